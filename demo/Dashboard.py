@@ -3,6 +3,21 @@
 Minimal placeholder dashboard for CI.
 The real Streamlit dashboard is run locally, not in tests.
 """
+import os, time
+
+TSDB_DIR = os.getenv("TSDB_DIR", "logs/tsdb")
+
+def speed_history(vehicle="car-01", minutes=60, max_points=600, topic="speed", root=TSDB_DIR):
+    """Speed chart rows (ts, min, max, mean, count) for the last `minutes`, straight from the
+    telemetry store's rollups; never loads the raw samples into pandas."""
+    from tsdb import TelemetryStore, to_rows
+    end = int(time.time() * 1000)
+    store = TelemetryStore(root, readonly=True)
+    try:
+        result = store.query(vehicle, topic, end - minutes * 60_000, end, max_points=max_points)
+    except KeyError:
+        return []
+    return to_rows(result)
 
 def main():
     # No Streamlit, no long-running loops; just a stub.
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import json
+import operator
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+import uuri
+
+
+NO_ALERT = np.iinfo(np.int64).min // 2  # "never alerted"; far enough from 0 to pass any debounce
+TS_MIN, TS_MAX = 0, np.iinfo(np.int64).max // 2  # sample timestamps outside this are garbage
+
+_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+
+# ---------------- rules -----------------
+
+
+class Rule:
+    """Base class: a rule turns one micro-batch into a boolean "fires" mask."""
+
+    kind = "rule"
+
+    def __init__(self, name: str, field: str = "kmh", debounce_ms: int = 2000):
+        self.name = name
+        self.field = field
+        self.debounce_ms = debounce_ms
+
+    def describe(self) -> dict:
+        return {"rule": self.kind}
+
+    def mask(self, batch: "Batch", state: "VehicleState") -> np.ndarray:
+        raise NotImplementedError
+
+
+class ThresholdRule(Rule):
+    """value <op> threshold, e.g. kmh > 80."""
+
+    kind = "threshold"
+
+    def __init__(self, name: str, threshold: float, op: str = ">", **kw):
+        super().__init__(name, **kw)
+        if op not in _OPS:
+            raise ValueError(f"op must be one of {sorted(_OPS)}")
+        self.threshold, self.op = float(threshold), op
+
+    def describe(self) -> dict:
+        return {"rule": self.kind, "threshold": self.threshold, "op": self.op}
+
+    def mask(self, batch, state):
+        return _OPS[self.op](batch.value, self.threshold)
+
+
+class RateOfChangeRule(Rule):
+    """|value change| per second above a limit, against the vehicle's previous sample.
+
+    A sample not newer than its predecessor (out of order, or a repeated
+    timestamp) has no meaningful rate and never fires.
+    """
+
+    kind = "rate"
+
+    def __init__(self, name: str, max_per_s: float, **kw):
+        super().__init__(name, **kw)
+        self.max_per_s = float(max_per_s)
+
+    def describe(self) -> dict:
+        return {"rule": self.kind, "max_per_s": self.max_per_s}
+
+    def mask(self, batch, state):
+        dt = batch.ts - batch.prev_ts
+        newer = (batch.prev_ts >= 0) & (dt > 0)
+        rate = np.abs(batch.value - batch.prev_value) / (np.where(newer, dt, 1) / 1000.0)
+        return newer & (rate > self.max_per_s)
+
+
+class SustainedRule(Rule):
+    """value above a threshold continuously for at least window_ms."""
+
+    kind = "sustained"
+
+    def __init__(self, name: str, threshold: float, window_ms: int, **kw):
+        super().__init__(name, **kw)
+        self.threshold, self.window_ms = float(threshold), int(window_ms)
+        self.slot = -1  # column in VehicleState.above_since, assigned by the engine
+
+    def describe(self) -> dict:
+        return {"rule": self.kind, "threshold": self.threshold, "window_ms": self.window_ms}
+
+    def mask(self, batch, state):
+        above = batch.value > self.threshold
+        n = len(above)
+        carried = state.above_since[batch.idx, self.slot]  # run still open from the last batch
+        prev_above = np.empty(n, dtype=bool)
+        prev_above[1:] = above[:-1]
+        prev_above[batch.first] = carried[batch.first] >= 0
+        starts = above & ~prev_above
+        # anchors: where a run starts, or a vehicle's first sample continuing a carried run
+        anchors = starts | (above & batch.first)
+        anchor_ts = np.where(starts, batch.ts, carried)
+        last_anchor = np.maximum.accumulate(np.where(anchors, np.arange(n), 0))
+        since = np.where(above, anchor_ts[last_anchor], -1)
+        batch.scratch[self.slot] = since
+        return above & (batch.ts - since >= self.window_ms)
+
+
+RULE_KINDS = {c.kind: c for c in (ThresholdRule, RateOfChangeRule, SustainedRule)}
+
+
+def load_rules(spec: str | list) -> list[Rule]:
+    """Rules from JSON, e.g. [{"kind": "threshold", "name": "SPEED_ALERT", "threshold": 80}]."""
+    items = json.loads(spec) if isinstance(spec, str) else spec
+    rules = []
+    for item in items:
+        item = dict(item)
+        cls = RULE_KINDS[item.pop("kind")]
+        rules.append(cls(**item))
+    return rules
+
+
+# ---------------- per-vehicle state -----------------
+
+
+class VehicleState:
+    """Dense per-vehicle arrays; a vehicle key maps to a row index."""
+
+    def __init__(self, n_rules: int, n_sustained: int, capacity: int = 1024):
+        self.index: dict[str, int] = {}
+        self.keys: list[str] = []
+        self.last_value = np.full(capacity, np.nan)
+        self.last_ts = np.full(capacity, -1, dtype=np.int64)
+        self.last_alert = np.full((capacity, n_rules), NO_ALERT, dtype=np.int64)
+        self.above_since = np.full((capacity, max(n_sustained, 1)), -1, dtype=np.int64)
+
+    def rows(self, keys: Iterable[str]) -> np.ndarray:
+        index = self.index
+        out = []
+        for key in keys:
+            row = index.get(key)
+            if row is None:
+                row = index[key] = len(self.keys)
+                self.keys.append(key)
+            out.append(row)
+        if len(self.keys) > len(self.last_ts):
+            self._grow(len(self.keys))
+        return np.asarray(out, dtype=np.int64)
+
+    def _grow(self, need: int) -> None:
+        cap = len(self.last_ts)
+        while cap < need:
+            cap *= 2
+
+        def grow(a, fill):
+            b = np.full((cap,) + a.shape[1:], fill, dtype=a.dtype)
+            b[: len(a)] = a
+            return b
+
+        self.last_value = grow(self.last_value, np.nan)
+        self.last_ts = grow(self.last_ts, -1)
+        self.last_alert = grow(self.last_alert, NO_ALERT)
+        self.above_since = grow(self.above_since, -1)
+
+
+class Batch:
+    """One micro-batch, sorted by (vehicle, time), with each sample's predecessor.
+
+    Samples not newer than the vehicle's stored one arrived out of order: they
+    get no predecessor (prev_ts -1) and are skipped as one.
+    """
+
+    def __init__(self, idx, value, ts, state: VehicleState, n_sustained: int):
+        order = np.lexsort((ts, idx))
+        self.order = order
+        self.idx, self.value, self.ts = idx[order], value[order], ts[order]
+        n = len(self.idx)
+        self.first = np.ones(n, dtype=bool)
+        self.first[1:] = self.idx[1:] != self.idx[:-1]
+        self.last = np.ones(n, dtype=bool)
+        self.last[:-1] = self.idx[:-1] != self.idx[1:]
+        live = np.flatnonzero(self.ts > state.last_ts[self.idx])
+        idx, ts, value = self.idx[live], self.ts[live], self.value[live]
+        first = np.ones(len(live), dtype=bool)
+        first[1:] = idx[1:] != idx[:-1]
+        self.prev_value = np.full(n, np.nan)
+        self.prev_value[live[1:]] = value[:-1]
+        self.prev_value[live[first]] = state.last_value[idx[first]]
+        self.prev_ts = np.full(n, -1, dtype=np.int64)
+        self.prev_ts[live[1:]] = ts[:-1]
+        self.prev_ts[live[first]] = state.last_ts[idx[first]]
+        self.scratch: list = [None] * n_sustained
+
+
+# ---------------- engine -----------------
+
+
+def vehicle_key(evt: dict) -> str:
+    """Authority of the event source (car-01, ...), or the raw source string."""
+    src = evt.get("source") or ""
+    if not isinstance(src, str):
+        return ""
+    try:
+        return uuri.parse(src).authority
+    except ValueError:
+        return src
+
+
+class FieldEngine:
+    """All rules that read the same payload field, with their own per-vehicle state."""
+
+    def __init__(self, field: str, rules: list[Rule], capacity: int = 1024):
+        self.field = field
+        self.rules = rules
+        sustained = [r for r in rules if isinstance(r, SustainedRule)]
+        for slot, r in enumerate(sustained):
+            r.slot = slot
+        self.n_sustained = len(sustained)
+        self.state = VehicleState(len(rules), self.n_sustained, capacity)
+
+    def evaluate(self, events: list[dict], now_ms: int) -> list[dict]:
+        field = self.field
+        keep, values, stamps = [], [], []
+        for i, evt in enumerate(events):
+            p, src = evt.get("payload"), evt.get("source")
+            if not isinstance(p, dict) or field not in p:
+                continue
+            if src is not None and not isinstance(src, str):  # no vehicle to key state by
+                continue
+            try:  # a sample that isn't a number is masked out, not fatal to the batch
+                v, t = float(p[field]), int(p.get("timestamp_ms", now_ms))
+            except (TypeError, ValueError, OverflowError):
+                continue
+            if not TS_MIN <= t <= TS_MAX:
+                continue
+            keep.append(i)
+            values.append(v)
+            stamps.append(t)
+        if not keep:
+            return []
+        state = self.state
+        idx = state.rows(vehicle_key(events[i]) for i in keep)
+        value = np.asarray(values, dtype=np.float64)
+        ts = np.asarray(stamps, dtype=np.int64)
+        batch = Batch(idx, value, ts, state, self.n_sustained)
+
+        alerts = []
+        for col, rule in enumerate(self.rules):
+            hits = np.flatnonzero(rule.mask(batch, state))
+            if not len(hits):
+                continue
+            # earliest qualifying sample per vehicle, then per-vehicle debounce
+            rows, first_hit = np.unique(batch.idx[hits], return_index=True)
+            hits = hits[first_hit]
+            ok = batch.ts[hits] - state.last_alert[rows, col] >= rule.debounce_ms
+            for pos in hits[ok]:
+                evt = events[keep[batch.order[pos]]]
+                alerts.append({
+                    "type": rule.name,
+                    **rule.describe(),
+                    "vehicle": state.keys[batch.idx[pos]],
+                    field: float(batch.value[pos]),
+                    "timestamp_ms": now_ms,
+                    "event_ts_ms": int(batch.ts[pos]),
+                    "source": evt.get("target"),
+                })
+            state.last_alert[rows[ok], col] = batch.ts[hits[ok]]
+
+        # roll per-vehicle state forward to each vehicle's newest sample (never back in time)
+        last = batch.last
+        rows = batch.idx[last]
+        newer = batch.ts[last] > state.last_ts[rows]
+        state.last_value[rows[newer]] = batch.value[last][newer]
+        state.last_ts[rows[newer]] = batch.ts[last][newer]
+        for slot, since in enumerate(batch.scratch):
+            state.above_since[rows, slot] = since[last]
+        return alerts
+
+
+class AlertEngine:
+    """Evaluate many rules over many vehicles, one micro-batch of events at a time.
+
+    Rules run as NumPy array expressions over the whole batch. State (last
+    sample, run start, last alert) is kept per vehicle and per rule, so one
+    car's alert never debounces another's. Within a batch, each rule fires
+    at most once per vehicle (its earliest qualifying sample).
+    """
+
+    def __init__(self, rules: list[Rule], capacity: int = 1024):
+        self.rules = rules
+        by_field: dict[str, list[Rule]] = {}
+        for r in rules:
+            by_field.setdefault(r.field, []).append(r)
+        self.engines = [FieldEngine(f, rs, capacity) for f, rs in by_field.items()]
+
+    def evaluate(self, events: list[dict], now_ms: Optional[int] = None) -> list[dict]:
+        if not events:
+            return []
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        return [a for engine in self.engines for a in engine.evaluate(events, now_ms)]
+
+    @property
+    def vehicles(self) -> int:
+        return max((len(e.state.keys) for e in self.engines), default=0)
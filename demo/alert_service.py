@@ -1,58 +1,87 @@
 # demo/alert_service.py
 import os, time
-from common import udp_bind, udp_recv_json, udp_send_json, epoch_ms
+from common import QosReceiver, notify_ready, udp_subscribe, udp_send_json, epoch_ms
+from bulk_io import recv_one
+from alert_rules import AlertEngine, ThresholdRule, load_rules
+import metrics
 import socket
 
 IN_HOST = os.getenv("ALERT_IN_HOST", "127.0.0.1")
 IN_PORT = int(os.getenv("ALERT_IN_PORT", "50052"))    # same as telemetry port
+TOPIC = os.getenv("ALERT_TOPIC", "up://*/vehicle.telemetry/speed?v=1")  # used with DEMO_BROKER
 OUT_HOST = os.getenv("ALERT_OUT_HOST", "127.0.0.1")
 OUT_PORT = int(os.getenv("ALERT_OUT_PORT", "50053"))  # alert topic port
 
 THRESH = float(os.getenv("SPEED_THRESHOLD", "80"))
 DEBOUNCE_MS = int(os.getenv("ALERT_DEBOUNCE_MS", "2000"))
 BOUND_TIMEOUT = float(os.getenv("ALERT_TIMEOUT", "0"))  # 0 => run forever
+# JSON rule list (see alert_rules.load_rules); default is the single speed threshold
+RULES = os.getenv("ALERT_RULES", "")
 
-def main():
-    sub = udp_bind(IN_HOST, IN_PORT, None if BOUND_TIMEOUT == 0 else BOUND_TIMEOUT)
+log = metrics.Log("alert")
+EVENTS = metrics.counter("alert.events")
+ALERTS = metrics.counter("alert.alerts")
+EVAL_US = metrics.histogram("alert.evaluate_us")        # per micro-batch
+AGE_US = metrics.histogram("alert.receive_to_dispatch_us")  # envelope ts_ms -> evaluated
+
+def build_engine() -> AlertEngine:
+    if RULES:
+        return AlertEngine(load_rules(RULES))
+    return AlertEngine([ThresholdRule("SPEED_ALERT", THRESH, debounce_ms=DEBOUNCE_MS)])
+
+def serve(sub: socket.socket, engine: AlertEngine | None = None) -> None:
+    """Evaluate everything `sub` receives, forever, emitting alerts to OUT_HOST:OUT_PORT."""
+    engine = engine or build_engine()
     pub = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    last_alert_ms = 0
+    rx = QosReceiver(sub)
+    metrics.gauge("alert.vehicles", lambda: engine.vehicles)
+    metrics.gauge("alert.receiver", lambda: dict(rx.stats))
+    try:
+        while True:
+            # everything queued since the last wakeup is one micro-batch
+            for alert in evaluate(engine, rx.recv_batch()):
+                emit(pub, alert)
+    finally:
+        pub.close()
+
+def evaluate(engine: AlertEngine, batch: list[dict]) -> list[dict]:
+    """Alerts raised by one micro-batch of events (also used by service_host)."""
+    EVENTS.inc(len(batch))
+    with EVAL_US.time():
+        alerts = engine.evaluate(batch, epoch_ms())
+    for evt in batch:
+        age = metrics.since_ms_us(evt.get("ts_ms"))
+        if age is not None:
+            AGE_US.record(age)
+    return alerts
+
+def emit(pub: socket.socket, alert: dict) -> None:
+    udp_send_json(pub, (OUT_HOST, OUT_PORT), alert)
+    ALERTS.inc()
+    log.sampled(alert["type"], "emitted: %s", alert)
+
+def main():
+    sub = udp_subscribe(TOPIC, IN_HOST, IN_PORT, None if BOUND_TIMEOUT == 0 else BOUND_TIMEOUT)
+    engine = build_engine()
+    notify_ready("alert_service")
     try:
         if BOUND_TIMEOUT == 0:
-            print(f"[alert] listening udp://{IN_HOST}:{IN_PORT}, emitting to {OUT_HOST}:{OUT_PORT}", flush=True)
-            while True:
-                evt = udp_recv_json(sub)
-                kmh = float(evt.get("payload", {}).get("kmh", 0))
-                now = epoch_ms()
-                if kmh > THRESH and (now - last_alert_ms) >= DEBOUNCE_MS:
-                    last_alert_ms = now
-                    alert = {
-                        "type": "SPEED_ALERT",
-                        "kmh": kmh,
-                        "threshold": THRESH,
-                        "timestamp_ms": now,
-                        "source": "up://car-01/vehicle.telemetry/speed?v=1"
-                    }
-                    udp_send_json(pub, (OUT_HOST, OUT_PORT), alert)
-                    print("[alert] emitted:", alert, flush=True)
+            metrics.start_exporters("alert_service")
+            print(f"[alert] listening udp://{IN_HOST}:{IN_PORT}, emitting to {OUT_HOST}:{OUT_PORT}, "
+                  f"{len(engine.rules)} rule(s)", flush=True)
+            serve(sub, engine)
         else:
             # bounded: process one message and exit
-            evt = udp_recv_json(sub)
-            kmh = float(evt.get("payload", {}).get("kmh", 0))
-            now = epoch_ms()
-            if kmh > THRESH:
-                alert = {
-                    "type": "SPEED_ALERT",
-                    "kmh": kmh,
-                    "threshold": THRESH,
-                    "timestamp_ms": now,
-                    "source": "up://car-01/vehicle.telemetry/speed?v=1"
-                }
-                udp_send_json(pub, (OUT_HOST, OUT_PORT), alert)
-                print("[alert] emitted (bounded):", alert, flush=True)
+            pub = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            with pub:
+                evt = recv_one(sub)
+                for alert in engine.evaluate([evt], epoch_ms()):
+                    udp_send_json(pub, (OUT_HOST, OUT_PORT), alert)
+                    print("[alert] emitted (bounded):", alert, flush=True)
     except Exception as e:
         print("[alert] end:", repr(e), flush=True)
     finally:
-        sub.close(); pub.close()
+        sub.close()
 
 if __name__ == "__main__":
     main()
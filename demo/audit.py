@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+FSYNC_POLICIES = ("never", "batch", "interval")
+_WAIT_SLICE_S = 0.1  # blocked callers re-check that the writer thread is alive this often
+
+
+def epoch_ms() -> int:
+    """Return current time in milliseconds since epoch."""
+    return int(time.time() * 1000)
+
+
+def rotated_name(path: Path, ts_ms: int) -> Path:
+    """Name a rotated segment: audit.jsonl -> audit.jsonl.<ts_ms>."""
+    candidate = path.with_name(f"{path.name}.{ts_ms}")
+    n = 1
+    while candidate.exists():
+        candidate = path.with_name(f"{path.name}.{ts_ms}-{n}")
+        n += 1
+    return candidate
+
+
+def segment_paths(log_path: Path) -> list[Path]:
+    """Rotated segments oldest first (audit.jsonl.<ts_ms>[-n]), then the live file."""
+    def order(p: Path):
+        stamp, _, n = p.name[len(log_path.name) + 1:].partition("-")
+        return (int(stamp) if stamp.isdigit() else 0, int(n) if n.isdigit() else 0, p.name)
+
+    rotated = sorted(log_path.parent.glob(log_path.name + ".*"), key=order)
+    return [p for p in rotated if p.is_file()] + ([log_path] if log_path.is_file() else [])
+
+
+def _slice(deadline: Optional[float]) -> float:
+    """How long a blocked caller waits before re-checking the writer thread."""
+    if deadline is None:
+        return _WAIT_SLICE_S
+    return max(0.0, min(_WAIT_SLICE_S, deadline - time.monotonic()))
+
+
+class AuditWriter:
+    """Append JSON lines from a background thread, group-committing batches.
+
+    One file handle stays open. Entries queue up and are written in batches of
+    up to ``batch_size`` or every ``flush_interval_s``, whichever comes first.
+    ``fsync`` is "never" (leave it to the OS), "batch" (after every group
+    commit) or "interval" (at most every ``fsync_interval_s``). A full queue
+    blocks ``write()`` callers, which is the backpressure. The file is rotated
+    to ``<name>.<ts_ms>`` once it reaches ``rotate_bytes`` or has been open
+    for ``rotate_interval_s`` (0 disables either trigger).
+
+    A batch that cannot be written (an entry json can't encode, a full disk)
+    is dropped and counted in ``stats``; the writer carries on with a fresh
+    file handle. Should the thread die anyway, ``write()`` and ``flush()``
+    raise instead of waiting on it.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        batch_size: int = 256,
+        flush_interval_s: float = 0.05,
+        queue_size: int = 10000,
+        fsync: str = "never",
+        fsync_interval_s: float = 1.0,
+        rotate_bytes: int = 0,
+        rotate_interval_s: float = 0,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.fsync = fsync
+        self.fsync_interval_s = fsync_interval_s
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval_s = rotate_interval_s
+        self.stats = {"written": 0, "batches": 0, "dropped": 0, "rotations": 0, "failed": 0, "io_errors": 0}
+        self._stats_lock = threading.Lock()  # "dropped" is counted on caller threads
+
+        self._q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._f = None
+        self._opened_at = 0.0
+        self._last_fsync = 0.0
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    # ---------------- producer side -----------------
+
+    def write(self, entry: dict, timeout: Optional[float] = None) -> bool:
+        """Queue an entry, blocking while the queue is full. False if it timed out."""
+        if self._closed:
+            raise RuntimeError("audit writer is closed")
+        entry.setdefault("ts_ms", epoch_ms())
+        try:
+            self._put(entry, timeout)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.stats["dropped"] += 1
+            return False
+
+    def try_write(self, entry: dict) -> bool:
+        """Queue an entry only if there is room right now."""
+        if self._closed:
+            raise RuntimeError("audit writer is closed")
+        entry.setdefault("ts_ms", epoch_ms())
+        try:
+            self._q.put_nowait(entry)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is written (and fsynced if policy says so)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._put(done, timeout)
+        except queue.Full:
+            return False
+        while not done.wait(_slice(deadline)):
+            self._check_alive()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            try:
+                self._put(None, timeout)
+            except (queue.Full, RuntimeError):
+                return
+        self._thread.join(timeout)
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def _check_alive(self) -> None:
+        if not self._thread.is_alive():
+            raise RuntimeError("audit writer thread has stopped")
+
+    def _put(self, item, timeout: Optional[float]) -> None:
+        """Queue.put that gives up (RuntimeError) if the writer thread is gone."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._check_alive()
+            try:
+                self._q.put(item, timeout=_slice(deadline))
+                return
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    # ---------------- writer thread -----------------
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.path.open("ab")
+        self._opened_at = time.monotonic()
+
+    def _drop_file(self) -> None:
+        f, self._f = self._f, None
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def _io_error(self) -> None:
+        # give up on the handle and whatever it still buffers; the next batch reopens the file
+        self.stats["io_errors"] += 1
+        self._drop_file()
+
+    def _rotate_due(self) -> bool:
+        if self.rotate_bytes and self._f.tell() >= self.rotate_bytes:
+            return True
+        if self.rotate_interval_s and time.monotonic() - self._opened_at >= self.rotate_interval_s:
+            return self._f.tell() > 0
+        return False
+
+    def _rotate(self) -> None:
+        self._sync(force=self.fsync != "never")
+        self._f.close()
+        os.replace(self.path, rotated_name(self.path, epoch_ms()))
+        self.stats["rotations"] += 1
+        self._open()
+
+    def _sync(self, force: bool = False) -> None:
+        self._f.flush()
+        now = time.monotonic()
+        if force or self.fsync == "batch" or (
+            self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval_s
+        ):
+            os.fsync(self._f.fileno())
+            self._last_fsync = now
+
+    def _commit(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        lines = []
+        for e in batch:
+            try:
+                lines.append(json.dumps(e).encode("utf-8") + b"\n")
+            except (TypeError, ValueError):  # not JSON-serializable
+                self.stats["failed"] += 1
+        batch.clear()
+        if not lines:
+            return
+        try:
+            if self._f is None:
+                self._open()
+            self._f.write(b"".join(lines))
+            self._sync()
+        except OSError:  # e.g. ENOSPC: the batch is lost, the writer is not
+            self.stats["failed"] += len(lines)
+            self._io_error()
+            return
+        self.stats["written"] += len(lines)
+        self.stats["batches"] += 1
+        try:
+            if self._rotate_due():
+                self._rotate()
+        except OSError:
+            self._io_error()
+
+    def _sync_now(self) -> None:
+        if self._f is None:
+            return
+        try:
+            self._sync(force=self.fsync != "never")
+        except OSError:
+            self._io_error()
+
+    def _run(self) -> None:
+        try:
+            self._open()
+        except OSError:
+            self._io_error()  # retried by the first batch
+        batch: list[dict] = []
+        stop = False
+        try:
+            while not stop:
+                item = self._q.get()
+                deadline = time.monotonic() + self.flush_interval_s
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    if isinstance(item, threading.Event):
+                        self._commit(batch)
+                        self._sync_now()
+                        item.set()
+                    else:
+                        batch.append(item)
+                        if len(batch) >= self.batch_size:
+                            break
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                self._commit(batch)
+        finally:
+            self._commit(batch)
+            self._sync_now()
+            self._drop_file()
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from audit import segment_paths
+
+
+# Sidecars live in a hidden directory next to the log (".audit.jsonl.idx/"), so
+# they never match the "audit.jsonl.*" rotation glob that readers scan:
+#
+#   manifest.json       per-segment state, keyed by inode (survives rotation renames)
+#   <ino>.cid           (hash64(correlation_id), offset) rows; sorted once the segment is sealed
+#   <ino>.ts            sparse time index: one (offset, min ts, max ts) row per block of lines
+#
+# The active segment's .cid file is append-only and scanned; rotated segments
+# never change again, so their .cid is sorted and binary-searched.
+
+CID_DTYPE = np.dtype([("h", "<u8"), ("off", "<u8")])
+TS_DTYPE = np.dtype([("off", "<u8"), ("min", "<i8"), ("max", "<i8")])
+BLOCK_LINES = 256
+READ_CHUNK = 1 << 20
+
+
+def cid_hash(correlation_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(correlation_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class AuditIndex:
+    """Incrementally maintained lookup index over an audit log and its rotated segments.
+
+    ``update()`` indexes only bytes appended since the previous call (complete
+    lines only); queries call it first, so results always include the newest
+    entries. Records are read back with a seek and streamed lazily.
+    """
+
+    def __init__(self, log_path: str | os.PathLike, index_dir: Optional[str | os.PathLike] = None,
+                 block_lines: int = BLOCK_LINES):
+        self.log_path = Path(log_path)
+        self.dir = Path(index_dir) if index_dir else self.log_path.with_name(f".{self.log_path.name}.idx")
+        self.block_lines = block_lines
+        self.manifest_path = self.dir / "manifest.json"
+        self.segments: dict[str, dict] = {}  # str(ino) -> state
+        if self.manifest_path.exists():
+            try:
+                self.segments = json.loads(self.manifest_path.read_text())["segments"]
+            except (ValueError, KeyError):
+                self.segments = {}
+
+    # ---------------- maintenance -----------------
+
+    def _save(self) -> None:
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"log": str(self.log_path), "segments": self.segments}))
+        os.replace(tmp, self.manifest_path)
+
+    def _sidecar(self, ino: str, ext: str) -> Path:
+        return self.dir / f"{ino}.{ext}"
+
+    def update(self) -> int:
+        """Index new bytes in every segment; returns the number of records added."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        added, live = 0, set()
+        for path in segment_paths(self.log_path):
+            try:
+                st = path.stat()
+            except FileNotFoundError:  # rotated or removed between glob and stat
+                continue
+            ino = str(st.st_ino)
+            live.add(ino)
+            seg = self.segments.get(ino)
+            if seg is None or st.st_size < seg["offset"]:  # new, or truncated and rewritten
+                for ext in ("cid", "ts"):
+                    self._sidecar(ino, ext).unlink(missing_ok=True)
+                seg = self.segments[ino] = {"name": path.name, "offset": 0, "records": 0, "sorted": False,
+                                            "min_ts": None, "max_ts": None,
+                                            "block_off": 0, "block_n": 0, "block_min": None, "block_max": None}
+            seg["name"] = path.name
+            if st.st_size > seg["offset"]:
+                added += self._index_tail(path, ino, seg)
+            if path != self.log_path and not seg["sorted"]:
+                self._seal(ino, seg)
+        for ino in set(self.segments) - live:  # segment deleted by retention
+            for ext in ("cid", "ts"):
+                self._sidecar(ino, ext).unlink(missing_ok=True)
+            del self.segments[ino]
+        self._save()
+        return added
+
+    def _index_tail(self, path: Path, ino: str, seg: dict) -> int:
+        cids, blocks = [], []
+        with open(path, "rb") as f:
+            f.seek(seg["offset"])
+            off = seg["offset"]
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                end = chunk.rfind(b"\n")
+                if end < 0:  # a line longer than a chunk: read on until it ends
+                    parts, size = [chunk], len(chunk)
+                    while end < 0:
+                        more = f.read(READ_CHUNK)
+                        if not more:
+                            break
+                        i = more.rfind(b"\n")
+                        if i >= 0:
+                            end = size + i
+                        parts.append(more)
+                        size += len(more)
+                    chunk = b"".join(parts)
+                if end < 0:
+                    break  # partial line: wait for the writer to finish it
+                f.seek(off + end + 1)
+                pos = 0
+                for line in chunk[: end + 1].splitlines(keepends=True):
+                    line_off = off + pos
+                    pos += len(line)
+                    try:
+                        obj = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not isinstance(obj, dict):
+                        continue
+                    cid = obj.get("correlation_id")
+                    if cid:
+                        cids.append((cid_hash(str(cid)), line_off))
+                    ts = obj.get("ts_ms")
+                    if isinstance(ts, int):
+                        seg["min_ts"] = ts if seg["min_ts"] is None else min(seg["min_ts"], ts)
+                        seg["max_ts"] = ts if seg["max_ts"] is None else max(seg["max_ts"], ts)
+                        seg["block_min"] = ts if seg["block_min"] is None else min(seg["block_min"], ts)
+                        seg["block_max"] = ts if seg["block_max"] is None else max(seg["block_max"], ts)
+                    seg["block_n"] += 1
+                    if seg["block_n"] >= self.block_lines:
+                        if seg["block_min"] is not None:
+                            blocks.append((seg["block_off"], seg["block_min"], seg["block_max"]))
+                        seg.update(block_off=off + pos, block_n=0, block_min=None, block_max=None)
+                off += end + 1
+        with open(self._sidecar(ino, "cid"), "ab") as f:
+            f.write(np.array(cids, dtype=CID_DTYPE).tobytes())
+        with open(self._sidecar(ino, "ts"), "ab") as f:
+            f.write(np.array(blocks, dtype=TS_DTYPE).tobytes())
+        seg["records"] += len(cids)
+        seg["offset"] = off
+        seg["sorted"] = seg["sorted"] and not cids
+        return len(cids)
+
+    def _seal(self, ino: str, seg: dict) -> None:
+        rows = self._load(ino, "cid", CID_DTYPE)
+        path = self._sidecar(ino, "cid")
+        tmp = path.with_suffix(".tmp")
+        np.sort(rows, order=("h", "off")).tofile(tmp)
+        os.replace(tmp, path)
+        seg["sorted"] = True
+
+    def _load(self, ino: str, ext: str, dtype: np.dtype) -> np.ndarray:
+        path = self._sidecar(ino, ext)
+        if not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def _ordered(self) -> list[tuple[str, dict]]:
+        names = {p.name: i for i, p in enumerate(segment_paths(self.log_path))}
+        return sorted(((ino, s) for ino, s in self.segments.items() if s["name"] in names),
+                      key=lambda kv: names[kv[1]["name"]])
+
+    # ---------------- queries -----------------
+
+    def lookup(self, correlation_id: str, refresh: bool = True) -> Iterator[dict]:
+        """Every record with this correlation_id, oldest segment first."""
+        if refresh:
+            self.update()
+        h = np.uint64(cid_hash(correlation_id))
+        for ino, seg in self._ordered():
+            rows = self._load(ino, "cid", CID_DTYPE)
+            if not len(rows):
+                continue
+            if seg["sorted"]:
+                col = rows["h"]
+                offs = rows["off"][np.searchsorted(col, h, "left"): np.searchsorted(col, h, "right")]
+            else:
+                offs = rows["off"][rows["h"] == h]
+            if not len(offs):
+                continue
+            with open(self.log_path.with_name(seg["name"]), "rb") as f:
+                for off in offs:
+                    f.seek(int(off))
+                    obj = json.loads(f.readline())
+                    if obj.get("correlation_id") == correlation_id:  # guard against hash collisions
+                        yield obj
+
+    def range(self, start_ms: int, end_ms: int, method: Optional[str] = None,
+              refresh: bool = True) -> Iterator[dict]:
+        """Records with start_ms <= ts_ms < end_ms (optionally of one method), in file order."""
+        if refresh:
+            self.update()
+        for ino, seg in self._ordered():
+            if seg["min_ts"] is None or seg["max_ts"] < start_ms or seg["min_ts"] >= end_ms:
+                continue
+            blocks = self._load(ino, "ts", TS_DTYPE)
+            spans = [(int(b["off"]), int(blocks["off"][i + 1]) if i + 1 < len(blocks) else seg["block_off"])
+                     for i, b in enumerate(blocks) if b["max"] >= start_ms and b["min"] < end_ms]
+            spans.append((seg["block_off"], seg["offset"]))  # open block: not summarised yet
+            with open(self.log_path.with_name(seg["name"]), "rb") as f:
+                for lo, hi in spans:
+                    if hi <= lo:
+                        continue
+                    f.seek(lo)
+                    for line in f.read(hi - lo).splitlines():
+                        try:
+                            obj = json.loads(line)
+                        except ValueError:
+                            continue
+                        ts = obj.get("ts_ms")
+                        if not isinstance(ts, int) or not start_ms <= ts < end_ms:
+                            continue
+                        if method is not None and obj.get("request", {}).get("method") != method:
+                            continue
+                        yield obj
+
+    def stats(self) -> dict:
+        return {
+            "segments": len(self.segments),
+            "records": sum(s["records"] for s in self.segments.values()),
+            "bytes_indexed": sum(s["offset"] for s in self.segments.values()),
+        }
+
+
+# ---------------- CLI -----------------
+
+
+def _parse_ts(text: str) -> int:
+    """Epoch ms, or an ISO-8601 timestamp (local time unless it has an offset)."""
+    if text.isdigit():
+        return int(text)
+    from datetime import datetime
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Indexed lookups over the RPC audit log.")
+    ap.add_argument("--log", default=os.getenv("AUDIT_PATH", "logs/audit.jsonl"), help="live audit log path")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("update", help="index new entries and print index stats")
+    by_id = sub.add_parser("id", help="records for a correlation_id")
+    by_id.add_argument("correlation_id")
+    by_time = sub.add_parser("range", help="records in [since, until)")
+    by_time.add_argument("--since", required=True, help="epoch ms or ISO-8601")
+    by_time.add_argument("--until", default=None, help="epoch ms or ISO-8601 (default: now)")
+    by_time.add_argument("--method", default=None, help="only this RPC method, e.g. lock")
+    by_time.add_argument("--limit", type=int, default=0, help="stop after N records")
+    args = ap.parse_args(argv)
+
+    index = AuditIndex(args.log)
+    if args.cmd == "update":
+        added = index.update()
+        print(json.dumps({"added": added, **index.stats()}))
+        return 0
+    if args.cmd == "id":
+        records = index.lookup(args.correlation_id)
+    else:
+        import time
+        until = _parse_ts(args.until) if args.until else int(time.time() * 1000) + 1
+        records = index.range(_parse_ts(args.since), until, args.method)
+    found = 0
+    for obj in records:
+        sys.stdout.write(json.dumps(obj) + "\n")
+        found += 1
+        if args.cmd == "range" and args.limit and found >= args.limit:
+            break
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+# demo/bench_codec.py
+"""
+Compare wire codecs: bytes per message and encode/decode throughput.
+
+    python demo/bench_codec.py [--n 200000] [--json results.json]
+"""
+import argparse, json, time
+
+import codec
+from simulate_messages import uevent, urequest, uresponse, uuri_str
+
+
+def sample_messages() -> dict:
+    speed = uevent(uuri_str("car-01", "vehicle.telemetry", "/speed"),
+                   {"kmh": 72, "timestamp_ms": int(time.time() * 1000)})
+    req = urequest(uuri_str("car-01", "body.control", "/doors/lock"), {"lock": True})
+    resp = uresponse(req["id"], req["source"], {"code": "OK", "message": "Doors locked"}, {"success": True})
+    return {"event": speed, "request": req, "response": resp}
+
+
+def ops_per_s(fn, arg, n: int) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    return n / (time.perf_counter() - started)
+
+
+def run(n: int) -> list[dict]:
+    rows = []
+    for kind, msg in sample_messages().items():
+        for c in (codec.JSON, codec.BINARY):
+            wire = c.encode(msg)
+            rows.append({
+                "message": kind,
+                "codec": c.content_type,
+                "bytes": len(wire),
+                "encode_per_s": round(ops_per_s(c.encode, msg, n)),
+                "decode_per_s": round(ops_per_s(c.decode, wire, n)),
+            })
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--n", type=int, default=200_000, help="iterations per measurement")
+    ap.add_argument("--json", help="also write the rows to this file")
+    args = ap.parse_args()
+
+    rows = run(args.n)
+    print(f"{'message':<10} {'codec':<30} {'bytes':>6} {'encode/s':>11} {'decode/s':>11}")
+    for r in rows:
+        print(f"{r['message']:<10} {r['codec']:<30} {r['bytes']:>6} {r['encode_per_s']:>11,} {r['decode_per_s']:>11,}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# demo/bench_suite.py
+"""
+End-to-end benchmark: pub/sub through the broker and RPC against rpc_server.
+
+Launches a broker, the selected services and publisher processes on a
+private port range, measures throughput, end-to-end latency percentiles
+(from the timestamp embedded in each event), loss and CPU per message,
+then writes the results as JSON so runs can be compared.
+
+    python demo/bench_suite.py --rate 5000 --duration 5 --size 128
+    python demo/bench_suite.py --compare bench_results/<earlier>.json
+"""
+import argparse, json, multiprocessing as mp, os, platform, socket, subprocess, sys, tempfile, threading, time
+from pathlib import Path
+
+DEMO = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEMO))
+
+import codec
+from bulk_io import BatchSender, BulkReceiver
+from rpc_client import RpcPool
+
+SERVICES = {
+    "sub": "sub_telemetry.py",
+    "alert": "alert_service.py",
+    "summary": "status_summary.py",
+}
+SPEED_TOPIC = "up://{car}/vehicle.telemetry/speed?v=1"
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+# ---------------- helpers -----------------
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"p50": None, "p99": None, "p99_9": None, "max": None}
+    s = sorted(samples)
+
+    def pick(q):
+        return round(s[min(len(s) - 1, int(q * len(s)))], 3)
+
+    return {"p50": pick(0.50), "p99": pick(0.99), "p99_9": pick(0.999), "max": round(s[-1], 3)}
+
+
+def proc_cpu_s(pid: int) -> float | None:
+    """utime+stime of a process from /proc (Linux); None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def self_cpu_s() -> float:
+    t = os.times()
+    return t.user + t.system
+
+
+def git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DEMO, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ---------------- publisher processes -----------------
+
+
+def publisher(addr, rate: float, duration_s: float, size: int, vehicles: int, content_type: str,
+              worker: int, sent):
+    """Paced publisher: `rate` msgs/s for `duration_s`, cycling over `vehicles` cars."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    out = BatchSender(sock, addr, max_bytes=16384, linger_ms=2)
+    pad = "x" * max(0, size - 64)
+    cars = [f"car-{worker:02d}-{i:04d}" for i in range(vehicles)]
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    n = 0
+    while True:
+        due = start + n * interval
+        now = time.perf_counter()
+        if now - start >= duration_s:
+            break
+        if due > now:
+            out.flush()
+            time.sleep(due - now)
+        car = cars[n % vehicles]
+        out.send({
+            "type": "EVENT",
+            "source": f"up://{car}/vehicle.telemetry/publisher?v=1",
+            "target": SPEED_TOPIC.format(car=car),
+            "content_type": content_type,
+            "payload": {"kmh": 40 + n % 80, "timestamp_ms": int(time.time() * 1000),
+                        "sent_ns": time.time_ns(), "pad": pad},
+            "qos": 0,
+            "ttl_ms": 2000,
+        })
+        n += 1
+    out.flush()
+    sent.value = n
+    sock.close()
+
+
+# ---------------- services -----------------
+
+
+def launch(script: str, env: dict, cwd: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, str(DEMO / script)], env={**os.environ, **env}, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop(procs: list) -> None:
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+class Sink:
+    """Bench-side subscriber that records end-to-end latency of every event it gets."""
+
+    def __init__(self, broker_addr, topic: str):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.2)
+        self.sock.sendto(json.dumps({"type": "SUBSCRIBE", "topic": topic, "lease_s": 3600}).encode(), broker_addr)
+        self.latencies_ms: list[float] = []
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        rx = BulkReceiver(self.sock, slots=256)
+        lat = self.latencies_ms
+        while not self._stop.is_set():
+            try:
+                batch = rx.recv_batch()
+            except socket.timeout:
+                continue
+            now_ns = time.time_ns()
+            for msg in batch:
+                p = msg.get("payload") or {}
+                if "sent_ns" in p:
+                    lat.append((now_ns - p["sent_ns"]) / 1e6)
+                elif "timestamp_ms" in p:
+                    lat.append(now_ns / 1e6 - p["timestamp_ms"])
+            self.received += len(batch)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sock.close()
+
+
+# ---------------- scenarios -----------------
+
+
+def bench_pubsub(args, ports: dict, workdir: str) -> dict:
+    broker_addr = ("127.0.0.1", ports["broker"])
+    env = {
+        "DEMO_BROKER": f"127.0.0.1:{ports['broker']}",
+        "BROKER_PORT": str(ports["broker"]), "BROKER_STATS_S": "0",
+        "ALERT_OUT_PORT": str(ports["alert_out"]), "SUM_OUT_PORT": str(ports["summary_out"]),
+        "SUM_AUDIT_PATH": str(Path(workdir) / "logs" / "audit.jsonl"),
+        "ALERT_TOPIC": "up://*/vehicle.telemetry/speed?v=1",
+        "SUM_SPEED_TOPIC": "up://*/vehicle.telemetry/speed?v=1",
+        "DEMO_SUB_TOPIC": "up://*/vehicle.telemetry/*",
+    }
+    procs = [launch("broker.py", env, workdir)]
+    time.sleep(0.3)
+    procs += [launch(SERVICES[name], env, workdir) for name in args.services]
+    sink = Sink(broker_addr, "up://*/vehicle.telemetry/*")
+    sink.start()
+    time.sleep(args.warmup)
+
+    cpu0 = {p.pid: proc_cpu_s(p.pid) for p in procs}
+    self0 = self_cpu_s()
+    ct = codec.CT_BINARY if args.codec == "binary" else codec.CT_JSON
+    sent = [mp.Value("q", 0) for _ in range(args.publishers)]
+    pubs = [mp.Process(target=publisher, args=(broker_addr, args.rate / args.publishers, args.duration,
+                                               args.size, args.vehicles, ct, i, sent[i]))
+            for i in range(args.publishers)]
+    started = time.perf_counter()
+    for p in pubs:
+        p.start()
+    for p in pubs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    time.sleep(args.drain)
+    sink.stop()
+    cpu1 = {p.pid: proc_cpu_s(p.pid) for p in procs}
+    self1 = self_cpu_s()
+    stop(procs)
+
+    total_sent = sum(v.value for v in sent)
+    received = sink.received
+    per_proc = {}
+    for p, name in zip(procs, ["broker", *args.services]):
+        if cpu0[p.pid] is not None and cpu1[p.pid] is not None:
+            per_proc[name] = round(cpu1[p.pid] - cpu0[p.pid], 3)
+    svc_cpu = sum(per_proc.values())
+    return {
+        "sent": total_sent,
+        "received": received,
+        "loss_rate": round(1 - received / total_sent, 5) if total_sent else None,
+        "throughput_msgs_s": round(received / elapsed, 1),
+        "latency_ms": percentiles(sink.latencies_ms),
+        "cpu_s": {**per_proc, "sink": round(self1 - self0, 3)},
+        "cpu_us_per_msg": round(svc_cpu / received * 1e6, 2) if received and per_proc else None,
+    }
+
+
+def bench_rpc(args, ports: dict, workdir: str) -> dict:
+    proc = launch("rpc_server.py", {"RPC_PORT": str(ports["rpc"])}, workdir)
+    time.sleep(args.warmup)
+    cpu0 = proc_cpu_s(proc.pid)
+    latencies: list[float] = []
+    errors = 0
+    gate = threading.Semaphore(args.rpc_concurrency)
+    lock = threading.Lock()
+    try:
+        with RpcPool("127.0.0.1", ports["rpc"], size=args.rpc_connections) as pool:
+            started = time.perf_counter()
+
+            def done(fut, t0):
+                nonlocal errors
+                ms = (time.perf_counter() - t0) * 1000
+                with lock:
+                    if fut.exception() is None:
+                        latencies.append(ms)
+                    else:
+                        errors += 1
+                gate.release()
+
+            for _ in range(args.rpc_calls):
+                gate.acquire()
+                t0 = time.perf_counter()
+                pool.submit("lock").add_done_callback(lambda f, t0=t0: done(f, t0))
+            for _ in range(args.rpc_concurrency):
+                gate.acquire()
+            elapsed = time.perf_counter() - started
+        cpu1 = proc_cpu_s(proc.pid)
+    finally:
+        stop([proc])
+    ok = len(latencies)
+    return {
+        "calls": args.rpc_calls,
+        "ok": ok,
+        "errors": errors,
+        "throughput_calls_s": round(ok / elapsed, 1),
+        "latency_ms": percentiles(latencies),
+        "cpu_us_per_call": round((cpu1 - cpu0) / ok * 1e6, 2) if ok and cpu0 is not None and cpu1 is not None else None,
+    }
+
+
+# ---------------- compare -----------------
+
+
+# metric path -> True if higher is better
+TRACKED = {
+    ("pubsub", "throughput_msgs_s"): True,
+    ("pubsub", "loss_rate"): False,
+    ("pubsub", "latency_ms", "p50"): False,
+    ("pubsub", "latency_ms", "p99"): False,
+    ("pubsub", "cpu_us_per_msg"): False,
+    ("rpc", "throughput_calls_s"): True,
+    ("rpc", "latency_ms", "p50"): False,
+    ("rpc", "latency_ms", "p99"): False,
+    ("rpc", "cpu_us_per_call"): False,
+}
+
+
+def _get(d: dict, path: tuple):
+    for k in path:
+        if not isinstance(d, dict) or k not in d:
+            return None
+        d = d[k]
+    return d
+
+
+def compare(old: dict, new: dict, tolerance: float) -> list[str]:
+    """Print a metric-by-metric diff; return the metrics that regressed beyond tolerance."""
+    regressions = []
+    for path, higher_better in TRACKED.items():
+        a, b = _get(old, path), _get(new, path)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a if a else (0.0 if b == a else float("inf"))
+        worse = -change if higher_better else change
+        name = ".".join(path)
+        flag = "REGRESSION" if worse > tolerance else ""
+        print(f"  {name:<32} {a:>12} -> {b:<12} {change:+.1%} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--scenarios", default="pubsub,rpc", help="comma list of pubsub,rpc")
+    ap.add_argument("--services", default="sub,alert,summary", help="services to run alongside (sub,alert,summary)")
+    ap.add_argument("--rate", type=float, default=2000, help="aggregate publish rate, msgs/s")
+    ap.add_argument("--duration", type=float, default=5, help="publish duration, seconds")
+    ap.add_argument("--size", type=int, default=128, help="approximate payload size, bytes")
+    ap.add_argument("--vehicles", type=int, default=10, help="vehicles per publisher")
+    ap.add_argument("--publishers", type=int, default=1, help="publisher processes")
+    ap.add_argument("--codec", choices=("json", "binary"), default="json")
+    ap.add_argument("--rpc-calls", type=int, default=2000)
+    ap.add_argument("--rpc-concurrency", type=int, default=32, help="requests in flight")
+    ap.add_argument("--rpc-connections", type=int, default=2)
+    ap.add_argument("--base-port", type=int, default=51000)
+    ap.add_argument("--warmup", type=float, default=1.0, help="seconds to let services bind")
+    ap.add_argument("--drain", type=float, default=1.0, help="seconds to wait for stragglers")
+    ap.add_argument("--out", default="bench_results", help="directory for result JSON")
+    ap.add_argument("--compare", help="earlier result JSON to diff against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = ap.parse_args()
+    args.services = [s for s in args.services.split(",") if s]
+    scenarios = [s for s in args.scenarios.split(",") if s]
+
+    ports = {"broker": args.base_port, "alert_out": args.base_port + 1,
+             "summary_out": args.base_port + 2, "rpc": args.base_port + 3}
+    result = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_rev(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "cpus": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        }
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        if "pubsub" in scenarios:
+            result["pubsub"] = bench_pubsub(args, ports, workdir)
+            print("[bench] pubsub:", json.dumps(result["pubsub"]), flush=True)
+        if "rpc" in scenarios:
+            result["rpc"] = bench_rpc(args, ports, workdir)
+            print("[bench] rpc:", json.dumps(result["rpc"]), flush=True)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"[bench] wrote {path}", flush=True)
+
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"[bench] compared with {args.compare}:")
+        if compare(old, result, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# demo/broker.py
+"""
+Local pub/sub broker: publishers send once, the broker fans each message out
+to every subscriber whose topic matches the message's `target`.
+
+Subscribers register from the socket they want data on:
+    {"type": "SUBSCRIBE", "topic": "up://car-01/vehicle.telemetry/speed?v=1", "lease_s": 30}
+A "*" segment is a wildcard (see uuri.TopicTrie). Subscriptions expire unless renewed.
+Each subscriber has a bounded queue; overflow is dropped and counted.
+
+QoS 1: the broker remembers who published each routed QoS 1 message and
+relays subscriber ACKs back to that publisher (first ACK per id wins), so
+ReliableSender works through the broker as it does point to point.
+"""
+import os, json, math, time, socket, threading
+from collections import OrderedDict, deque
+
+import codec
+from bulk_io import BatchSender, BulkReceiver, split_batch
+from common import ACK_MAX_IDS, ACK_TYPE, notify_ready
+import uuri
+from uuri import TopicTrie
+
+HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+PORT = int(os.getenv("BROKER_PORT", "50050"))
+QUEUE_MAX = int(os.getenv("BROKER_QUEUE", "4096"))        # per subscriber
+DEFAULT_LEASE_S = float(os.getenv("BROKER_LEASE_S", "30"))
+STATS_S = float(os.getenv("BROKER_STATS_S", "10"))         # 0 => never print stats
+ACK_ROUTES = int(os.getenv("BROKER_ACK_ROUTES", "65536"))   # QoS 1 ids awaiting an ACK, oldest evicted
+
+CONTROL_TYPES = ("SUBSCRIBE", "UNSUBSCRIBE", "BROKER_STATS")
+
+
+class Subscriber:
+    def __init__(self, addr, sock: socket.socket, queue_max: int):
+        self.addr = addr
+        self.queue: deque = deque()
+        self.queue_max = queue_max
+        self.sender = BatchSender(sock, addr, linger_ms=1000)  # send_loop flushes explicitly
+        self.topics: dict[str, float] = {}  # topic -> lease expiry (monotonic)
+        self.delivered = 0
+        self.dropped = 0
+
+    def offer(self, raw: bytes) -> bool:
+        if len(self.queue) >= self.queue_max:
+            self.dropped += 1
+            return False
+        self.queue.append(raw)
+        return True
+
+
+class Broker:
+    def __init__(self, sock: socket.socket, queue_max: int = QUEUE_MAX, ack_routes: int = ACK_ROUTES):
+        self.sock = sock
+        self.queue_max = queue_max
+        self.table = TopicTrie()
+        self.subs: dict[tuple, Subscriber] = {}
+        self.ack_routes: "OrderedDict[str, tuple]" = OrderedDict()  # QoS 1 id -> publisher addr
+        self.ack_routes_max = ack_routes
+        self.cond = threading.Condition()
+        self.stats = {"received": 0, "routed": 0, "unrouted": 0, "bad": 0, "acks": 0}
+
+    # ---------------- control -----------------
+
+    def control(self, msg: dict, addr) -> None:
+        """Apply one control message; ValueError if it is malformed."""
+        if not isinstance(msg, dict):
+            raise ValueError("control message is not an object")
+        kind, topic = msg.get("type"), msg.get("topic")
+        if kind == "BROKER_STATS":
+            self.sock.sendto(codec.JSON.encode(self.snapshot()), addr)
+            return
+        if not isinstance(topic, str):
+            raise ValueError("topic must be a string")
+        lease_s = msg.get("lease_s", DEFAULT_LEASE_S)
+        if isinstance(lease_s, bool) or not isinstance(lease_s, (int, float)) or not math.isfinite(lease_s):
+            raise ValueError("lease_s must be a number")
+        uuri.parse(topic)
+        with self.cond:
+            sub = self.subs.get(addr)
+            if kind == "SUBSCRIBE":
+                if sub is None:
+                    sub = self.subs[addr] = Subscriber(addr, self.sock, self.queue_max)
+                if topic not in sub.topics:
+                    self.table.add(topic, sub)
+                sub.topics[topic] = time.monotonic() + lease_s
+            elif kind == "UNSUBSCRIBE" and sub is not None and topic in sub.topics:
+                del sub.topics[topic]
+                self.table.remove(topic, sub)
+                if not sub.topics:
+                    del self.subs[addr]
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        with self.cond:
+            for addr, sub in list(self.subs.items()):
+                for topic, deadline in list(sub.topics.items()):
+                    if deadline < now:
+                        del sub.topics[topic]
+                        self.table.remove(topic, sub)
+                if not sub.topics:
+                    del self.subs[addr]
+
+    # ---------------- acks -----------------
+
+    def expect_ack(self, msg_id: str, publisher) -> None:
+        """Remember where the ACK for a routed QoS 1 message goes; call with cond held."""
+        routes = self.ack_routes
+        routes[msg_id] = publisher
+        routes.move_to_end(msg_id)
+        while len(routes) > self.ack_routes_max:
+            routes.popitem(last=False)
+
+    def relay_ack(self, msg) -> None:
+        """Forward a subscriber's ACK to the publishers of the ids it names; ValueError if malformed."""
+        ids = msg.get("ids") if isinstance(msg, dict) else None
+        if not isinstance(ids, list):
+            raise ValueError("ACK ids must be a list")
+        by_publisher: dict[tuple, list] = {}
+        with self.cond:
+            for msg_id in ids:
+                publisher = self.ack_routes.pop(msg_id, None) if isinstance(msg_id, str) else None
+                if publisher is not None:  # unknown: already acked by another subscriber, or evicted
+                    by_publisher.setdefault(publisher, []).append(msg_id)
+        for publisher, acked in by_publisher.items():
+            for i in range(0, len(acked), ACK_MAX_IDS):
+                self.sock.sendto(codec.JSON.encode({"type": ACK_TYPE, "ids": acked[i:i + ACK_MAX_IDS]}), publisher)
+            self.stats["acks"] += len(acked)
+
+    # ---------------- data path -----------------
+
+    def route(self, raw: bytes, target) -> bool:
+        try:
+            subs = self.table.match(target) if isinstance(target, str) else ()
+        except ValueError:  # not a uProtocol URI
+            subs = ()
+        if not subs:
+            self.stats["unrouted"] += 1
+            return False
+        self.stats["routed"] += 1
+        for sub in subs:
+            sub.offer(raw)
+        return True
+
+    @staticmethod
+    def _peek(part) -> tuple:
+        """(type, target, qos, id, decoded JSON or None) of one message, decoding JSON only once."""
+        delivery = codec.peek_delivery(part)
+        if delivery is None:
+            msg = codec.JSON.decode(part)
+            if not isinstance(msg, dict):
+                raise ValueError("message is not an object")
+            return msg.get("type"), msg.get("target"), msg.get("qos", 0), msg.get("id"), msg
+        mtype, target = codec.peek_route(part)
+        qos, mid, _ = delivery
+        if qos >= 1 and mid is None:  # non-UUID ids live in the body
+            mid = codec.decode(part).get("id")
+        return mtype, target, qos, mid, None
+
+    def receive_loop(self) -> None:
+        rx = BulkReceiver(self.sock)
+        while True:
+            try:
+                views = rx.recv_views()
+            except OSError:
+                continue  # e.g. ICMP port unreachable from a vanished subscriber
+            controls = []
+            with self.cond:
+                for view, addr in zip(views, rx.addrs):
+                    for part in split_batch(view):
+                        self.stats["received"] += 1
+                        try:
+                            mtype, target, qos, mid, msg = self._peek(part)
+                            if mtype in CONTROL_TYPES or mtype == ACK_TYPE:
+                                controls.append((msg if msg is not None else codec.JSON.decode(part), addr))
+                            elif (self.route(bytes(part), target) and type(qos) is int and qos >= 1
+                                  and isinstance(mid, str)):
+                                self.expect_ack(mid, addr)
+                        except Exception:  # one bad datagram must not stop routing
+                            self.stats["bad"] += 1
+                self.cond.notify()
+            for msg, addr in controls:
+                try:
+                    if msg.get("type") == ACK_TYPE:
+                        self.relay_ack(msg)
+                    else:
+                        self.control(msg, addr)
+                except Exception:
+                    self.stats["bad"] += 1
+
+    def send_loop(self) -> None:
+        while True:
+            with self.cond:
+                while not any(s.queue for s in self.subs.values()):
+                    self.cond.wait()
+                work = [(s, list(s.queue)) for s in self.subs.values() if s.queue]
+                for s, _ in work:
+                    s.queue.clear()
+            for sub, items in work:
+                try:
+                    for raw in items:
+                        sub.sender.send(raw)
+                    sub.sender.flush()
+                    sub.delivered += len(items)
+                except OSError:
+                    sub.dropped += len(items)
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return {
+                "type": "BROKER_STATS",
+                **self.stats,
+                "subscribers": [
+                    {"addr": f"{a[0]}:{a[1]}", "topics": sorted(s.topics), "queued": len(s.queue),
+                     "delivered": s.delivered, "dropped": s.dropped}
+                    for a, s in self.subs.items()
+                ],
+            }
+
+
+def main():
+    # deliberately no SO_REUSEPORT: exactly one broker owns the port
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((HOST, PORT))
+    broker = Broker(sock)
+    threading.Thread(target=broker.receive_loop, daemon=True).start()
+    threading.Thread(target=broker.send_loop, daemon=True).start()
+    print(f"[broker] listening udp://{HOST}:{PORT} (queue {QUEUE_MAX}/subscriber)", flush=True)
+    notify_ready("broker")
+    try:
+        while True:
+            time.sleep(STATS_S or 1.0)
+            broker.expire()
+            if STATS_S:
+                print("[broker] stats:", json.dumps(broker.snapshot()), flush=True)
+    finally:
+        sock.close()
+
+if __name__ == "__main__":
+    main()
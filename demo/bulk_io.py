@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import socket
+import struct
+import time
+from typing import Callable, Iterator, Optional, Union
+
+import codec
+
+
+# A coalesced datagram: magic, count, then (u16 length, message) * count.
+# Single messages are always sent bare, so old receivers keep working.
+BATCH_MAGIC = 0xBA
+BATCH_HDR = struct.Struct("!BH")
+MSG_LEN = struct.Struct("!H")
+
+MAX_DATAGRAM = 65507
+DEFAULT_BATCH_BYTES = 1472  # fits one Ethernet frame; raise it for loopback-only setups
+
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+def split_batch(view: memoryview) -> list[memoryview]:
+    """Message views inside one datagram (one view if it is not a batch).
+
+    A malformed batch is returned whole, so it fails to decode and is
+    counted like any other bad datagram.
+    """
+    size = len(view)
+    if size < BATCH_HDR.size or view[0] != BATCH_MAGIC:
+        return [view]
+    _, count = BATCH_HDR.unpack_from(view, 0)
+    pos, out = BATCH_HDR.size, []
+    for _ in range(count):
+        if pos + 2 > size:
+            return [view]
+        (n,) = MSG_LEN.unpack_from(view, pos)
+        if pos + 2 + n > size:
+            return [view]
+        out.append(view[pos + 2: pos + 2 + n])
+        pos += 2 + n
+    return out
+
+
+# ---------------- receive side -----------------
+
+
+class BulkReceiver:
+    """Drain many datagrams per wakeup into a preallocated, reused buffer ring.
+
+    The first ``recvfrom_into`` honours the socket's timeout; the rest of the
+    batch is whatever is already queued, read without blocking. Returned
+    views point into the ring and are only valid until the next call.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        slots: int = 64,
+        slot_size: int = MAX_DATAGRAM,
+        decode: Callable[[memoryview], dict] = codec.decode,
+    ):
+        self.sock = sock
+        self.decode = decode
+        # readers that hand out views of their own memory (shm_transport.ShmReader) need no ring
+        self._direct = hasattr(sock, "recv_views")
+        if self._direct:
+            slots = 0
+        self._buf = bytearray(slots * slot_size)
+        mv = memoryview(self._buf)
+        self._slots = [mv[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self.addrs: list = []  # sender address of each view from the last recv_views()
+        self.stats = {"wakeups": 0, "datagrams": 0, "messages": 0, "errors": 0}
+
+    def recv_views(self) -> list[memoryview]:
+        """Raw datagram views for one wakeup (raises socket.timeout like recvfrom)."""
+        if self._direct:
+            views = self.sock.recv_views()
+            self.addrs = self.sock.addrs
+            self.stats["wakeups"] += 1
+            self.stats["datagrams"] += len(views)
+            return views
+        first = self._slots[0]
+        n, addr = self.sock.recvfrom_into(first)
+        views = [first[:n]]
+        addrs = self.addrs = [addr]
+        # A socket with a Python-level timeout polls before every recv even with
+        # MSG_DONTWAIT, so those (and platforms without the flag) drain in
+        # non-blocking mode and get their timeout back afterwards.
+        timeout = self.sock.gettimeout()
+        toggle = timeout != 0 and (timeout is not None or not _DONTWAIT)
+        if toggle:
+            self.sock.settimeout(0)
+        try:
+            for slot in self._slots[1:]:
+                try:
+                    n, addr = self.sock.recvfrom_into(slot, 0, _DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    break
+                views.append(slot[:n])
+                addrs.append(addr)
+        finally:
+            if toggle:
+                self.sock.settimeout(timeout)
+        self.stats["wakeups"] += 1
+        self.stats["datagrams"] += len(views)
+        return views
+
+    def recv_batch(self) -> list[dict]:
+        """Decoded messages for one wakeup; undecodable ones are counted and skipped."""
+        out = []
+        for view in self.recv_views():
+            for part in split_batch(view):
+                try:
+                    out.append(self.decode(part))
+                except (ValueError, struct.error, KeyError, IndexError, UnicodeDecodeError):
+                    self.stats["errors"] += 1
+        if not self.intact():
+            self.stats["errors"] += len(out)
+            return []
+        self.stats["messages"] += len(out)
+        return out
+
+    def intact(self) -> bool:
+        """False if the views of the last wakeup were overwritten before we were done with them
+        (only possible for shared-memory readers; socket views are ours until the next call)."""
+        return not self._direct or self.sock.intact()
+
+    def __iter__(self) -> Iterator[dict]:
+        while True:
+            yield from self.recv_batch()
+
+
+def iter_messages(sock: socket.socket, **kwargs) -> Iterator[dict]:
+    """Iterate decoded messages from a UDP socket, many per syscall wakeup."""
+    return iter(BulkReceiver(sock, **kwargs))
+
+
+# ---------------- send side -----------------
+
+
+class BatchSender:
+    """Coalesce outgoing messages into as few datagrams as possible.
+
+    Messages accumulate until adding one would exceed ``max_bytes`` or
+    ``max_msgs``, or until ``linger_ms`` has passed since the first queued
+    message (checked on each ``send``). Call ``flush()`` at the end of a tick.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        addr: tuple[str, int],
+        max_bytes: int = DEFAULT_BATCH_BYTES,
+        max_msgs: int = 0xFFFF,
+        linger_ms: float = 5.0,
+        encode: Callable[[dict], bytes] = codec.encode,
+    ):
+        self.sock = sock
+        self.addr = addr
+        self.max_bytes = min(max_bytes, MAX_DATAGRAM)
+        self.max_msgs = max_msgs
+        self.linger_s = linger_ms / 1000
+        self.encode = encode
+        self._parts: list[bytes] = []
+        self._size = BATCH_HDR.size
+        self._first_at = 0.0
+        self.stats = {"messages": 0, "datagrams": 0}
+
+    def send(self, msg: Union[dict, bytes]) -> None:
+        raw = msg if isinstance(msg, (bytes, bytearray, memoryview)) else self.encode(msg)
+        need = MSG_LEN.size + len(raw)
+        if self._parts and (self._size + need > self.max_bytes or len(self._parts) >= self.max_msgs):
+            self.flush()
+        if not self._parts:
+            self._first_at = time.monotonic()
+        self._parts.append(raw)
+        self._size += need
+        self.stats["messages"] += 1
+        if self._size >= self.max_bytes or time.monotonic() - self._first_at >= self.linger_s:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._parts:
+            return
+        if len(self._parts) == 1:
+            self.sock.sendto(self._parts[0], self.addr)
+        else:
+            chunks = [BATCH_HDR.pack(BATCH_MAGIC, len(self._parts))]
+            for raw in self._parts:
+                chunks.append(MSG_LEN.pack(len(raw)))
+                chunks.append(raw)
+            self.sock.sendto(b"".join(chunks), self.addr)
+        self.stats["datagrams"] += 1
+        self._parts.clear()
+        self._size = BATCH_HDR.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def recv_one(sock: socket.socket, receiver: Optional[BulkReceiver] = None) -> dict:
+    """Convenience for bounded/CI modes: block for the first message."""
+    receiver = receiver or BulkReceiver(sock, slots=1)
+    while True:
+        batch = receiver.recv_batch()
+        if batch:
+            return batch[0]
@@ -0,0 +1,538 @@
+# demo/capture.py
+"""Record the demo's traffic into a capture file and replay it later.
+
+A capture is an append-only file of timestamped records, each holding the
+exact bytes that were on the wire: one UDP datagram (a single envelope or a
+coalesced batch, JSON or binary) or one RPC frame body. Nothing is decoded
+while recording, so the recorder keeps up with the load generator.
+
+    <file>       16-byte header, then records back to back:
+                 (ts_us int64, length u32, kind u8, flags u8, port u16) + payload
+    <file>.idx   (offset, ts_us) of every INDEX_EVERY-th record, for seeking by time
+
+Recording taps:
+
+  --udp PORT      bind PORT and record what publishers send to it; with
+                  --forward HOST:PORT each datagram is passed on, so the tap
+                  can sit between pub_telemetry and its consumers. With
+                  DEMO_BROKER set it subscribes to --topic instead and records
+                  alongside the other subscribers.
+  --rpc L:U       TCP proxy on port L in front of the RPC server on port U;
+                  requests and responses are both recorded.
+
+Replay reads the file through mmap (pages are dropped again by the kernel, so
+memory stays flat however long the capture is) and sends UDP records to their
+original port, or --udp-port, and RPC requests over one pipelined connection
+to --rpc. --speed 1 keeps the recorded timing, N runs N times faster and
+0 sends as fast as possible.
+
+    python demo/capture.py record --out logs/run.cap --udp 50052 --forward 127.0.0.1:50062 --rpc 6001:6000
+    python demo/capture.py info logs/run.cap
+    python demo/capture.py replay logs/run.cap --speed 10 --rpc 127.0.0.1:6000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+
+import codec
+from common import FrameReader, broker_addr, send_frame, tcp_connect, tcp_listen, udp_subscribe
+
+FILE_HDR = struct.Struct("<4sHHq")   # magic, version, reserved, created (epoch us)
+REC_HDR = struct.Struct("<qIBBH")    # ts_us, length, kind, flags, port
+MAGIC = b"UPCP"
+VERSION = 1
+
+KIND_UDP = 0
+KIND_RPC_REQUEST = 1
+KIND_RPC_RESPONSE = 2
+KIND_NAMES = {KIND_UDP: "udp", KIND_RPC_REQUEST: "rpc_request", KIND_RPC_RESPONSE: "rpc_response"}
+
+INDEX_DTYPE = np.dtype([("off", "<u8"), ("ts", "<i8")])
+INDEX_EVERY = 1024
+WRITE_BUFFER = 1 << 20
+MAX_DATAGRAM = 65535
+
+
+def now_us() -> int:
+    return time.time_ns() // 1000
+
+
+def index_path(path: Path) -> Path:
+    return path.with_name(path.name + ".idx")
+
+
+class Record(NamedTuple):
+    ts_us: int
+    kind: int
+    port: int
+    data: memoryview  # valid until the Capture is closed
+
+
+# ---------------- recording -----------------
+
+
+class Recorder:
+    """Append records to a capture file; safe to share between tap threads.
+
+    Writes go through a large buffer; flush() (or close()) makes them visible
+    to readers. Reopening an existing capture appends to it, after cutting off
+    a record left half-written by a crash.
+    """
+
+    def __init__(self, path: str | os.PathLike, index_every: int = INDEX_EVERY):
+        self.path = Path(path)
+        self.index_every = index_every
+        self.records = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        end = None
+        if self.path.exists() and self.path.stat().st_size >= FILE_HDR.size:
+            with Capture(self.path) as cap:
+                end = cap.end()
+            os.truncate(self.path, end)
+            self._trim_index(end)
+        self._f = open(self.path, "ab", buffering=WRITE_BUFFER)
+        self._idx = open(index_path(self.path), "ab")
+        if end is None:
+            self._f.truncate(0)
+            self._f.write(FILE_HDR.pack(MAGIC, VERSION, 0, now_us()))
+            self._idx.truncate(0)
+            end = FILE_HDR.size
+        self.offset = end
+
+    def _trim_index(self, end: int) -> None:
+        idx = index_path(self.path)
+        if idx.exists():
+            rows = np.fromfile(idx, dtype=INDEX_DTYPE)
+            keep = int(np.searchsorted(rows["off"], end))
+            if keep < len(rows):
+                os.truncate(idx, keep * INDEX_DTYPE.itemsize)
+
+    def write(self, kind: int, port: int, data, ts_us: Optional[int] = None) -> None:
+        n = len(data)
+        with self._lock:
+            ts = now_us() if ts_us is None else ts_us  # stamped under the lock: the file stays in time order
+            if self.records % self.index_every == 0:
+                self._idx.write(np.array([(self.offset, ts)], dtype=INDEX_DTYPE).tobytes())
+            self._f.write(REC_HDR.pack(ts, n, kind, 0, port))
+            self._f.write(data)
+            self.offset += REC_HDR.size + n
+            self.records += 1
+            self.bytes += n
+
+    def flush(self) -> None:
+        with self._lock:
+            self._f.flush()
+            self._idx.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+                self._idx.close()
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def tap_udp(recorder: Recorder, sock: socket.socket, port: int,
+            forward: Optional[tuple[str, int]] = None, stop: Optional[threading.Event] = None) -> None:
+    """Record every datagram `sock` receives (tagged with `port`), passing it on to `forward`."""
+    buf = bytearray(MAX_DATAGRAM)
+    view = memoryview(buf)
+    out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if forward else None
+    try:
+        while stop is None or not stop.is_set():
+            try:
+                n, _ = sock.recvfrom_into(buf)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                recorder.write(KIND_UDP, port, view[:n])
+            except ValueError:  # the recorder was closed: nothing left to tap for
+                return
+            if out is not None:
+                out.sendto(view[:n], forward)
+    finally:
+        if out is not None:
+            out.close()
+
+
+class RpcTap:
+    """TCP proxy in front of the RPC server that records both directions, frame by frame."""
+
+    def __init__(self, recorder: Recorder, listen: socket.socket, upstream: tuple[str, int]):
+        self.recorder = recorder
+        self.listen = listen
+        self.upstream = upstream
+        self._lock = threading.Lock()
+        self._conns: set[socket.socket] = set()
+        self._pumps: list[threading.Thread] = []
+        self._closed = False
+
+    def serve(self) -> None:
+        while True:
+            try:
+                client, _ = self.listen.accept()
+            except OSError:
+                return
+            try:
+                server = tcp_connect(*self.upstream)
+            except OSError:
+                client.close()
+                continue
+            server.settimeout(None)  # connected: idle clients must not time the pair out
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pumps = [threading.Thread(target=self._pump, args=(client, server, KIND_RPC_REQUEST), daemon=True),
+                     threading.Thread(target=self._pump, args=(server, client, KIND_RPC_RESPONSE), daemon=True)]
+            with self._lock:
+                if self._closed:  # close() ran while this pair was connecting
+                    client.close()
+                    server.close()
+                    return
+                self._conns.update((client, server))
+                self._pumps = [t for t in self._pumps if t.is_alive()] + pumps
+                for t in pumps:  # started under the lock so close() never joins an unstarted pump
+                    t.start()
+
+    def close(self, timeout_s: float = 2.0) -> None:
+        """Stop accepting, cut every proxied connection and wait for the pumps to finish writing."""
+        try:
+            self.listen.shutdown(socket.SHUT_RDWR)  # wakes a blocked accept(); close() alone doesn't
+        except OSError:
+            pass
+        self.listen.close()
+        with self._lock:
+            self._closed = True
+            conns, pumps = list(self._conns), list(self._pumps)
+        for sock in conns:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for t in pumps:
+            t.join(timeout_s)
+
+    def _pump(self, src: socket.socket, dst: socket.socket, kind: int) -> None:
+        port = self.upstream[1]
+        try:
+            for frame in FrameReader(src):
+                self.recorder.write(kind, port, frame)
+                send_frame(dst, frame)
+        except (OSError, ValueError):  # ValueError covers FrameTooLarge
+            pass
+        finally:
+            for sock in (src, dst):  # either side closing ends the pair
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            src.close()
+            with self._lock:
+                self._conns.discard(src)
+
+
+# ---------------- reading -----------------
+
+
+class Capture:
+    """Read-only, memory-mapped view of a capture file.
+
+    Records are yielded as views into the mapping, so iterating a capture of
+    any size copies nothing and holds only the pages being read. A record cut
+    short by a crash (or still being written) ends the iteration.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size < FILE_HDR.size:
+                raise ValueError(f"not a capture file: {self.path}")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.created_us = FILE_HDR.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"not a capture file: {self.path}")
+        if hasattr(self._mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mm.madvise(mmap.MADV_SEQUENTIAL)  # read-ahead, and pages behind us are cheap to drop
+        self._view = memoryview(self._mm)
+        idx = index_path(self.path)
+        self.index = np.fromfile(idx, dtype=INDEX_DTYPE) if idx.exists() else np.empty(0, INDEX_DTYPE)
+        self.index = self.index[self.index["off"] < self.size]
+
+    def _start(self, since_us: Optional[int]) -> int:
+        if since_us is None or not len(self.index):
+            return FILE_HDR.size
+        i = int(np.searchsorted(self.index["ts"], since_us, side="left")) - 1
+        return int(self.index["off"][i]) if i >= 0 else FILE_HDR.size
+
+    def records(self, since_us: Optional[int] = None, until_us: Optional[int] = None,
+                kinds: Optional[set[int]] = None) -> Iterator[Record]:
+        """Records with since_us <= ts < until_us (either bound optional), in file order."""
+        mm, view, size = self._mm, self._view, self.size
+        off = self._start(since_us)
+        while off + REC_HDR.size <= size:
+            ts, n, kind, _, port = REC_HDR.unpack_from(mm, off)
+            body = off + REC_HDR.size
+            if body + n > size:
+                break
+            off = body + n
+            if since_us is not None and ts < since_us:
+                continue
+            if until_us is not None and ts >= until_us:
+                break
+            if kinds is None or kind in kinds:
+                yield Record(ts, kind, port, view[body:off])
+
+    def __iter__(self) -> Iterator[Record]:
+        return self.records()
+
+    def end(self) -> int:
+        """Offset just past the last complete record."""
+        off = int(self.index["off"][-1]) if len(self.index) else FILE_HDR.size
+        while off + REC_HDR.size <= self.size:
+            n = REC_HDR.unpack_from(self._mm, off)[1]
+            if off + REC_HDR.size + n > self.size:
+                break
+            off += REC_HDR.size + n
+        return off
+
+    def info(self) -> dict:
+        kinds: dict[str, int] = {}
+        first = last = None
+        records = payload = 0
+        for rec in self.records():
+            name = KIND_NAMES.get(rec.kind, str(rec.kind))
+            kinds[name] = kinds.get(name, 0) + 1
+            first = rec.ts_us if first is None else first
+            last = rec.ts_us
+            records += 1
+            payload += len(rec.data)
+        return {"path": str(self.path), "records": records, "payload_bytes": payload, "file_bytes": self.size,
+                "kinds": kinds, "first_us": first, "last_us": last,
+                "duration_s": (last - first) / 1e6 if records else 0.0, "index_rows": len(self.index)}
+
+    def close(self) -> None:
+        self._view.release()
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # records still referenced by the caller; the mapping goes when they do
+
+    def __enter__(self) -> "Capture":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ---------------- replay -----------------
+
+
+class _RpcReplay:
+    """One pipelined connection for replayed requests; responses are counted by status code."""
+
+    def __init__(self, addr: tuple[str, int]):
+        self.conn = tcp_connect(*addr)
+        self.conn.settimeout(None)
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sent = 0
+        self.codes: dict[str, int] = {}
+        self._answered = threading.Condition()
+        self._responses = 0
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def send(self, frame) -> None:
+        send_frame(self.conn, frame)
+        self.sent += 1
+
+    def _read(self) -> None:
+        try:
+            for frame in FrameReader(self.conn):
+                try:
+                    status = codec.decode(frame).get("status")  # ValueError for any corrupt frame
+                    code = str(status.get("code") if isinstance(status, dict) else None)
+                except ValueError:
+                    code = "undecodable"
+                with self._answered:
+                    self.codes[code] = self.codes.get(code, 0) + 1
+                    self._responses += 1
+                    self._answered.notify_all()
+        except (OSError, ValueError):
+            pass
+        with self._answered:
+            self._responses = -1  # connection gone: stop waiting
+            self._answered.notify_all()
+
+    def close(self, timeout_s: float) -> None:
+        with self._answered:
+            self._answered.wait_for(lambda: self._responses < 0 or self._responses >= self.sent, timeout_s)
+        self.conn.close()
+
+
+def replay(cap: Capture, speed: float = 1.0, host: str = "127.0.0.1", udp_port: Optional[int] = None,
+           rpc_addr: Optional[tuple[str, int]] = None, since_us: Optional[int] = None,
+           until_us: Optional[int] = None, drain_s: float = 5.0) -> dict:
+    """Send the capture's records again, keeping their spacing divided by `speed` (0 => no pacing).
+
+    UDP records go to (host, udp_port or the recorded port). RPC requests go to
+    rpc_addr and their responses are awaited for up to `drain_s` at the end;
+    RPC records are skipped without rpc_addr, recorded responses always are.
+    """
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rpc = _RpcReplay(rpc_addr) if rpc_addr else None
+    stats = {"udp": 0, "rpc": 0, "skipped": 0, "late": 0, "max_lag_ms": 0.0}
+    first_ts = None
+    started = time.perf_counter()
+    try:
+        for rec in cap.records(since_us, until_us):
+            if not (rec.kind == KIND_UDP or (rec.kind == KIND_RPC_REQUEST and rpc is not None)):
+                stats["skipped"] += 1
+                continue
+            if first_ts is None:
+                first_ts = rec.ts_us
+            if speed > 0:
+                due = started + (rec.ts_us - first_ts) / 1e6 / speed
+                ahead = due - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+                elif ahead < -0.001:  # more than a millisecond behind the recorded timing
+                    stats["late"] += 1
+                    stats["max_lag_ms"] = max(stats["max_lag_ms"], -ahead * 1000)
+            if rec.kind == KIND_UDP:
+                udp.sendto(rec.data, (host, udp_port or rec.port))
+                stats["udp"] += 1
+            else:
+                rpc.send(rec.data)
+                stats["rpc"] += 1
+        elapsed = time.perf_counter() - started
+    finally:
+        udp.close()
+        if rpc is not None:
+            rpc.close(drain_s)
+    sent = stats["udp"] + stats["rpc"]
+    stats.update(elapsed_s=round(elapsed, 3), rate=round(sent / elapsed, 1) if elapsed > 0 else 0.0,
+                 max_lag_ms=round(stats["max_lag_ms"], 3))
+    if rpc is not None:
+        stats["rpc_responses"] = dict(rpc.codes)
+    return stats
+
+
+# ---------------- CLI -----------------
+
+
+def _addr(text: str) -> tuple[str, int]:
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def record(args) -> int:
+    recorder = Recorder(args.out)
+    stop = threading.Event()
+    threads, socks, taps = [], [], []
+    for port in args.udp:
+        if broker_addr() is not None:
+            sock = udp_subscribe(args.topic, args.host, port, 1.0)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+            sock.bind((args.host, port))
+            sock.settimeout(1.0)
+        socks.append(sock)
+        forward = _addr(args.forward) if args.forward else None
+        threads.append(threading.Thread(target=tap_udp, args=(recorder, sock, port, forward, stop), daemon=True))
+    for spec in args.rpc:
+        listen_port, _, upstream_port = spec.partition(":")
+        taps.append(RpcTap(recorder, tcp_listen(args.host, int(listen_port)), (args.host, int(upstream_port))))
+        threads.append(threading.Thread(target=taps[-1].serve, daemon=True))
+    for t in threads:
+        t.start()
+    print(f"[capture] recording udp={args.udp} rpc={args.rpc} into {args.out}", flush=True)
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1.0 if deadline is None else max(0.0, min(1.0, deadline - time.monotonic())))
+            recorder.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # every tap is stopped before the recorder closes under it
+        stop.set()
+        for sock in socks:
+            sock.close()
+        for tap in taps:
+            tap.close()
+        for t in threads:
+            t.join(2.0)
+        recorder.close()
+    print(f"[capture] {recorder.records} records, {recorder.bytes} bytes", flush=True)
+    return 0
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Record demo traffic into a capture file and replay it.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("record", help="tap UDP ports and/or proxy the RPC server")
+    rec.add_argument("--out", default=os.getenv("CAPTURE_PATH", "logs/capture.cap"))
+    rec.add_argument("--host", default="127.0.0.1")
+    rec.add_argument("--udp", type=int, action="append", default=[], help="UDP port to tap (repeatable)")
+    rec.add_argument("--forward", default=None, help="HOST:PORT to pass tapped datagrams on to")
+    rec.add_argument("--topic", default="up://*/vehicle.telemetry/*", help="subscription used with DEMO_BROKER")
+    rec.add_argument("--rpc", action="append", default=[], help="LISTEN:UPSTREAM ports of an RPC proxy (repeatable)")
+    rec.add_argument("--duration", type=float, default=0, help="seconds to record (default: until Ctrl-C)")
+    inf = sub.add_parser("info", help="summarise a capture")
+    inf.add_argument("path")
+    rep = sub.add_parser("replay", help="send a capture again")
+    rep.add_argument("path")
+    rep.add_argument("--speed", type=float, default=1.0, help="1 = recorded timing, N = N times faster, 0 = max")
+    rep.add_argument("--host", default="127.0.0.1", help="UDP destination host")
+    rep.add_argument("--udp-port", type=int, default=None, help="send every UDP record here instead")
+    rep.add_argument("--rpc", default=None, help="HOST:PORT of the RPC server (RPC records skipped otherwise)")
+    rep.add_argument("--since", type=float, default=None, help="seconds into the capture to start at")
+    rep.add_argument("--until", type=float, default=None, help="seconds into the capture to stop at")
+    rep.add_argument("--loop", type=int, default=1, help="replay the capture this many times")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "record":
+        return record(args)
+    with Capture(args.path) as cap:
+        if args.cmd == "info":
+            print(json.dumps(cap.info()))
+            return 0
+        first = next(iter(cap), None)
+        if first is None:
+            print("[capture] empty capture", file=sys.stderr)
+            return 1
+        t0 = first.ts_us
+        del first  # a live record view would keep the mapping open
+        since = t0 + int(args.since * 1e6) if args.since is not None else None
+        until = t0 + int(args.until * 1e6) if args.until is not None else None
+        for _ in range(args.loop):
+            stats = replay(cap, args.speed, args.host, args.udp_port, _addr(args.rpc) if args.rpc else None,
+                           since, until)
+            print(json.dumps(stats), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import json
+import struct
+import uuid
+from typing import Iterable, Optional, Union
+
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+CT_JSON = "application/json"
+CT_BINARY = "application/x-uprotocol+bin"
+
+
+# ---------------- JSON (default) -----------------
+
+
+class JsonCodec:
+    """The original wire format: one UTF-8 JSON object per message."""
+
+    content_type = CT_JSON
+
+    def encode(self, msg: dict) -> bytes:
+        return json.dumps(msg, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+    def decode(self, data: Buffer) -> dict:
+        msg = json.loads(bytes(data) if isinstance(data, memoryview) else data)
+        if not isinstance(msg, dict):
+            raise ValueError("message is not a JSON object")
+        return msg
+
+
+# ---------------- topic interning -----------------
+
+
+INLINE_TOPIC = 0xFFFF
+
+# Both ends of a link must agree on this table; anything not in it is sent inline.
+WELL_KNOWN_TOPICS = (
+    "up://car-01/vehicle.telemetry/publisher?v=1",
+    "up://car-01/vehicle.telemetry/speed?v=1",
+    "up://car-01/mobile.app/client?v=1",
+    "up://car-01/body.control/service?v=1",
+    "up://car-01/body.control/doors/lock?v=1",
+)
+
+
+class TopicTable:
+    """Two-way URI <-> small integer table for the binary header."""
+
+    def __init__(self, uris: Iterable[str] = ()):
+        self._ids: dict[str, int] = {}
+        self._uris: list[Optional[str]] = [None]  # id 0 means "no topic"
+        for uri in uris:
+            self.register(uri)
+
+    def register(self, uri: str) -> int:
+        tid = self._ids.get(uri)
+        if tid is None:
+            tid = len(self._uris)
+            if tid >= INLINE_TOPIC:
+                raise ValueError("topic table full")
+            self._ids[uri] = tid
+            self._uris.append(uri)
+        return tid
+
+    def id_of(self, uri: Optional[str]) -> int:
+        if uri is None:
+            return 0
+        return self._ids.get(uri, INLINE_TOPIC)
+
+    def uri_of(self, tid: int) -> Optional[str]:
+        return self._uris[tid]
+
+
+# ---------------- compact binary -----------------
+
+
+MAGIC = 0xB1
+VERSION = 1
+
+TYPE_CODES = {"EVENT": 1, "REQUEST": 2, "RESPONSE": 3}
+TYPE_NAMES = {v: k for k, v in TYPE_CODES.items()}
+
+FLAG_CORR_UUID = 0x01   # 16-byte correlation_id follows
+FLAG_TTL = 0x02         # ttl_ms present (0 is a valid value)
+FLAG_BODY = 0x04        # compact JSON object of the remaining keys fills the rest
+FLAG_TS = 0x08          # 8-byte ts_ms (creation time, the base for ttl_ms) follows the correlation id
+
+# magic, version, type, flags, qos, ttl_ms, id, source topic, target topic
+HEADER = struct.Struct("!BBBBBI16sHH")
+U16 = struct.Struct("!H")
+U64 = struct.Struct("!Q")
+NO_ID = bytes(16)
+
+# everything else (payload, status, method, ...) goes into the JSON body in one dumps() call
+HEADER_KEYS = frozenset(("type", "id", "source", "target", "content_type",
+                         "qos", "ttl_ms", "correlation_id", "ts_ms"))
+
+
+def _uuid_bytes(value) -> Optional[bytes]:
+    if isinstance(value, (bytes, bytearray)) and len(value) == 16:
+        return bytes(value)
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    # only the canonical (lowercase) form goes into the header: it must decode to the same string
+    if (isinstance(value, str) and len(value) == 36 and value[8] == value[13] == value[18] == value[23] == "-"
+            and value == value.lower()):
+        try:
+            raw = bytes.fromhex(value.replace("-", ""))  # much cheaper than uuid.UUID()
+        except ValueError:
+            return None
+        return raw if len(raw) == 16 else None  # fromhex skips whitespace
+    return None
+
+
+def _uuid_str(raw) -> str:
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _json_default(obj):
+    # ids are minted as 16 raw bytes (ids.MessageId) and only become text here
+    if isinstance(obj, (bytes, bytearray)) and len(obj) == 16:
+        return _uuid_str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _compact(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+class BinaryCodec:
+    """Fixed-width header, 16-byte binary UUIDs and interned topic IDs.
+
+    Fields outside the header (payload, status, unknown message types,
+    non-UUID ids, extra keys) are carried as one compact JSON object after
+    it, so every envelope round-trips.
+    """
+
+    content_type = CT_BINARY
+
+    def __init__(self, topics: Optional[TopicTable] = None):
+        self.topics = topics if topics is not None else TopicTable(WELL_KNOWN_TOPICS)
+
+    def encode(self, msg: dict) -> bytes:
+        body = {k: v for k, v in msg.items() if k not in HEADER_KEYS}
+        mtype = msg.get("type")
+        type_code = TYPE_CODES.get(mtype, 0)
+        if type_code == 0 and mtype is not None:
+            body["type"] = mtype
+
+        id_raw = _uuid_bytes(msg.get("id"))
+        if id_raw is None:
+            id_raw = NO_ID
+            if msg.get("id") is not None:
+                body["id"] = msg["id"]
+
+        flags = FLAG_TTL if "ttl_ms" in msg else 0
+        tail = []
+        src, dst = msg.get("source"), msg.get("target")
+        src_id, dst_id = self.topics.id_of(src), self.topics.id_of(dst)
+        for tid, uri in ((src_id, src), (dst_id, dst)):
+            if tid == INLINE_TOPIC:
+                raw = uri.encode("utf-8")
+                tail.append(U16.pack(len(raw)) + raw)
+
+        if "correlation_id" in msg:
+            corr = _uuid_bytes(msg["correlation_id"])
+            if corr is not None:
+                flags |= FLAG_CORR_UUID
+                tail.append(corr)
+            else:
+                body["correlation_id"] = msg["correlation_id"]
+        if "ts_ms" in msg:
+            flags |= FLAG_TS
+            tail.append(U64.pack(int(msg["ts_ms"])))
+        if body:
+            flags |= FLAG_BODY
+            tail.append(json.dumps(body, separators=(",", ":")).encode("utf-8"))
+
+        hdr = HEADER.pack(MAGIC, VERSION, type_code, flags, int(msg.get("qos", 0)),
+                          int(msg.get("ttl_ms", 0)), id_raw, src_id, dst_id)
+        return hdr + b"".join(tail)
+
+    def decode(self, data: Buffer) -> dict:
+        """ValueError for anything that is not a well-formed message."""
+        try:
+            return self._decode(data)
+        except (struct.error, KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"malformed binary uProtocol message: {e}") from e
+
+    def _decode(self, data: Buffer) -> dict:
+        (magic, version, type_code, flags, qos, ttl_ms, id_raw,
+         src_id, dst_id) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a v{VERSION} binary uProtocol message")
+        pos = HEADER.size
+        mv = memoryview(data)
+
+        msg: dict = {}
+        if type_code:
+            msg["type"] = TYPE_NAMES[type_code]
+        if id_raw != NO_ID:
+            msg["id"] = _uuid_str(id_raw)
+        for key, tid in (("source", src_id), ("target", dst_id)):
+            if tid == INLINE_TOPIC:
+                (n,) = U16.unpack_from(mv, pos)
+                msg[key] = str(mv[pos + 2: pos + 2 + n], "utf-8")
+                pos += 2 + n
+            elif tid:
+                msg[key] = self.topics.uri_of(tid)
+        msg["content_type"] = CT_BINARY
+        msg["qos"] = qos
+        if flags & FLAG_TTL:
+            msg["ttl_ms"] = ttl_ms
+        if flags & FLAG_CORR_UUID:
+            msg["correlation_id"] = _uuid_str(mv[pos: pos + 16])
+            pos += 16
+        if flags & FLAG_TS:
+            (msg["ts_ms"],) = U64.unpack_from(mv, pos)
+            pos += 8
+        if flags & FLAG_BODY:
+            body = json.loads(bytes(mv[pos:]))
+            if not isinstance(body, dict):
+                raise ValueError("binary message body is not a JSON object")
+            msg.update(body)
+        return msg
+
+
+# ---------------- registry / negotiation -----------------
+
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+CODECS = {CT_JSON: JSON, CT_BINARY: BINARY}
+
+
+def get_codec(content_type: Optional[str]) -> Union[JsonCodec, BinaryCodec]:
+    """Codec for a content_type; anything unknown falls back to JSON."""
+    return CODECS.get(content_type, JSON)
+
+
+def codec_for(msg: dict) -> Union[JsonCodec, BinaryCodec]:
+    """The codec a message asked for via its content_type."""
+    return get_codec(msg.get("content_type"))
+
+
+def encode(msg: dict) -> bytes:
+    return codec_for(msg).encode(msg)
+
+
+def peek_route(data: Buffer) -> tuple[Optional[str], Optional[str]]:
+    """(type, target) of an encoded message; binary messages are read from the header only."""
+    if len(data) and data[0] == MAGIC:
+        _, _, type_code, _, _, _, _, src_id, dst_id = HEADER.unpack_from(data, 0)
+        mtype = TYPE_NAMES.get(type_code)
+        if dst_id != INLINE_TOPIC:
+            return mtype, BINARY.topics.uri_of(dst_id)
+        pos = HEADER.size
+        if src_id == INLINE_TOPIC:
+            (n,) = U16.unpack_from(data, pos)
+            pos += 2 + n
+        (n,) = U16.unpack_from(data, pos)
+        return mtype, str(memoryview(data)[pos + 2: pos + 2 + n], "utf-8")
+    msg = JSON.decode(data)
+    return msg.get("type"), msg.get("target")
+
+
+def peek_deadline(data: Buffer) -> Optional[int]:
+    """Expiry time (epoch ms) of a binary message, read from the header without decoding.
+
+    None when the message has no ts_ms/ttl_ms (never expires) or is JSON,
+    whose expiry is only known after decoding.
+    """
+    if not len(data) or data[0] != MAGIC:
+        return None
+    _, _, _, flags, _, ttl_ms, _, src_id, dst_id = HEADER.unpack_from(data, 0)
+    if not (flags & FLAG_TS and flags & FLAG_TTL) or ttl_ms == 0:
+        return None
+    pos = HEADER.size
+    for tid in (src_id, dst_id):
+        if tid == INLINE_TOPIC:
+            (n,) = U16.unpack_from(data, pos)
+            pos += 2 + n
+    if flags & FLAG_CORR_UUID:
+        pos += 16
+    (ts_ms,) = U64.unpack_from(data, pos)
+    return ts_ms + ttl_ms
+
+
+def peek_delivery(data: Buffer) -> Optional[tuple[int, Optional[str], Optional[str]]]:
+    """(qos, id, source) of a binary message, read from the header without decoding.
+
+    None for JSON, like peek_deadline. Non-UUID ids live in the body and
+    come back as None.
+    """
+    if not len(data) or data[0] != MAGIC:
+        return None
+    _, _, _, _, qos, _, id_raw, src_id, _ = HEADER.unpack_from(data, 0)
+    mid = _uuid_str(id_raw) if id_raw != NO_ID else None
+    if src_id == INLINE_TOPIC:
+        (n,) = U16.unpack_from(data, HEADER.size)
+        return qos, mid, str(memoryview(data)[HEADER.size + 2: HEADER.size + 2 + n], "utf-8")
+    return qos, mid, BINARY.topics.uri_of(src_id) if src_id else None
+
+
+def decode(data: Buffer) -> dict:
+    """Decode either format, sniffing the first byte; ValueError if it is malformed."""
+    if len(data) and data[0] == MAGIC:
+        return BINARY.decode(data)
+    return JSON.decode(data)
@@ -1,11 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import os
 import socket
 import struct
+import threading
 import time
+from collections import OrderedDict
 from typing import Optional
 
+import codec
+from bulk_io import BulkReceiver, split_batch
+from ids import new_id
+import shm_transport
+
 
 # ---------------- UDP helpers -----------------
 
@@ -37,6 +46,334 @@ def udp_recv_json(sock: socket.socket) -> dict:
     return json.loads(data.decode("utf-8"))
 
 
+# ---------------- broker (demo/broker.py) -----------------
+
+# "host:port" of a running broker; empty => publishers and subscribers share the port directly
+BROKER = os.getenv("DEMO_BROKER", "")
+# udp | shm (same-host shared-memory rings, one per port; see shm_transport.py)
+TRANSPORT = os.getenv("DEMO_TRANSPORT", "udp")
+SUB_LEASE_S = 30.0
+
+
+def broker_addr() -> Optional[tuple[str, int]]:
+    """Address of the broker when DEMO_BROKER is set."""
+    if not BROKER:
+        return None
+    host, _, port = BROKER.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def udp_subscribe(topic: str, host: str, port: int, timeout_s: Optional[float] = None) -> socket.socket:
+    """Socket that receives `topic`.
+
+    Without a broker this is udp_bind(host, port). With DEMO_BROKER set it
+    binds an ephemeral port, subscribes it at the broker and renews the
+    lease in the background, so every consumer gets every message. With
+    DEMO_TRANSPORT=shm it is a reader of the port's shared-memory channel,
+    which every consumer also receives in full.
+    """
+    if TRANSPORT == "shm":
+        return shm_transport.ShmReader(shm_transport.channel_name(port), timeout_s)
+    addr = broker_addr()
+    if addr is None:
+        return udp_bind(host, port, timeout_s)
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((host, 0))
+    if timeout_s is not None:
+        s.settimeout(timeout_s)
+    req = json.dumps({"type": "SUBSCRIBE", "topic": topic, "lease_s": SUB_LEASE_S}).encode("utf-8")
+
+    def renew():
+        while s.fileno() != -1:
+            try:
+                s.sendto(req, addr)
+            except OSError:
+                pass
+            time.sleep(SUB_LEASE_S / 3)
+
+    threading.Thread(target=renew, name=f"lease:{topic}", daemon=True).start()
+    return s
+
+
+def publish_addr(default: tuple[str, int]) -> tuple[str, int]:
+    """Where publishers send: the broker if configured, else the direct address."""
+    if TRANSPORT == "shm":
+        return default
+    return broker_addr() or default
+
+
+def open_sender():
+    """What publishers sendto(): a UDP socket, or the shared-memory producer with DEMO_TRANSPORT=shm."""
+    if TRANSPORT == "shm":
+        return shm_transport.ShmSender()
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+def udp_send_msg(sock: socket.socket, addr: tuple[str, int], obj: dict) -> None:
+    """Send an envelope over UDP in the codec named by its content_type (JSON by default)."""
+    sock.sendto(codec.encode(obj), addr)
+
+
+def udp_recv_msg(sock: socket.socket) -> dict:
+    """Receive one envelope over UDP, whichever codec it was sent with."""
+    data, _ = sock.recvfrom(65535)
+    return codec.decode(data)
+
+
+# ---------------- QoS -----------------
+
+# QoS 0: fire and forget. QoS 1: at least once; the receiver acks every copy
+# (acks can be lost too) and drops duplicates by id. Any message with ts_ms and a
+# non-zero ttl_ms is dropped once ts_ms + ttl_ms has passed.
+ACK_TYPE = "ACK"
+ACK_MAX_IDS = 1000  # ids per ACK datagram; keeps it well under the UDP limit
+DEDUP_WINDOW_S = float(os.getenv("DEMO_DEDUP_WINDOW_S", "60"))
+
+
+def is_expired(msg: dict, now_ms: Optional[int] = None) -> bool:
+    """True when the envelope carries ts_ms and ttl_ms and its time is up.
+
+    ValueError if either field is present but not an integer.
+    """
+    ttl, ts = msg.get("ttl_ms"), msg.get("ts_ms")
+    if (ttl is not None and type(ttl) is not int) or (ts is not None and type(ts) is not int):
+        raise ValueError("ts_ms and ttl_ms must be integers")
+    if not ttl or ts is None:
+        return False
+    return (epoch_ms() if now_ms is None else now_ms) > ts + ttl
+
+
+class DedupWindow:
+    """Message ids seen in the last `window_s` seconds, capped at `max_ids` (oldest evicted first)."""
+
+    def __init__(self, window_s: float = DEDUP_WINDOW_S, max_ids: int = 100_000):
+        self.window_s = window_s
+        self.max_ids = max_ids
+        self._ids: "OrderedDict[str, float]" = OrderedDict()
+
+    def seen(self, msg_id: str) -> bool:
+        """Record `msg_id`; True if it was already recorded inside the window."""
+        now = time.monotonic()
+        ids = self._ids
+        while ids:
+            t = next(iter(ids.values()))
+            if now - t < self.window_s and len(ids) < self.max_ids:
+                break
+            ids.popitem(last=False)
+        if msg_id in ids:
+            return True
+        ids[msg_id] = now
+        return False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class ReliableSender:
+    """Send envelopes over UDP, retransmitting QoS 1 ones until acked.
+
+    At most ``window`` QoS 1 messages are unacked at a time; ``send()`` blocks
+    for a slot. The retransmit timeout adapts to measured round trips (RFC
+    6298 smoothing, Karn's rule for retransmitted messages) and backs off
+    exponentially per message. A message is given up after ``max_retries``
+    or once its TTL has expired. QoS 0 messages are just sent.
+    """
+
+    def __init__(self, sock: socket.socket, addr: tuple[str, int], window: int = 64,
+                 rto_s: float = 0.2, rto_min_s: float = 0.02, rto_max_s: float = 5.0, max_retries: int = 5):
+        self.sock = sock
+        self.addr = addr
+        self.window = window
+        self.rto = rto_s
+        self.rto_min, self.rto_max = rto_min_s, rto_max_s
+        self.max_retries = max_retries
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self._pending: dict[str, list] = {}  # id -> [raw, msg, first_sent, last_sent, retries]
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.stats = {"sent": 0, "acked": 0, "retransmits": 0, "failed": 0, "expired": 0}
+
+    def send(self, msg: dict, timeout: Optional[float] = None) -> bool:
+        """Send one envelope; False if no window slot freed up within `timeout`.
+
+        ValueError if a QoS 1 envelope's ts_ms or ttl_ms is not an integer.
+        """
+        if int(msg.get("qos", 0)) < 1:
+            self.sock.sendto(codec.encode(msg), self.addr)
+            self.stats["sent"] += 1
+            return True
+        msg_id = msg.get("id") or new_id()
+        msg["id"] = msg_id
+        msg.setdefault("ts_ms", epoch_ms())
+        is_expired(msg, 0)  # raises ValueError now rather than in the retransmit thread
+        raw = codec.encode(msg)
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._pending) < self.window or self._closed, timeout):
+                return False
+            now = time.monotonic()
+            self._pending[msg_id] = [raw, msg, now, now, 0]
+            self.sock.sendto(raw, self.addr)
+            self.stats["sent"] += 1
+            if self._thread is None:  # the socket is bound now, so acks can come back to it
+                self._thread = threading.Thread(target=self._run, name="qos-retransmit", daemon=True)
+                self._thread.start()
+        return True
+
+    def in_flight(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every QoS 1 message is acked or given up."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(1.0)
+
+    def _on_rtt(self, sample: float) -> None:
+        if self.srtt is None:
+            self.srtt, self.rttvar = sample, sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.rto = min(self.rto_max, max(self.rto_min, self.srtt + 4 * self.rttvar))
+
+    def _on_ack(self, ids) -> None:
+        now = time.monotonic()
+        with self._cond:
+            for msg_id in ids:
+                entry = self._pending.pop(msg_id, None)
+                if entry is None:
+                    continue  # duplicate ack for a retransmitted message
+                if entry[4] == 0:  # Karn: a retransmitted message's RTT is ambiguous
+                    self._on_rtt(now - entry[2])
+                self.stats["acked"] += 1
+            self._cond.notify_all()
+
+    def _retransmit(self) -> None:
+        now, now_ms = time.monotonic(), epoch_ms()
+        with self._cond:
+            for msg_id, entry in list(self._pending.items()):
+                raw, msg, _, last, retries = entry
+                if now - last < min(self.rto_max, self.rto * (2 ** retries)):
+                    continue
+                try:
+                    expired = is_expired(msg, now_ms)
+                except ValueError:  # ts_ms/ttl_ms rewritten after send(): give the message up
+                    expired, retries = False, self.max_retries
+                if expired:
+                    del self._pending[msg_id]
+                    self.stats["expired"] += 1
+                elif retries >= self.max_retries:
+                    del self._pending[msg_id]
+                    self.stats["failed"] += 1
+                else:
+                    self.sock.sendto(raw, self.addr)
+                    entry[3], entry[4] = now, retries + 1
+                    self.stats["retransmits"] += 1
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        buf = bytearray(65535)
+        while not self._closed:
+            self.sock.settimeout(max(self.rto_min, self.rto / 4))
+            try:
+                n, _ = self.sock.recvfrom_into(buf)
+                ack = codec.decode(memoryview(buf)[:n])
+                if ack.get("type") == ACK_TYPE:
+                    self._on_ack(ack.get("ids", ()))
+            except socket.timeout:
+                pass
+            except (OSError, ValueError):
+                if self.sock.fileno() == -1:
+                    return
+            self._retransmit()
+
+
+class QosFilter:
+    """The receive-side QoS rules, for any source of datagrams.
+
+    Expired messages are dropped (binary ones before decoding), QoS 1
+    messages are acked to their sender (one ACK datagram per sender per
+    wakeup) and duplicates are dropped by id.
+    """
+
+    def __init__(self, dedup: Optional[DedupWindow] = None):
+        self.dedup = dedup if dedup is not None else DedupWindow()
+        self.stats = {"messages": 0, "expired": 0, "duplicates": 0, "acks": 0, "errors": 0}
+
+    def feed(self, view, addr, now_ms: int, out: list, acks: dict) -> None:
+        """Decode one datagram into `out`; ids to ack are collected per sender in `acks`."""
+        for part in split_batch(view):
+            try:
+                deadline = codec.peek_deadline(part)
+                if deadline is not None and now_ms > deadline:
+                    self.stats["expired"] += 1
+                    continue
+                msg = codec.decode(part)
+                if not isinstance(msg, dict):
+                    raise ValueError("message is not an object")
+                expired = is_expired(msg, now_ms)
+                qos, mid = msg.get("qos", 0), msg.get("id")
+                if type(qos) is not int or not isinstance(mid, (str, type(None))):
+                    raise ValueError("malformed qos or id")
+            except (ValueError, struct.error, KeyError, IndexError, UnicodeDecodeError):
+                self.stats["errors"] += 1
+                continue
+            if expired:
+                self.stats["expired"] += 1
+                continue
+            if qos >= 1 and mid:
+                acks.setdefault(addr, []).append(mid)
+                if self.dedup.seen(mid):
+                    self.stats["duplicates"] += 1
+                    continue
+            out.append(msg)
+
+    def send_acks(self, sendto, acks: dict) -> None:
+        """Ack through `sendto(data, addr)` (a socket's, or an asyncio transport's)."""
+        for addr, ids in acks.items():
+            for i in range(0, len(ids), ACK_MAX_IDS):
+                try:
+                    sendto(codec.JSON.encode({"type": ACK_TYPE, "ids": ids[i:i + ACK_MAX_IDS]}), addr)
+                    self.stats["acks"] += 1
+                except OSError:
+                    pass
+
+
+class QosReceiver(QosFilter):
+    """BulkReceiver wrapper that honours envelope QoS (see QosFilter)."""
+
+    def __init__(self, sock: socket.socket, dedup: Optional[DedupWindow] = None, **kwargs):
+        super().__init__(dedup)
+        self.sock = sock
+        self.rx = BulkReceiver(sock, **kwargs)
+
+    def recv_batch(self) -> list[dict]:
+        out, acks = [], {}
+        now_ms = epoch_ms()
+        views = self.rx.recv_views()
+        for view, addr in zip(views, self.rx.addrs):
+            self.feed(view, addr, now_ms, out, acks)
+        if not self.rx.intact():  # shared memory: the producer overwrote what we just decoded
+            self.stats["errors"] += len(out)
+            return []
+        self.send_acks(self.sock.sendto, acks)
+        self.stats["messages"] += len(out)
+        return out
+
+    def __iter__(self):
+        while True:
+            yield from self.recv_batch()
+
+
 # ---------------- TCP helpers (RPC) -----------------
 
 
@@ -54,28 +391,241 @@ def tcp_connect(host: str, port: int, timeout_s: float = 5.0) -> socket.socket:
     return socket.create_connection((host, port), timeout=timeout_s)
 
 
+# ---------------- framing -----------------
+
+# Every TCP message is a 4-byte big-endian length followed by that many bytes.
+FRAME_HDR = struct.Struct("!I")
+MAX_FRAME = int(os.getenv("DEMO_MAX_FRAME", str(16 << 20)))  # larger frames close the connection
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")  # not on Windows
+
+
+class FrameTooLarge(ValueError):
+    """A peer announced a frame above the configured limit."""
+
+
+class FrameDecoder:
+    """Incremental length-prefixed frame parser over one reusable bytearray.
+
+    Bytes are read straight into the buffer (``get_buffer`` / ``buffer_updated``,
+    the asyncio BufferedProtocol contract) and every complete frame in it is
+    returned by ``frames()`` as a memoryview. Views stay valid until the next
+    ``get_buffer()``; decode them before reading again. The buffer grows to
+    fit the largest frame seen, never beyond ``max_frame``.
+    """
+
+    def __init__(self, max_frame: int = MAX_FRAME, initial_size: int = 64 * 1024):
+        self.max_frame = max_frame
+        self._buf = bytearray(initial_size)
+        self._start = 0  # first unparsed byte
+        self._end = 0    # one past the last received byte
+        self._need = FRAME_HDR.size  # bytes the frame at _start needs in total
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        want = max(self._need - (self._end - self._start), sizehint, 4096)
+        if len(self._buf) - self._end < want:
+            pending = self._end - self._start
+            if pending + want <= len(self._buf):
+                self._buf[:pending] = self._buf[self._start:self._end]  # compact in place
+            else:
+                grown = bytearray(max(len(self._buf) * 2, pending + want))
+                grown[:pending] = self._buf[self._start:self._end]
+                self._buf = grown
+            self._start, self._end = 0, pending
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._end += nbytes
+
+    def feed(self, data) -> None:
+        """Copy in bytes that arrived some other way (e.g. Protocol.data_received)."""
+        n = len(data)
+        self.get_buffer(n)[:n] = data
+        self.buffer_updated(n)
+
+    def frames(self) -> list[memoryview]:
+        out = []
+        buf, start, end = self._buf, self._start, self._end
+        mv = memoryview(buf)
+        while end - start >= FRAME_HDR.size:
+            (n,) = FRAME_HDR.unpack_from(buf, start)
+            if n > self.max_frame:
+                raise FrameTooLarge(f"frame of {n} bytes exceeds limit of {self.max_frame}")
+            if end - start < FRAME_HDR.size + n:
+                self._need = FRAME_HDR.size + n
+                break
+            out.append(mv[start + FRAME_HDR.size: start + FRAME_HDR.size + n])
+            start += FRAME_HDR.size + n
+        else:
+            self._need = FRAME_HDR.size
+        self._start = start
+        if start == end:
+            self._start = self._end = 0  # nothing pending: reuse the buffer from the front
+        return out
+
+    @property
+    def buffered(self) -> int:
+        return self._end - self._start
+
+
+class FrameReader:
+    """Blocking frame reader for one socket: one recv_into per wakeup, many frames per read."""
+
+    def __init__(self, sock: socket.socket, max_frame: int = MAX_FRAME):
+        self.sock = sock
+        self.decoder = FrameDecoder(max_frame)
+        self._ready: list[memoryview] = []
+
+    def read(self) -> memoryview:
+        """Next frame (valid until the following read()); ConnectionError at EOF."""
+        while not self._ready:
+            n = self.sock.recv_into(self.decoder.get_buffer())
+            if not n:
+                raise ConnectionError("connection closed")
+            self.decoder.buffer_updated(n)
+            self._ready = self.decoder.frames()
+            self._ready.reverse()
+        return self._ready.pop()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except ConnectionError:
+                return
+
+
+def _recv_exact(conn: socket.socket, n: int) -> bytearray:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = conn.recv_into(view[got:])
+        if not k:
+            raise ConnectionError("connection closed")
+        got += k
+    return buf
+
+
+def recv_frame(conn: socket.socket, max_frame: int = MAX_FRAME) -> bytearray:
+    """Read exactly one frame without consuming anything after it (use FrameReader to stream)."""
+    (n,) = FRAME_HDR.unpack(_recv_exact(conn, FRAME_HDR.size))
+    if n > max_frame:
+        raise FrameTooLarge(f"frame of {n} bytes exceeds limit of {max_frame}")
+    return _recv_exact(conn, n)
+
+
+def send_frame(conn: socket.socket, raw: bytes) -> None:
+    """Write header and body with one vectored send, without joining them first."""
+    hdr = FRAME_HDR.pack(len(raw))
+    if not _HAS_SENDMSG:
+        conn.sendall(hdr + raw)
+        return
+    sent = conn.sendmsg([hdr, raw])
+    total = len(hdr) + len(raw)
+    if sent < total:  # short write (large body, full socket buffer): finish the remainder
+        if sent < len(hdr):
+            conn.sendall(hdr[sent:])
+            sent = len(hdr)
+        conn.sendall(memoryview(raw)[sent - len(hdr):])
+
+
+def write_frame(transport: asyncio.WriteTransport, raw: bytes) -> None:
+    """asyncio counterpart of send_frame."""
+    transport.writelines((FRAME_HDR.pack(len(raw)), raw))
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """asyncio protocol that receives straight into a FrameDecoder and calls
+    ``frame_received(view)`` per frame. ``drain()`` honours write flow control."""
+
+    max_frame = MAX_FRAME
+
+    def __init__(self):
+        self.decoder = FrameDecoder(self.max_frame)
+        self.transport: Optional[asyncio.Transport] = None
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.decoder.buffer_updated(nbytes)
+        try:
+            for view in self.decoder.frames():
+                self.frame_received(view)
+        except ValueError:  # oversized frame or undecodable message: drop the peer
+            self.transport.abort()
+
+    def frame_received(self, view: memoryview) -> None:
+        raise NotImplementedError
+
+    def pause_writing(self) -> None:
+        self._writable.clear()
+
+    def resume_writing(self) -> None:
+        self._writable.set()
+
+    def connection_lost(self, exc) -> None:
+        self._writable.set()  # never leave a drain() waiting on a dead connection
+
+    async def drain(self) -> None:
+        await self._writable.wait()
+
+
+# ---------------- TCP messages -----------------
+
+
 def send_json(conn: socket.socket, obj: dict) -> None:
     """Send a length-prefixed JSON object over TCP."""
-    raw = json.dumps(obj).encode("utf-8")
-    hdr = struct.pack("!I", len(raw))
-    conn.sendall(hdr + raw)
+    send_frame(conn, json.dumps(obj).encode("utf-8"))
 
 
 def recv_json(conn: socket.socket) -> dict:
     """Receive a length-prefixed JSON object over TCP."""
+    return json.loads(recv_frame(conn))
+
+
+def send_msg(conn: socket.socket, obj: dict, content_type: Optional[str] = None) -> None:
+    """Send a length-prefixed envelope; content_type overrides the envelope's own."""
+    raw = codec.get_codec(content_type).encode(obj) if content_type else codec.encode(obj)
+    send_frame(conn, raw)
+
+
+def recv_msg(conn: socket.socket) -> dict:
+    """Receive a length-prefixed envelope in either codec."""
+    return codec.decode(recv_frame(conn))
+
+
+# ---------------- readiness -----------------
+
+# A launcher that wants to know when a service is up (rather than sleeping and
+# hoping) passes one of these; the service reports once its sockets are bound.
+READY_FD = "DEMO_READY_FD"      # inherited pipe fd: one "READY <service>" line
+READY_ADDR = "DEMO_READY_ADDR"  # host:port: one "READY <service>" UDP datagram
 
-    def recvn(n: int) -> bytes:
-        buf = b""
-        while len(buf) < n:
-            chunk = conn.recv(n - len(buf))
-            if not chunk:
-                raise ConnectionError("connection closed")
-            buf += chunk
-        return buf
 
-    (length,) = struct.unpack("!I", recvn(4))
-    raw = recvn(length)
-    return json.loads(raw.decode("utf-8"))
+def notify_ready(service: str) -> None:
+    """Tell the launcher, if there is one, that `service` is accepting traffic."""
+    line = f"READY {service}\n".encode("utf-8")
+    fd = os.environ.pop(READY_FD, None)  # popped: processes we start must not answer for us
+    if fd:
+        try:
+            os.write(int(fd), line)
+            os.close(int(fd))
+        except (OSError, ValueError):
+            pass
+    addr = os.environ.pop(READY_ADDR, None)
+    if addr:
+        host, _, port = addr.rpartition(":")
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.sendto(line, (host or "127.0.0.1", int(port)))
+        except (OSError, ValueError):
+            pass
 
 
 # ---------------- Time helper -----------------
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional
+
+
+# request fields that differ between retries of the same command
+VOLATILE_KEYS = frozenset(("correlation_id", "id", "ts_ms", "ttl_ms", "content_type", "qos", "source"))
+
+
+def flight_key(req: dict) -> tuple:
+    """Requests with equal keys ask for the same thing (method, target and arguments)."""
+    args = {k: v for k, v in req.items() if k not in VOLATILE_KEYS}
+    return req.get("method", ""), req.get("target"), json.dumps(args, sort_keys=True, default=str)
+
+
+# ---------------- response cache -----------------
+
+
+class ResponseCache:
+    """Responses kept for `ttl_s` seconds, at most `max_entries` (least recently used evicted first)."""
+
+    def __init__(self, ttl_s: float, max_entries: int = 10_000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, response: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ---------------- single-flight -----------------
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one execution of fn (threads)."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], object]) -> tuple[object, bool]:
+        """(result, shared); shared is True for callers that waited on another's call.
+        An exception from fn is raised in every caller."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> tuple[object, bool]:
+        fut = self._calls.get(key)
+        if fut is not None:
+            # a waiter that gets cancelled must not cancel the shared call
+            return await asyncio.shield(fut), True
+        fut = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except BaseException as e:
+            # the leader's cancellation is its own: waiters get an ordinary error they can answer with
+            fut.set_exception(RuntimeError("shared call was cancelled")
+                              if isinstance(e, asyncio.CancelledError) else e)
+            fut.exception()  # retrieved: no "never retrieved" warning when nobody waited
+            raise
+        else:
+            fut.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+
+# ---------------- idempotency layer -----------------
+
+
+class Idempotency:
+    """Answer retries from a cache and run identical concurrent requests once.
+
+    Successful responses are cached by (method, correlation_id) for `ttl_s`,
+    so a retried request gets the original answer without a second
+    execution. Requests with the same flight_key() that arrive while one is
+    executing wait for it and share its response. Exceptions are never
+    cached. Every caller gets its own shallow copy of the response.
+    """
+
+    def __init__(self, ttl_s: float = 30.0, max_entries: int = 10_000):
+        self.cache = ResponseCache(ttl_s, max_entries) if ttl_s > 0 else None
+        self.flights = SingleFlight()
+        self.async_flights = AsyncSingleFlight()
+        self.stats = {"executed": 0, "cache_hits": 0, "coalesced": 0}
+        self._stats_lock = threading.Lock()  # handler threads count concurrently
+
+    def _cached(self, ckey) -> Optional[dict]:
+        if self.cache is None or ckey[1] is None:
+            return None
+        res = self.cache.get(ckey)
+        if res is not None:
+            with self._stats_lock:
+                self.stats["cache_hits"] += 1
+        return res
+
+    def _store(self, ckey, res: dict, shared: bool) -> dict:
+        with self._stats_lock:
+            self.stats["coalesced" if shared else "executed"] += 1
+        if self.cache is not None and ckey[1] is not None:
+            self.cache.put(ckey, res)
+        return dict(res)
+
+    def call(self, req: dict, fn: Callable[[], dict]) -> dict:
+        ckey = (req.get("method", ""), req.get("correlation_id"))
+        res = self._cached(ckey)
+        if res is not None:
+            return dict(res)
+        res, shared = self.flights.do(flight_key(req), fn)
+        return self._store(ckey, res, shared)
+
+    async def call_async(self, req: dict, fn: Callable[[], Awaitable[dict]]) -> dict:
+        ckey = (req.get("method", ""), req.get("correlation_id"))
+        res = self._cached(ckey)
+        if res is not None:
+            return dict(res)
+        res, shared = await self.async_flights.do(flight_key(req), fn)
+        return self._store(ckey, res, shared)
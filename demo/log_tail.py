@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import ctypes
+import json
+import os
+import select
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+from audit import segment_paths
+
+
+CHUNK = 1 << 20
+
+# inotify(7) event masks
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+
+# ---------------- change notification -----------------
+
+
+class _Inotify:
+    """Directory watch via inotify (Linux only), used to sleep until the log changes."""
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(str(directory)), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch failed for {directory}")
+        self.fd = fd
+
+    def wait(self, timeout_s: float) -> None:
+        ready, _, _ = select.select([self.fd], [], [], timeout_s)
+        if ready:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _Poller:
+    """Fallback when inotify is unavailable: just sleep."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+
+    def wait(self, timeout_s: float) -> None:
+        time.sleep(min(timeout_s, self.interval_s))
+
+    def close(self) -> None:
+        pass
+
+
+# ---------------- tailer -----------------
+
+
+class LogTailer:
+    """Follow a line-oriented log file by (inode, offset).
+
+    Only bytes appended since the last read are parsed. If the path is
+    renamed away (rotation) the old file is drained to EOF before switching
+    to the new one; if the file shrinks (truncation) reading restarts at 0.
+    With ``checkpoint_path`` the position, plus any caller state kept in
+    ``meta``, is persisted so a restart resumes where it left off, reading
+    every segment rotated while the process was down, oldest first.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        checkpoint_path: Path | str | None = None,
+        poll_interval_s: float = 1.0,
+        checkpoint_every_s: float = 1.0,
+        use_inotify: bool = True,
+        start_at_end: bool = False,
+    ):
+        self.path = Path(path)
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path else None
+        self.poll_interval_s = poll_interval_s
+        self.checkpoint_every_s = checkpoint_every_s
+        self.start_at_end = start_at_end
+        self.meta: dict = {}
+        self.offset = 0  # byte offset just past the last complete line returned
+        self._f = None
+        self._ident: Optional[tuple[int, int]] = None
+        self._partial = bytearray()
+        self._pending: list[Path] = []  # rotated segments still to read before the live file
+        self._last_checkpoint = 0.0
+        self._notifier = self._make_notifier(use_inotify)
+        self._load_checkpoint()
+
+    def _make_notifier(self, use_inotify: bool):
+        if use_inotify:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                return _Inotify(self.path.parent)
+            except (OSError, AttributeError):
+                pass
+        return _Poller(self.poll_interval_s)
+
+    # ---------------- file handling -----------------
+
+    def _open(self, path: Path, offset: int) -> bool:
+        try:
+            f = path.open("rb")
+        except FileNotFoundError:
+            return False
+        st = os.fstat(f.fileno())
+        if offset > st.st_size:
+            offset = 0
+        f.seek(offset)
+        self._close_file()
+        self._f, self._ident, self.offset = f, (st.st_dev, st.st_ino), offset
+        self._partial.clear()
+        return True
+
+    def _close_file(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def _drain(self) -> list[bytes]:
+        lines: list[bytes] = []
+        while True:
+            data = self._f.read(CHUNK)
+            if not data:
+                return lines
+            self._partial += data
+            end = self._partial.rfind(b"\n")
+            if end < 0:
+                continue
+            complete = bytes(self._partial[:end])
+            del self._partial[: end + 1]
+            self.offset += end + 1
+            lines.extend(complete.split(b"\n"))
+
+    def read_new(self) -> list[bytes]:
+        """Return complete lines appended since the previous call (without newlines)."""
+        if self._f is None:
+            if not self._open(self.path, 0):
+                return []
+            if self.start_at_end:
+                self._f.seek(0, os.SEEK_END)
+                self.offset = self._f.tell()
+        lines = self._drain()
+
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return lines  # rotated away and not recreated yet; keep the old handle
+        if (st.st_dev, st.st_ino) != self._ident:
+            # rotated: the writer may have appended to the old inode right before the rename
+            lines += self._drain()
+            while self._pending:  # rotated while we were down, after the checkpointed segment
+                if self._open(self._pending.pop(0), 0):
+                    lines += self._drain()
+            if self._open(self.path, 0):
+                lines += self._drain()
+        elif st.st_size < self.offset + len(self._partial):
+            # truncated in place
+            self._open(self.path, 0)
+            lines += self._drain()
+        return lines
+
+    def follow(self, idle_timeout_s: Optional[float] = None) -> Iterator[bytes]:
+        """Yield lines forever (or until nothing arrives for ``idle_timeout_s``)."""
+        idle_since = time.monotonic()
+        while True:
+            lines = self.read_new()
+            if lines:
+                yield from lines
+                idle_since = time.monotonic()
+                self.maybe_checkpoint()
+                continue
+            if idle_timeout_s is not None and time.monotonic() - idle_since >= idle_timeout_s:
+                return
+            self._notifier.wait(self.poll_interval_s)
+
+    def close(self) -> None:
+        self.save_checkpoint()
+        self._close_file()
+        self._notifier.close()
+
+    # ---------------- checkpoint -----------------
+
+    def maybe_checkpoint(self) -> None:
+        if time.monotonic() - self._last_checkpoint >= self.checkpoint_every_s:
+            self.save_checkpoint()
+
+    def save_checkpoint(self) -> None:
+        if self.checkpoint_path is None or self._ident is None:
+            return
+        dev, ino = self._ident
+        state = {"dev": dev, "ino": ino, "offset": self.offset, "meta": self.meta}
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+    def _load_checkpoint(self) -> None:
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return
+        try:
+            state = json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+            ident = (int(state["dev"]), int(state["ino"]))
+            offset = int(state["offset"])
+        except (ValueError, KeyError, TypeError):
+            return
+        self.meta = state.get("meta") or {}
+        # oldest first: every rotated segment after the checkpointed one is read in turn
+        segments = segment_paths(self.path)
+        for i, candidate in enumerate(segments):
+            try:
+                st = candidate.stat()
+            except FileNotFoundError:
+                continue
+            if (st.st_dev, st.st_ino) == ident:
+                # may be a rotated segment; read_new() drains it and the later ones, then self.path
+                self._open(candidate, offset)
+                self._pending = [p for p in segments[i + 1:] if p != self.path]
+                return
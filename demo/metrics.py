@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+
+# Exporters (all off by default):
+#   DEMO_METRICS_FILE   snapshot path, rewritten every DEMO_METRICS_INTERVAL_S; "{service}" is substituted
+#   DEMO_METRICS_PORT   serve GET /metrics (JSON) on 127.0.0.1:<port>; 0 => off
+# Logging:
+#   DEMO_LOG_LEVEL      debug | info | warn | error
+#   DEMO_LOG_SAMPLE_S   sampled log lines print at most once per this many seconds per key
+METRICS_FILE = os.getenv("DEMO_METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("DEMO_METRICS_PORT", "0"))
+METRICS_INTERVAL_S = float(os.getenv("DEMO_METRICS_INTERVAL_S", "5"))
+LOG_LEVEL = os.getenv("DEMO_LOG_LEVEL", "info")
+LOG_SAMPLE_S = float(os.getenv("DEMO_LOG_SAMPLE_S", "1"))
+
+
+# ---------------- instruments -----------------
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1) -> None:
+        with self._lock:
+            self.value += n
+
+
+class Histogram:
+    """Log-linear (HDR-style) histogram of non-negative integers, e.g. microseconds.
+
+    Values below 2 * 2**bits are counted exactly; above that each power-of-two
+    range is split into 2**bits buckets, so any recorded value is reported
+    within about 1 / 2**bits (3% at the default 5 bits). Memory is a few
+    hundred counters whatever the range.
+    """
+
+    def __init__(self, bits: int = 5):
+        self.bits = bits
+        self.sub = 1 << bits
+        self.counts: list[int] = []
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def _index(self, v: int) -> int:
+        shift = v.bit_length() - self.bits - 1
+        return v if shift <= 0 else shift * self.sub + (v >> shift)
+
+    def _lower(self, idx: int) -> int:
+        if idx < 2 * self.sub:
+            return idx
+        shift = idx // self.sub - 1
+        return (idx - shift * self.sub) << shift
+
+    def record(self, value: int) -> None:
+        v = max(0, int(value))
+        idx = self._index(v)
+        with self._lock:
+            counts = self.counts
+            if idx >= len(counts):
+                counts.extend([0] * (idx + 1 - len(counts)))
+            counts[idx] += 1
+            self.count += 1
+            self.total += v
+            if self.min is None or v < self.min:
+                self.min = v
+            if v > self.max:
+                self.max = v
+
+    def observe_s(self, seconds: float) -> None:
+        """Record a duration given in seconds, as microseconds."""
+        self.record(seconds * 1e6)
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_s(time.perf_counter() - t0)
+
+    def percentile(self, q: float) -> int:
+        with self._lock:
+            if not self.count:
+                return 0
+            rank = max(1, int(round(q / 100 * self.count)))
+            seen = 0
+            for idx, c in enumerate(self.counts):
+                seen += c
+                if seen >= rank:
+                    return min(max(self._lower(idx), self.min), self.max)
+            return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": self.min,
+            "mean": round(self.total / self.count, 1),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max,
+        }
+
+    def export(self) -> dict:
+        """Raw state, e.g. to ship to another process and merge() there."""
+        with self._lock:
+            return {"bits": self.bits, "counts": list(self.counts), "count": self.count,
+                    "total": self.total, "min": self.min, "max": self.max}
+
+    def merge(self, state: dict) -> None:
+        """Add another histogram's export() (same bits) into this one."""
+        if state["bits"] != self.bits:
+            raise ValueError(f"cannot merge a {state['bits']}-bit histogram into a {self.bits}-bit one")
+        if not state["count"]:
+            return
+        with self._lock:
+            counts = self.counts
+            if len(state["counts"]) > len(counts):
+                counts.extend([0] * (len(state["counts"]) - len(counts)))
+            for i, c in enumerate(state["counts"]):
+                counts[i] += c
+            self.count += state["count"]
+            self.total += state["total"]
+            if self.min is None or state["min"] < self.min:
+                self.min = state["min"]
+            self.max = max(self.max, state["max"])
+
+
+class Registry:
+    """Named counters, histograms and gauges (callables sampled at snapshot time)."""
+
+    def __init__(self):
+        self.counters: dict[str, Counter] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.gauges: dict[str, Callable[[], object]] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def counter(self, name: str) -> Counter:
+        c = self.counters.get(name)
+        if c is None:
+            with self._lock:
+                c = self.counters.setdefault(name, Counter())
+        return c
+
+    def histogram(self, name: str) -> Histogram:
+        h = self.histograms.get(name)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(name, Histogram())
+        return h
+
+    def gauge(self, name: str, fn: Callable[[], object]) -> None:
+        self.gauges[name] = fn
+
+    def sample_gauges(self) -> dict:
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:  # a gauge must never break the exporter
+                gauges[name] = repr(e)
+        return gauges
+
+    def export(self) -> dict:
+        """Raw counters and histograms plus sampled gauges; picklable and JSON-safe."""
+        return {
+            "counters": {k: c.value for k, c in self.counters.items()},
+            "histograms": {k: h.export() for k, h in self.histograms.items()},
+            "gauges": self.sample_gauges(),
+        }
+
+    def merge(self, export: dict) -> None:
+        """Add another registry's export() into this one (gauges are not merged)."""
+        for k, v in export["counters"].items():
+            self.counter(k).inc(v)
+        for k, state in export["histograms"].items():
+            self.histogram(k).merge(state)
+
+    def snapshot(self) -> dict:
+        gauges = self.sample_gauges()
+        return {
+            "ts_ms": int(time.time() * 1000),
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": {k: c.value for k, c in sorted(self.counters.items())},
+            "gauges": gauges,
+            "histograms_us": {k: h.summary() for k, h in sorted(self.histograms.items())},
+        }
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str) -> Counter:
+    return REGISTRY.counter(name)
+
+
+def histogram(name: str) -> Histogram:
+    return REGISTRY.histogram(name)
+
+
+def gauge(name: str, fn: Callable[[], object]) -> None:
+    REGISTRY.gauge(name, fn)
+
+
+def since_ms_us(ts_ms) -> Optional[int]:
+    """Microseconds since an envelope's epoch-ms timestamp (None without a valid one)."""
+    if type(ts_ms) is not int:
+        return None
+    return max(0, int(time.time() * 1e6) - ts_ms * 1000)
+
+
+# ---------------- exporters -----------------
+
+
+def write_snapshot(path: Path, registry: Registry = REGISTRY, service: str = "") -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"service": service, **registry.snapshot()}, indent=1))
+    os.replace(tmp, path)  # readers never see a half-written file
+
+
+def _snapshot_loop(path: Path, interval_s: float, registry: Registry, service: str) -> None:
+    while True:
+        time.sleep(interval_s)
+        try:
+            write_snapshot(path, registry, service)
+        except OSError:
+            pass
+
+
+def serve_stats(port: int, registry: Registry = REGISTRY, service: str = "",
+                host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """GET /metrics (or /) returns the registry snapshot as JSON, from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = json.dumps({"service": service, **registry.snapshot()}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # keep request lines off stdout
+            pass
+
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics-http", daemon=True).start()
+    return srv
+
+
+def start_exporters(service: str, registry: Registry = REGISTRY) -> None:
+    """Start whichever exporters the DEMO_METRICS_* variables ask for."""
+    if METRICS_FILE:
+        path = Path(METRICS_FILE.format(service=service))
+        threading.Thread(target=_snapshot_loop, args=(path, METRICS_INTERVAL_S, registry, service),
+                         name="metrics-file", daemon=True).start()
+    if METRICS_PORT:
+        serve_stats(METRICS_PORT, registry, service)
+
+
+# ---------------- logging -----------------
+
+
+LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+
+
+class lazy:
+    """Log argument rendered only if the line is printed, e.g. lazy(json.dumps, msg)."""
+
+    __slots__ = ("fn", "args", "kwargs")
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+
+    def __str__(self) -> str:
+        return str(self.fn(*self.args, **self.kwargs))
+
+
+class Log:
+    """Leveled ``print(..., flush=True)`` with per-key sampling for hot paths.
+
+    ``log.sampled(key, ...)`` prints at most once per ``sample_s`` for each
+    key and appends how many lines were suppressed since the last one, so a
+    per-message log costs a dict lookup and a clock read, not an I/O.
+    Messages are only formatted when they are printed.
+    """
+
+    def __init__(self, prefix: str, level: str = LOG_LEVEL, sample_s: float = LOG_SAMPLE_S):
+        self.prefix = prefix
+        self.level = LEVELS.get(level.lower(), 20)
+        self.sample_s = sample_s
+        self._last: dict[str, float] = {}
+        self._suppressed: dict[str, int] = {}
+
+    def enabled(self, level: str) -> bool:
+        return LEVELS[level] >= self.level
+
+    def _emit(self, msg: str, args: tuple, suffix: str = "") -> None:
+        print(f"[{self.prefix}] " + (msg % args if args else msg) + suffix, flush=True)
+
+    def debug(self, msg: str, *args) -> None:
+        if self.level <= 10:
+            self._emit(msg, args)
+
+    def info(self, msg: str, *args) -> None:
+        if self.level <= 20:
+            self._emit(msg, args)
+
+    def warn(self, msg: str, *args) -> None:
+        if self.level <= 30:
+            self._emit(msg, args)
+
+    def error(self, msg: str, *args) -> None:
+        self._emit(msg, args)
+
+    def sampled(self, key: str, msg: str, *args, level: str = "info") -> None:
+        if LEVELS[level] < self.level:
+            return
+        now = time.monotonic()
+        if now - self._last.get(key, -1e9) < self.sample_s:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return
+        self._last[key] = now
+        skipped = self._suppressed.pop(key, 0)
+        self._emit(msg, args, f" (+{skipped} more)" if skipped else "")
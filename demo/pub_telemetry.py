@@ -1,32 +1,216 @@
 # demo/pub_telemetry.py
-import socket, json, time, uuid, random
+import os, time, uuid, random, multiprocessing as mp
+import codec
+import uuri as _uuri
+from bulk_io import BatchSender
+from common import TRANSPORT, ReliableSender, epoch_ms, open_sender, publish_addr
+from ids import new_id, new_ids
 
 SUB_PORT = 50052  # where subscriber is listening
+COUNT = int(os.getenv("PUB_COUNT", "0"))  # 0 => run forever
+CONTENT_TYPE = codec.CT_BINARY if os.getenv("PUB_CODEC", "json") == "binary" else codec.CT_JSON
+QOS = int(os.getenv("PUB_QOS", "0"))  # 1 => acked and retransmitted (demo mode)
+
+# load-generator mode (PUB_RATE > 0)
+RATE = float(os.getenv("PUB_RATE", "0"))             # aggregate msgs/s; 0 => one event per second
+VEHICLES = int(os.getenv("PUB_VEHICLES", "1"))
+TOPICS = int(os.getenv("PUB_TOPICS", "1"))           # signals per vehicle; the first is speed
+PROCS = int(os.getenv("PUB_PROCS", "1"))             # publisher processes sharing the rate
+DURATION_S = float(os.getenv("PUB_DURATION_S", "0")) # 0 => until COUNT or forever
+BURST = os.getenv("PUB_BURST", "")                   # "<base_s>:<burst_s>:<multiplier>", e.g. "4:1:5"
+BATCH_BYTES = int(os.getenv("PUB_BATCH_BYTES", "16384"))
+
+SIGNALS = ["speed", "rpm", "fuel", "coolant", "battery", "odometer"]
 
 def uuri(authority, ue_id, resource, v=1):
-    return f"up://{authority}/{ue_id}{resource}?v={v}"
+    return str(_uuri.uuri(authority, ue_id, resource, v))
 
 def build_speed_event(kmh: int):
     return {
         "type": "EVENT",
-        "id": str(uuid.uuid4()),
+        "id": new_id(),
         "source": uuri("car-01", "vehicle.telemetry", "/publisher"),
         "target": uuri("car-01", "vehicle.telemetry", "/speed"),
-        "content_type": "application/json",
+        "content_type": CONTENT_TYPE,
         "payload": {"kmh": kmh, "timestamp_ms": int(time.time() * 1000)},
-        "qos": 0,
+        "qos": QOS,
         "ttl_ms": 2000,
+        "ts_ms": epoch_ms(),
     }
 
+# ---------------- load generator -----------------
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens/s, holding at most `burst` tokens."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.perf_counter()
+
+    def take(self, want: int) -> int:
+        """Take up to `want` tokens; returns how many were granted (possibly 0)."""
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        got = min(want, int(self.tokens))
+        self.tokens -= got
+        return got
+
+    def wait_s(self) -> float:
+        """Time until at least one token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 0.1
+
+class BurstProfile:
+    """Square wave: base rate for base_s, then rate * multiplier for burst_s."""
+
+    def __init__(self, spec: str):
+        base_s, burst_s, mult = spec.split(":")
+        self.base_s, self.burst_s, self.mult = float(base_s), float(burst_s), float(mult)
+
+    def factor(self, t: float) -> float:
+        return self.mult if t % (self.base_s + self.burst_s) >= self.base_s else 1.0
+
+class EnvelopeTemplate:
+    """An envelope encoded once; per message only the id, value and timestamp bytes are patched."""
+
+    ID_STR = "eeeeeeee-eeee-4eee-aeee-eeeeeeeeeeee"  # sentinel values, spliced out below
+    ID_RAW = uuid.UUID(ID_STR).bytes
+    VALUE = 987654321
+    TS = 123456789012345
+
+    def __init__(self, vehicle: str, signal: str, content_type: str):
+        field = "kmh" if signal == "speed" else "value"
+        raw = codec.get_codec(content_type).encode({
+            "type": "EVENT",
+            "id": self.ID_STR,
+            "source": uuri(vehicle, "vehicle.telemetry", "/publisher"),
+            "target": uuri(vehicle, "vehicle.telemetry", f"/{signal}"),
+            "content_type": content_type,
+            "payload": {field: self.VALUE, "timestamp_ms": self.TS},
+            "qos": 0,
+            "ttl_ms": 2000,
+        })
+        self.binary_id = content_type == codec.CT_BINARY
+        id_mark = self.ID_RAW if self.binary_id else self.ID_STR.encode()
+        head, rest = raw.split(id_mark, 1)
+        mid, rest = rest.split(str(self.VALUE).encode(), 1)
+        mid2, tail = rest.split(str(self.TS).encode(), 1)
+        self.parts = (head, mid, mid2, tail)
+
+    def render(self, msg_id, value: int, ts_bytes: bytes) -> bytes:
+        head, mid, mid2, tail = self.parts
+        return b"".join((head, msg_id, mid, b"%d" % value, mid2, ts_bytes, tail))
+
+class IdSequence:
+    """Time-ordered ids in wire form (raw bytes, or the JSON string), taken from blocks of ids."""
+
+    BLOCK = 256
+
+    def __init__(self, binary: bool):
+        self.binary = binary
+        self._ready: list[bytes] = []
+
+    def next(self) -> bytes:
+        if not self._ready:
+            block = new_ids(self.BLOCK)
+            block.reverse()
+            self._ready = block if self.binary else [str(i).encode() for i in block]
+        return self._ready.pop()
+
+def loadgen_worker(addr, rate: float, vehicles: list[str], topics: int, content_type: str,
+                   duration_s: float, count: int, burst: str, stats=None) -> int:
+    """Send prebuilt envelopes for `vehicles` x `topics` at `rate` msgs/s; returns messages sent."""
+    sock = open_sender()
+    out = BatchSender(sock, addr, max_bytes=BATCH_BYTES, linger_ms=1000)
+    templates = [EnvelopeTemplate(v, SIGNALS[j % len(SIGNALS)] if j < len(SIGNALS) else f"signal{j}",
+                                  content_type)
+                 for v in vehicles for j in range(topics)]
+    ids = IdSequence(content_type == codec.CT_BINARY)
+    profile = BurstProfile(burst) if burst else None
+    bucket = TokenBucket(rate, burst=max(1.0, rate / 100))  # ~10 ms of slack
+    rnd = random.Random()
+    values = [rnd.randint(20, 120) for _ in range(997)]
+    sent, n_tpl = 0, len(templates)
+    start = time.perf_counter()
+    try:
+        while True:
+            elapsed = time.perf_counter() - start
+            if (duration_s and elapsed >= duration_s) or (count and sent >= count):
+                break
+            if profile is not None:
+                bucket.rate = rate * profile.factor(elapsed)
+            grant = bucket.take(min(4096, count - sent) if count else 4096)
+            if not grant:
+                out.flush()
+                time.sleep(min(bucket.wait_s(), 0.005))
+                continue
+            ts = b"%d" % int(time.time() * 1000)  # one clock read per grant, not per message
+            for i in range(sent, sent + grant):
+                out.send(templates[i % n_tpl].render(ids.next(), values[i % 997], ts))
+            sent += grant
+        out.flush()
+    finally:
+        sock.close()
+    if stats is not None:
+        stats.value = sent
+    return sent
+
+def run_loadgen(addr) -> None:
+    procs = max(1, PROCS)
+    vehicles = [f"car-{i:04d}" for i in range(VEHICLES)]
+    shards = [vehicles[i::procs] or vehicles[:1] for i in range(procs)]
+    per_count = -(-COUNT // procs) if COUNT else 0
+    if TRANSPORT == "shm" and procs > 1:
+        raise SystemExit("[pub] a shared-memory channel has a single producer: use PUB_PROCS=1")
+    print(f"[pub] loadgen -> {TRANSPORT}://{addr[0]}:{addr[1]}: {RATE:g} msgs/s, {VEHICLES} vehicles x {TOPICS} topics, "
+          f"{procs} process(es){', burst ' + BURST if BURST else ''}", flush=True)
+    started = time.perf_counter()
+    if procs == 1:
+        sent = loadgen_worker(addr, RATE, shards[0], TOPICS, CONTENT_TYPE, DURATION_S, COUNT, BURST)
+    else:
+        counters = [mp.Value("q", 0) for _ in range(procs)]
+        workers = [mp.Process(target=loadgen_worker,
+                              args=(addr, RATE / procs, shards[i], TOPICS, CONTENT_TYPE,
+                                    DURATION_S, per_count, BURST, counters[i]))
+                   for i in range(procs)]
+        for w in workers:
+            w.start()
+        try:
+            for w in workers:
+                w.join()
+        except KeyboardInterrupt:
+            for w in workers:
+                w.terminate()
+        sent = sum(c.value for c in counters)
+    elapsed = time.perf_counter() - started
+    print(f"[pub] sent {sent} messages in {elapsed:.2f}s ({sent / elapsed:,.0f} msgs/s)", flush=True)
+
 def main():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    print(f"[pub] sending to udp://127.0.0.1:{SUB_PORT} every 1s. Ctrl+C to stop.")
+    host, port = publish_addr(("127.0.0.1", SUB_PORT))
+    if RATE > 0:
+        run_loadgen((host, port))
+        return
+    sock = open_sender()
+    qos = QOS if TRANSPORT == "udp" else 0  # shared memory has no ack path, and loses nothing it has room for
+    batch = ReliableSender(sock, (host, port)) if qos else BatchSender(sock, (host, port))
+    print(f"[pub] sending to {TRANSPORT}://{host}:{port} every 1s (qos {qos}). Ctrl+C to stop.")
+    sent = 0
     while True:
         kmh = random.randint(20, 120)
         msg = build_speed_event(kmh)
-        sock.sendto(json.dumps(msg).encode("utf-8"), ("127.0.0.1", SUB_PORT))
-        print(f"[pub] -> speed {kmh} km/h (id={msg['id'][:8]}...)")
+        batch.send(msg)
+        if not qos:
+            batch.flush()
+        print(f"[pub] -> speed {kmh} km/h (id=...{str(msg['id'])[-12:]})")
+        sent += 1
+        if COUNT and sent >= COUNT:
+            break
         time.sleep(1)
+    if qos:
+        batch.flush(timeout=5.0)
+        print("[pub] qos stats:", batch.stats, flush=True)
 
 if __name__ == "__main__":
     main()
@@ -1,38 +1,152 @@
 # demo/rpc_client.py
-import os, json, uuid, socket, struct
+import os, json, socket, threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from common import FrameReader, send_msg
+from ids import new_id
+import codec
 
 HOST = os.getenv("RPC_HOST", "127.0.0.1")
 PORT = int(os.getenv("RPC_PORT", "6000"))
+POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "2"))
+CALLS = int(os.getenv("RPC_CALLS", "1"))  # >1 pipelines that many lock calls
+CONTENT_TYPE = codec.CT_BINARY if os.getenv("RPC_CODEC", "json") == "binary" else None
 
-def send_json(conn: socket.socket, obj: dict) -> None:
-    raw = json.dumps(obj).encode("utf-8")
-    hdr = struct.pack("!I", len(raw))
-    conn.sendall(hdr + raw)
-
-def recv_json(conn: socket.socket) -> dict:
-    def recvn(n: int) -> bytes:
-        buf = b""
-        while len(buf) < n:
-            chunk = conn.recv(n - len(buf))
-            if not chunk:
-                raise ConnectionError("connection closed")
-            buf += chunk
-        return buf
-
-    import struct
-    (length,) = struct.unpack("!I", recvn(4))
-    raw = recvn(length)
-    return json.loads(raw.decode("utf-8"))
 
-def main():
-    corr = str(uuid.uuid4())
-    req = {"method": "lock", "correlation_id": corr}
+class RpcClient:
+    """One long-lived connection; many requests in flight, replies matched by correlation_id."""
+
+    def __init__(self, host: str = HOST, port: int = PORT, timeout_s: float = 3.0,
+                 content_type: str | None = CONTENT_TYPE):
+        self.content_type = content_type  # None => plain JSON, as before
+        self._conn = socket.create_connection((host, port), timeout=timeout_s)
+        self._conn.settimeout(None)  # the reader thread blocks until replies arrive
+        self._conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending: dict[str, Future] = {}
+        self._error: Exception | None = None
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return self._error is None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def submit(self, method: str, **fields) -> Future:
+        """Send a request without waiting; the Future resolves to the response dict."""
+        corr = fields.pop("correlation_id", None) or new_id()
+        req = {"method": method, "correlation_id": corr, **fields}
+        fut: Future = Future()
+        with self._lock:
+            if self._error is not None:
+                raise ConnectionError(f"rpc connection unusable: {self._error!r}")
+            self._pending[corr] = fut
+        try:
+            with self._send_lock:
+                send_msg(self._conn, req, self.content_type)
+        except OSError as e:
+            self._fail(e)
+            raise
+        return fut
+
+    def call(self, method: str, timeout_s: float = 3.0, **fields) -> dict:
+        corr = fields.pop("correlation_id", None) or new_id()
+        fut = self.submit(method, correlation_id=corr, **fields)
+        try:
+            return fut.result(timeout_s)
+        except FutureTimeout:
+            with self._lock:  # a late reply is dropped; the slot must not count as in flight forever
+                self._pending.pop(corr, None)
+            raise
+
+    def close(self) -> None:
+        try:
+            self._conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._conn.close()
+        self._reader.join(timeout=1.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_loop(self) -> None:
+        reader = FrameReader(self._conn)  # many replies per recv when they arrive together
+        try:
+            while True:
+                res = codec.decode(reader.read())
+                with self._lock:
+                    fut = self._pending.pop(res.get("correlation_id"), None)
+                if fut is not None:
+                    fut.set_result(res)
+        except (OSError, ValueError) as e:  # ConnectionError is an OSError
+            self._fail(e)
+
+    def _fail(self, err: Exception) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = err
+            pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError(f"rpc connection lost: {err!r}"))
 
-    with socket.create_connection((HOST, PORT), timeout=3.0) as conn:
-        send_json(conn, req)
-        res = recv_json(conn)
 
-    print("[client] RESPONSE:", json.dumps(res), flush=True)
+class RpcPool:
+    """Small pool of RpcClients; each call goes to the least-loaded live connection."""
+
+    def __init__(self, host: str = HOST, port: int = PORT, size: int = POOL_SIZE, timeout_s: float = 3.0,
+                 content_type: str | None = CONTENT_TYPE):
+        self.host, self.port, self.size, self.timeout_s = host, port, max(1, size), timeout_s
+        self.content_type = content_type
+        self._clients: list[RpcClient] = []
+        self._lock = threading.Lock()
+
+    def _pick(self) -> RpcClient:
+        with self._lock:
+            dead = [c for c in self._clients if not c.alive]
+            for c in dead:
+                self._clients.remove(c)
+                c.close()
+            idle = [c for c in self._clients if c.in_flight == 0]
+            if not idle and len(self._clients) < self.size:
+                client = RpcClient(self.host, self.port, self.timeout_s, self.content_type)
+                self._clients.append(client)
+                return client
+            return min(self._clients, key=lambda c: c.in_flight)
+
+    def submit(self, method: str, **fields) -> Future:
+        return self._pick().submit(method, **fields)
+
+    def call(self, method: str, timeout_s: float = 3.0, **fields) -> dict:
+        return self._pick().call(method, timeout_s, **fields)
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for c in clients:
+            c.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    with RpcPool() as pool:
+        futures = [pool.submit("lock") for _ in range(CALLS)]
+        for fut in futures:
+            res = fut.result(timeout=3.0 + 0.1 * CALLS)
+            print("[client] RESPONSE:", json.dumps(res), flush=True)
 
 if __name__ == "__main__":
     main()
@@ -1,78 +1,480 @@
 # demo/rpc_server.py
-import os, json, time, uuid, socket, struct
+import os, time, socket, threading, asyncio, atexit, heapq, itertools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from audit import AuditWriter
+from common import FrameProtocol, FrameReader, notify_ready, send_msg, write_frame
+from idempotency import Idempotency
+from ids import new_id
+import codec
+import metrics
 
 HOST = os.getenv("RPC_HOST", "127.0.0.1")
 PORT = int(os.getenv("RPC_PORT", "6000"))
 AUDIT = Path("logs/audit.jsonl")
+MODE = os.getenv("RPC_MODE", "async")           # async | threaded
+WORKERS = int(os.getenv("RPC_WORKERS", "16"))   # executor size for blocking handlers
+
+# audit group commit / rotation
+AUDIT_BATCH = int(os.getenv("AUDIT_BATCH", "256"))
+AUDIT_FLUSH_MS = int(os.getenv("AUDIT_FLUSH_MS", "50"))
+AUDIT_QUEUE = int(os.getenv("AUDIT_QUEUE", "10000"))
+AUDIT_FSYNC = os.getenv("AUDIT_FSYNC", "never")          # never | batch | interval
+AUDIT_ROTATE_MB = float(os.getenv("AUDIT_ROTATE_MB", "0"))   # 0 => no size rotation
+AUDIT_ROTATE_S = float(os.getenv("AUDIT_ROTATE_S", "0"))     # 0 => no time rotation
+
+# responses of idempotent methods are replayed to retries with the same correlation_id
+IDEMPOTENCY_TTL_S = float(os.getenv("RPC_IDEMPOTENCY_TTL_S", "30"))  # 0 => no cache (still single-flight)
+IDEMPOTENCY_MAX = int(os.getenv("RPC_IDEMPOTENCY_MAX", "10000"))
+
+# deadline scheduling: requests carrying ts_ms + ttl_ms run earliest deadline first
+MAX_QUEUE = int(os.getenv("RPC_MAX_QUEUE", "1000"))          # pending requests before shedding
+LATENCY_ALPHA = float(os.getenv("RPC_LATENCY_ALPHA", "0.2"))  # EWMA weight of the newest handler time
+
+# priority classes: lower runs first, whatever the deadlines
+PRIORITY_SAFETY = 0
+PRIORITY_NORMAL = 1
+PRIORITY_COSMETIC = 2
 
 def epoch_ms() -> int:
     return int(time.time() * 1000)
 
-def send_json(conn: socket.socket, obj: dict) -> None:
-    raw = json.dumps(obj).encode("utf-8")
-    hdr = struct.pack("!I", len(raw))        # 4-byte length prefix (big-endian)
-    conn.sendall(hdr + raw)
-
-def recv_json(conn: socket.socket) -> dict:
-    # read 4-byte length, then that many bytes
-    def recvn(n: int) -> bytes:
-        buf = b""
-        while len(buf) < n:
-            chunk = conn.recv(n - len(buf))
-            if not chunk:
-                raise ConnectionError("connection closed")
-            buf += chunk
-        return buf
-
-    (n,) = struct.unpack("!I", recvn(4))
-    raw = recvn(n)
-    return json.loads(raw.decode("utf-8"))
+_audit: AuditWriter | None = None
+_audit_lock = threading.Lock()
+
+def audit_writer() -> AuditWriter:
+    # one background writer per audit path, created on first use
+    global _audit
+    with _audit_lock:
+        if _audit is None or _audit.path != AUDIT:
+            if _audit is not None:
+                _audit.close()
+            _audit = AuditWriter(
+                AUDIT,
+                batch_size=AUDIT_BATCH,
+                flush_interval_s=AUDIT_FLUSH_MS / 1000,
+                queue_size=AUDIT_QUEUE,
+                fsync=AUDIT_FSYNC,
+                rotate_bytes=int(AUDIT_ROTATE_MB * 1024 * 1024),
+                rotate_interval_s=AUDIT_ROTATE_S,
+            )
+        return _audit
 
 def audit_write(entry: dict):
-    AUDIT.parent.mkdir(parents=True, exist_ok=True)
-    entry["ts_ms"] = epoch_ms()
-    with AUDIT.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(entry) + "\n")
+    # blocks only when the writer queue is full (backpressure)
+    audit_writer().write(entry)
+
+@atexit.register
+def audit_close():
+    if _audit is not None:
+        _audit.close()
 
 def handle_lock(req: dict) -> dict:
     # pretend to actuate a body control module
     time.sleep(0.05)  # small delay to simulate work
     return {"status": {"code": "OK", "message": "Doors locked"}, "success": True}
 
-def main():
+# ---------------- method dispatch -----------------
+
+class Method:
+    """A registered RPC method, its concurrency limit and priority class."""
+
+    def __init__(self, name: str, handler, max_concurrency: int, blocking: bool, idempotent: bool = False,
+                 priority: int = PRIORITY_NORMAL):
+        self.name = name
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.blocking = blocking  # False => handler is a coroutine function
+        self.idempotent = idempotent  # True => retries are answered from cache, duplicates coalesced
+        self.priority = priority
+        self.limit = threading.BoundedSemaphore(max_concurrency)  # threaded mode
+        self.running = 0   # async mode, owned by the scheduler
+        self.pending = 0
+        self.waiting = 0   # threaded mode: callers blocked on limit
+        self._waiting_lock = threading.Lock()
+        self.latency_s: float | None = None  # EWMA of handler time, None until measured
+
+    def acquire_limit(self) -> None:
+        # threaded mode: blocks on the concurrency limit, counted so admission can see the queue
+        with self._waiting_lock:
+            self.waiting += 1
+        try:
+            self.limit.acquire()
+        finally:
+            with self._waiting_lock:
+                self.waiting -= 1
+
+    def observe(self, elapsed_s: float) -> None:
+        if self.latency_s is None:
+            self.latency_s = elapsed_s
+        else:
+            self.latency_s += LATENCY_ALPHA * (elapsed_s - self.latency_s)
+
+    def predicted_ms(self, ahead: int) -> float:
+        """Time until a request with `ahead` others in front of it would finish."""
+        waves = ahead // self.max_concurrency + 1
+        return waves * (self.latency_s or 0.0) * 1000
+
+class MethodRegistry:
+    """Method name -> handler table used by both server modes."""
+
+    def __init__(self):
+        self._methods: dict[str, Method] = {}
+
+    def register(self, name: str, handler=None, *, max_concurrency: int = 4, blocking: bool = True,
+                 idempotent: bool = False, priority: int = PRIORITY_NORMAL):
+        """Register a handler; usable directly or as a decorator."""
+        def deco(fn):
+            self._methods[name] = Method(name, fn, max_concurrency, blocking, idempotent, priority)
+            return fn
+        return deco(handler) if handler is not None else deco
+
+    def get(self, name: str) -> Method | None:
+        return self._methods.get(name)
+
+    def names(self) -> list[str]:
+        return sorted(self._methods)
+
+registry = MethodRegistry()
+registry.register("lock", handle_lock, max_concurrency=4, idempotent=True, priority=PRIORITY_SAFETY)
+idempotency = Idempotency(IDEMPOTENCY_TTL_S, IDEMPOTENCY_MAX)
+
+def unknown_method(method: str) -> dict:
+    return {"status": {"code": "ERR", "message": f"Unknown method '{method}'"}}
+
+def handler_failed(err: Exception) -> dict:
+    return {"status": {"code": "ERR", "message": f"Handler failed: {err!r}"}}
+
+def deadline_exceeded(method: str) -> dict:
+    return {"status": {"code": "DEADLINE_EXCEEDED", "message": f"'{method}' expired before it could run"}}
+
+def overloaded(method: str, why: str) -> dict:
+    return {"status": {"code": "RESOURCE_EXHAUSTED", "message": f"'{method}' shed: {why}"}}
+
+# ---------------- deadline scheduling -----------------
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed while it waited to run."""
+
+def request_deadline(req: dict) -> int | None:
+    """Epoch ms after which the client no longer wants an answer (None => no deadline).
+
+    Fields that are not integers are ignored, as if absent.
+    """
+    ttl, ts = req.get("ttl_ms"), req.get("ts_ms")
+    if type(ttl) is not int or type(ts) is not int or not ttl:
+        return None
+    return ts + ttl
+
+def admission(m: Method, deadline: int | None, now_ms: int, ahead: int, queued: int) -> dict | None:
+    """Rejection response for a request that should not be queued, else None.
+
+    Expired requests are refused outright. Otherwise the method's measured
+    handler latency predicts when the request would finish behind the `ahead`
+    requests of the same method; if that is past its deadline it is shed
+    now rather than run for a client that has already given up.
+    """
+    if deadline is not None and now_ms > deadline:
+        EXPIRED.inc()
+        return deadline_exceeded(m.name)
+    if queued >= MAX_QUEUE:
+        SHED.inc()
+        return overloaded(m.name, f"{queued} requests queued")
+    if deadline is not None and m.latency_s is not None and now_ms + m.predicted_ms(ahead) > deadline:
+        SHED.inc()
+        return overloaded(m.name, f"would finish after its deadline ({m.latency_s * 1000:.0f} ms per call, "
+                                  f"{ahead} ahead)")
+    return None
+
+class Scheduler:
+    """Admits handler runs in (priority class, earliest deadline) order (asyncio mode).
+
+    At most `capacity` handlers run at once across all methods, and each
+    method stays within its own max_concurrency. Waiters that could no
+    longer finish by their deadline are failed with DeadlineExceeded
+    instead of run.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.running = 0
+        self._heap: list[tuple] = []  # (priority, deadline, seq, method, future)
+        self._seq = itertools.count()
+        self.stats = {"admitted": 0, "queued": 0, "expired_in_queue": 0}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def admit(self, m: Method, deadline: int | None, now_ms: int) -> dict | None:
+        return admission(m, deadline, now_ms, m.running + m.pending, len(self._heap))
+
+    async def acquire(self, m: Method, deadline: int | None) -> None:
+        if not self._heap and self.running < self.capacity and m.running < m.max_concurrency:
+            self._grant(m)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (m.priority, deadline if deadline is not None else float("inf"),
+                                    next(self._seq), m, fut))
+        m.pending += 1
+        self.stats["queued"] += 1
+        self._dispatch()  # capacity may be free for this method even if others are blocked
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release(m)  # granted, but the caller went away before running
+            raise
+
+    def release(self, m: Method, elapsed_s: float | None = None) -> None:
+        self.running -= 1
+        m.running -= 1
+        if elapsed_s is not None:
+            m.observe(elapsed_s)
+        self._dispatch()
+
+    def _grant(self, m: Method) -> None:
+        self.running += 1
+        m.running += 1
+        self.stats["admitted"] += 1
+
+    def _dispatch(self) -> None:
+        now = epoch_ms()
+        blocked = []  # methods at their own limit wait without holding up the others
+        while self._heap and self.running < self.capacity:
+            entry = heapq.heappop(self._heap)
+            _, deadline, _, m, fut = entry
+            if fut.done():  # cancelled while queued
+                m.pending -= 1
+                continue
+            if now + m.predicted_ms(0) > deadline:  # would finish too late to be of use
+                m.pending -= 1
+                self.stats["expired_in_queue"] += 1
+                fut.set_exception(DeadlineExceeded())
+                continue
+            if m.running >= m.max_concurrency:
+                blocked.append(entry)
+                continue
+            m.pending -= 1
+            self._grant(m)
+            fut.set_result(None)
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+
+scheduler = Scheduler(WORKERS)
+
+# ---------------- metrics -----------------
+
+REQUESTS = metrics.counter("rpc.requests")
+ERRORS = metrics.counter("rpc.errors")
+DISPATCH_US = metrics.histogram("rpc.receive_to_dispatch_us")  # frame read -> handler start
+HANDLER_US = metrics.histogram("rpc.handler_us")
+EXPIRED = metrics.counter("rpc.deadline_exceeded")  # rejected or dropped: the client gave up
+SHED = metrics.counter("rpc.shed")                  # refused by admission control
+AUDIT_US = metrics.histogram("rpc.audit_enqueue_us")
+metrics.gauge("audit.queue_depth", lambda: _audit.depth() if _audit else 0)
+metrics.gauge("audit.writer", lambda: dict(_audit.stats) if _audit else {})
+metrics.gauge("rpc.idempotency", lambda: dict(idempotency.stats))
+metrics.gauge("rpc.scheduler", lambda: dict(scheduler.stats, queue_depth=len(scheduler)))
+
+def handle_request(req: dict, received_at: float | None = None) -> dict:
+    corr = req.get("correlation_id") or str(new_id())  # text: it goes into the audit log
+    method = req.get("method", "")
+    REQUESTS.inc()
+
+    m = registry.get(method)
+    deadline = request_deadline(req)
+    if m is None:
+        res = unknown_method(method)
+        ERRORS.inc()
+    elif (rejection := admission(m, deadline, epoch_ms(), m.waiting, 0)) is not None:
+        res = rejection
+    else:
+        # threaded mode has no shared queue to reorder: each connection is served
+        # in order, so only the deadline checks and the latency estimate apply
+        def run() -> dict:
+            m.acquire_limit()
+            try:
+                if deadline is not None and epoch_ms() > deadline:
+                    raise DeadlineExceeded()
+                started = time.perf_counter()
+                if received_at is not None:
+                    DISPATCH_US.observe_s(started - received_at)
+                try:
+                    return m.handler(req) if m.blocking else asyncio.run(m.handler(req))
+                finally:
+                    elapsed = time.perf_counter() - started
+                    m.observe(elapsed)
+                    HANDLER_US.observe_s(elapsed)
+            finally:
+                m.limit.release()
+        try:
+            res = idempotency.call(req, run) if m.idempotent else run()
+        except DeadlineExceeded:
+            res = deadline_exceeded(method)
+            EXPIRED.inc()
+        except Exception as e:
+            res = handler_failed(e)
+            ERRORS.inc()
+
+    # echo correlation_id back
+    res["correlation_id"] = corr
+    return res
+
+def audit_entry(req: dict, res: dict) -> dict:
+    request = {"method": req.get("method", "")}
+    if req.get("target"):
+        request["target"] = req["target"]  # lets readers attribute the command to a vehicle
+    return {
+        "correlation_id": res["correlation_id"],
+        "request": request,
+        "response": res
+    }
+
+# ---------------- threaded mode -----------------
+
+def serve_conn(conn: socket.socket, addr) -> None:
+    # keep reading framed requests until the peer closes; clients pipeline on one socket
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    reader = FrameReader(conn)
+    with conn:
+        while True:
+            try:
+                req = codec.decode(reader.read())
+            except (ConnectionError, OSError, ValueError):  # ValueError covers FrameTooLarge
+                return
+            res = handle_request(req, time.perf_counter())
+            try:
+                # reply in whichever codec the request arrived in
+                send_msg(conn, res, req.get("content_type"))
+            except OSError:
+                return
+
+            # audit
+            with AUDIT_US.time():
+                audit_write(audit_entry(req, res))
+
+def serve_threaded():
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     srv.bind((HOST, PORT))
     srv.listen(8)
-    print(f"[rpc] listening tcp://{HOST}:{PORT}", flush=True)
+    print(f"[rpc] listening tcp://{HOST}:{PORT} (threaded)", flush=True)
+    notify_ready("rpc_server")
 
     try:
         while True:
             conn, addr = srv.accept()
-            with conn:
-                req = recv_json(conn)
-
-                corr = req.get("correlation_id") or str(uuid.uuid4())
-                method = req.get("method", "")
-
-                if method == "lock":
-                    res = handle_lock(req)
-                else:
-                    res = {"status": {"code": "ERR", "message": f"Unknown method '{method}'"}}
-
-                # echo correlation_id back
-                res["correlation_id"] = corr
-                send_json(conn, res)
-
-                # audit
-                audit_write({
-                    "correlation_id": corr,
-                    "request": {"method": method},
-                    "response": res
-                })
+            threading.Thread(target=serve_conn, args=(conn, addr), name="rpc-conn", daemon=True).start()
     finally:
         srv.close()
 
+# ---------------- asyncio mode -----------------
+
+async def handle_request_async(req: dict, executor: ThreadPoolExecutor,
+                               received_at: float | None = None) -> dict:
+    corr = req.get("correlation_id") or str(new_id())  # text: it goes into the audit log
+    method = req.get("method", "")
+    REQUESTS.inc()
+
+    m = registry.get(method)
+    deadline = request_deadline(req)
+    if m is None:
+        res = unknown_method(method)
+        ERRORS.inc()
+    elif (rejection := scheduler.admit(m, deadline, epoch_ms())) is not None:
+        res = rejection
+    else:
+        async def run() -> dict:
+            await scheduler.acquire(m, deadline)
+            started = time.perf_counter()
+            if received_at is not None:
+                DISPATCH_US.observe_s(started - received_at)
+            try:
+                if m.blocking:
+                    return await asyncio.get_running_loop().run_in_executor(executor, m.handler, req)
+                return await m.handler(req)
+            finally:
+                elapsed = time.perf_counter() - started
+                HANDLER_US.observe_s(elapsed)
+                scheduler.release(m, elapsed)
+        try:
+            res = await (idempotency.call_async(req, run) if m.idempotent else run())
+        except DeadlineExceeded:
+            res = deadline_exceeded(method)
+            EXPIRED.inc()
+        except Exception as e:
+            res = handler_failed(e)
+            ERRORS.inc()
+
+    res["correlation_id"] = corr
+    return res
+
+class RpcProtocol(FrameProtocol):
+    """One connection: requests are read straight into a reusable buffer and each
+    runs as its own task; replies go out as soon as they are ready."""
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        super().__init__()
+        self.executor = executor
+        self.tasks: set[asyncio.Task] = set()
+        self.eof = False
+
+    def connection_made(self, transport) -> None:
+        super().connection_made(transport)
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def frame_received(self, view: memoryview) -> None:
+        received_at = time.perf_counter()
+        req = codec.decode(view)  # decoded now: the view is reused by the next read
+        task = asyncio.get_running_loop().create_task(self.respond(req, received_at))
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if self.eof and not self.tasks:
+            self.transport.close()
+
+    def eof_received(self) -> bool:
+        # the peer finished sending: answer what is in flight, then close
+        self.eof = True
+        if not self.tasks:
+            self.transport.close()
+        return True
+
+    async def respond(self, req: dict, received_at: float) -> None:
+        res = await handle_request_async(req, self.executor, received_at)
+        if not self.transport.is_closing():
+            write_frame(self.transport, codec.codec_for(req).encode(res))
+            await self.drain()
+        # audit: enqueue without blocking the loop; only a full queue falls back to a blocking put
+        entry = audit_entry(req, res)
+        started = time.perf_counter()
+        if not audit_writer().try_write(entry):
+            await asyncio.get_running_loop().run_in_executor(None, audit_write, entry)
+        AUDIT_US.observe_s(time.perf_counter() - started)
+
+async def start_async_server(host: str, port: int, executor: ThreadPoolExecutor) -> asyncio.AbstractServer:
+    return await asyncio.get_running_loop().create_server(
+        lambda: RpcProtocol(executor), host, port, backlog=128)
+
+async def serve_async():
+    with ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="rpc-handler") as executor:
+        srv = await start_async_server(HOST, PORT, executor)
+        print(f"[rpc] listening tcp://{HOST}:{PORT} (async, {WORKERS} workers, "
+              f"methods={registry.names()})", flush=True)
+        notify_ready("rpc_server")
+        async with srv:
+            await srv.serve_forever()
+
+def main():
+    metrics.start_exporters("rpc_server")
+    if MODE == "threaded":
+        serve_threaded()
+    else:
+        asyncio.run(serve_async())
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,406 @@
+# demo/service_host.py
+"""Run several demo services in one process, or as ready-gated child processes.
+
+In one process (the default) the selected services are plugins on a shared
+asyncio loop. The host binds the telemetry port once, applies QoS there
+(acks, de-duplication, expiry) and decodes every datagram once. It then
+hands the messages to an in-memory TopicBus, where sub, alert and summary
+subscribe by topic pattern instead of each binding and decoding for
+itself. rpc runs its asyncio server on the same loop. The status summary's
+audit tail and publisher keep their threads: they block on file polling
+and a condition variable.
+
+    python demo/service_host.py sub alert summary rpc
+    python demo/service_host.py --procs sub alert summary rpc
+
+--procs starts every service as its own process, all at once, and waits
+until each has reported ready (common.notify_ready). start_service() does
+the same for one process, for launchers and tests that would otherwise sleep.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+import metrics
+from common import (READY_ADDR, READY_FD, TRANSPORT, QosFilter, QosReceiver, broker_addr, epoch_ms,
+                    notify_ready, udp_bind, udp_subscribe)
+from uuri import TopicTrie
+
+HOST = os.getenv("DEMO_BIND_HOST", "127.0.0.1")
+PORT = int(os.getenv("DEMO_BIND_PORT", "50052"))
+TOPIC = os.getenv("HOST_TOPIC", "up://*/vehicle.telemetry/*")  # ingress subscription, used with DEMO_BROKER
+READY_TIMEOUT_S = float(os.getenv("HOST_READY_TIMEOUT_S", "10"))
+
+DEMO_DIR = Path(__file__).resolve().parent
+SCRIPTS = {"broker": "broker.py", "sub": "sub_telemetry.py", "alert": "alert_service.py",
+           "summary": "status_summary.py", "rpc": "rpc_server.py"}
+
+log = metrics.Log("host")
+
+
+# ---------------- in-memory bus -----------------
+
+
+class TopicBus:
+    """In-process pub/sub: each message goes to every handler whose pattern matches its target.
+
+    Handlers run on the publisher's thread (the host's loop) and get their
+    share of a published batch as one list. They must not modify the
+    messages, which are shared between handlers.
+    """
+
+    def __init__(self):
+        self.table = TopicTrie()
+        self.stats = {"published": 0, "delivered": 0, "unrouted": 0, "errors": 0}
+
+    def subscribe(self, pattern: str, handler: Callable[[list[dict]], None]) -> None:
+        self.table.add(pattern, handler)
+
+    def unsubscribe(self, pattern: str, handler: Callable[[list[dict]], None]) -> None:
+        self.table.remove(pattern, handler)
+
+    def publish(self, msgs: list[dict]) -> None:
+        batches: dict[Callable, list[dict]] = {}
+        for msg in msgs:
+            target = msg.get("target")
+            try:
+                handlers = self.table.match(target) if isinstance(target, str) else ()
+            except ValueError:  # not a URI
+                handlers = ()
+            if not handlers:
+                self.stats["unrouted"] += 1
+            for handler in handlers:
+                batches.setdefault(handler, []).append(msg)
+        self.stats["published"] += len(msgs)
+        for handler, batch in batches.items():
+            try:
+                handler(batch)
+            except Exception as e:  # one broken plugin must not starve the others
+                self.stats["errors"] += 1
+                log.error("handler %r failed: %r", handler, e)
+            self.stats["delivered"] += len(batch)
+
+
+class Ingress(asyncio.DatagramProtocol):
+    """Telemetry datagrams -> bus, with QoS applied once for every plugin."""
+
+    def __init__(self, bus: TopicBus):
+        self.bus = bus
+        self.qos = QosFilter()
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        out, acks = [], {}
+        self.qos.feed(memoryview(data), addr, epoch_ms(), out, acks)
+        if acks:
+            self.qos.send_acks(self.transport.sendto, acks)
+        if out:
+            self.qos.stats["messages"] += len(out)
+            self.bus.publish(out)
+
+
+# ---------------- plugins -----------------
+
+
+class Plugin:
+    """One service inside the host; imported only when selected."""
+
+    name = ""
+    uses_bus = False  # True => needs the telemetry ingress
+
+    async def start(self, host: "ServiceHost") -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        pass
+
+
+class SubPlugin(Plugin):
+    name, uses_bus = "sub", True
+
+    async def start(self, host: "ServiceHost") -> None:
+        import sub_telemetry
+
+        def on_batch(batch: list[dict]) -> None:
+            for msg in batch:
+                sub_telemetry.handle(msg)
+        host.bus.subscribe(sub_telemetry.TOPIC, on_batch)
+
+
+class AlertPlugin(Plugin):
+    name, uses_bus = "alert", True
+
+    async def start(self, host: "ServiceHost") -> None:
+        import alert_service
+        engine = alert_service.build_engine()
+        metrics.gauge("alert.vehicles", lambda: engine.vehicles)
+        self.pub = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        def on_batch(batch: list[dict]) -> None:
+            for alert in alert_service.evaluate(engine, batch):
+                alert_service.emit(self.pub, alert)
+        host.bus.subscribe(alert_service.TOPIC, on_batch)
+
+    async def stop(self) -> None:
+        self.pub.close()
+
+
+class SummaryPlugin(Plugin):
+    name, uses_bus = "summary", True
+
+    async def start(self, host: "ServiceHost") -> None:
+        import status_summary
+
+        def on_batch(batch: list[dict]) -> None:
+            for evt in batch:
+                status_summary.on_speed(evt)
+        host.bus.subscribe(status_summary.SPEED_TOPIC, on_batch)
+        self.stop_event = threading.Event()
+        threading.Thread(target=status_summary.audit_watcher, name="summary-audit", daemon=True).start()
+        threading.Thread(target=status_summary.publisher, args=(self.stop_event,), name="summary-publisher",
+                         daemon=True).start()
+
+    async def stop(self) -> None:
+        self.stop_event.set()
+
+
+class RpcPlugin(Plugin):
+    name = "rpc"
+
+    async def start(self, host: "ServiceHost") -> None:
+        import rpc_server
+        self.executor = ThreadPoolExecutor(max_workers=rpc_server.WORKERS, thread_name_prefix="rpc-handler")
+        self.server = await rpc_server.start_async_server(rpc_server.HOST, rpc_server.PORT, self.executor)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+
+PLUGINS: dict[str, type[Plugin]] = {p.name: p for p in (SubPlugin, AlertPlugin, SummaryPlugin, RpcPlugin)}
+
+
+class ServiceHost:
+    """The selected plugins on the running loop, fed by one telemetry ingress."""
+
+    def __init__(self, names: list[str], host: str = HOST, port: int = PORT):
+        unknown = [n for n in names if n not in PLUGINS]
+        if unknown:
+            raise ValueError(f"unknown service(s) {unknown}; choose from {sorted(PLUGINS)}")
+        self.plugins = [PLUGINS[n]() for n in names]
+        self.host, self.port = host, port
+        self.bus = TopicBus()
+        self.ingress: Optional[Ingress] = None
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._shm_stop: Optional[threading.Event] = None
+        metrics.gauge("host.bus", lambda: dict(self.bus.stats))
+
+    async def start(self) -> None:
+        for plugin in self.plugins:
+            await plugin.start(self)
+        if any(p.uses_bus for p in self.plugins):
+            await self._open_ingress()
+
+    async def _open_ingress(self) -> None:
+        loop = asyncio.get_running_loop()
+        if TRANSPORT == "shm":  # a shared-memory ring is not a socket the loop can watch
+            rx = QosReceiver(udp_subscribe(TOPIC, self.host, self.port, 0.5))
+            self._shm_stop = threading.Event()
+
+            def pump() -> None:
+                while not self._shm_stop.is_set():
+                    try:
+                        batch = rx.recv_batch()
+                    except socket.timeout:
+                        continue
+                    if batch:
+                        loop.call_soon_threadsafe(self.bus.publish, batch)
+            threading.Thread(target=pump, name="host-shm-ingress", daemon=True).start()
+            metrics.gauge("host.receiver", lambda: dict(rx.stats))
+            return
+        if broker_addr() is not None:
+            sock = udp_subscribe(TOPIC, self.host, self.port)
+        else:
+            sock = udp_bind(self.host, self.port)
+        self._transport, self.ingress = await loop.create_datagram_endpoint(lambda: Ingress(self.bus), sock=sock)
+        self.port = sock.getsockname()[1]
+        metrics.gauge("host.receiver", lambda: dict(self.ingress.qos.stats))
+
+    async def stop(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        if self._shm_stop is not None:
+            self._shm_stop.set()
+        for plugin in reversed(self.plugins):
+            await plugin.stop()
+
+
+async def run_host(names: list[str]) -> None:
+    started = time.perf_counter()
+    host = ServiceHost(names)
+    await host.start()
+    log.info("%s ready in %.0f ms on one loop (telemetry udp://%s:%s)",
+             ",".join(names), (time.perf_counter() - started) * 1000, host.host, host.port)
+    notify_ready("service_host")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows: Ctrl-C still raises KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await host.stop()
+
+
+# ---------------- separate processes -----------------
+
+
+def _wait_pipe(proc: subprocess.Popen, fd: int, timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    got = b""
+    while b"\n" not in got:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{proc.args!r} not ready after {timeout_s:.1f}s")
+        readable, _, _ = select.select([fd], [], [], remaining)
+        if readable:
+            chunk = os.read(fd, 256)
+            if not chunk:  # every write end closed without a READY line: the child is gone
+                raise RuntimeError(f"{proc.args!r} exited before it was ready (code {proc.wait()})")
+            got += chunk
+
+
+def _wait_socket(proc: subprocess.Popen, sock: socket.socket, timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{proc.args!r} not ready after {timeout_s:.1f}s")
+        sock.settimeout(min(remaining, 0.1))
+        try:
+            sock.recv(256)
+            return
+        except socket.timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{proc.args!r} exited before it was ready (code {proc.returncode})")
+
+
+def start_service(argv: list[str], env: Optional[dict] = None, timeout_s: float = READY_TIMEOUT_S,
+                  **popen_kwargs) -> subprocess.Popen:
+    """Start a process and return as soon as it reports ready (see common.notify_ready).
+
+    Readiness comes through an inherited pipe, or a loopback UDP socket where
+    fds cannot be passed (Windows). Raises RuntimeError if the process exits
+    first, and TimeoutError (after killing it) if it stays silent.
+    """
+    env = dict(os.environ if env is None else env)
+    if os.name == "posix":
+        r, w = os.pipe()
+        env[READY_FD] = str(w)
+        try:
+            proc = subprocess.Popen(argv, env=env, pass_fds=(w,), **popen_kwargs)
+        finally:
+            os.close(w)
+        wait, arg = _wait_pipe, r
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        env[READY_ADDR] = "127.0.0.1:%d" % sock.getsockname()[1]
+        proc = subprocess.Popen(argv, env=env, **popen_kwargs)
+        wait, arg = _wait_socket, sock
+    try:
+        wait(proc, arg, timeout_s)
+    except TimeoutError:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        if isinstance(arg, socket.socket):
+            arg.close()
+        else:
+            os.close(arg)
+    return proc
+
+
+def run_processes(names: list[str]) -> int:
+    unknown = [n for n in names if n not in SCRIPTS]
+    if unknown:
+        print(f"[host] unknown service(s) {unknown}; choose from {sorted(SCRIPTS)}", file=sys.stderr)
+        return 2
+    started = time.perf_counter()
+    procs: dict[str, subprocess.Popen] = {}
+    # started side by side: startup costs overlap instead of adding up
+    with ThreadPoolExecutor(len(names)) as pool:
+        futures = {n: pool.submit(start_service, [sys.executable, str(DEMO_DIR / SCRIPTS[n])]) for n in names}
+        failed = False
+        for name, fut in futures.items():
+            try:
+                procs[name] = fut.result()
+            except (RuntimeError, TimeoutError, OSError) as e:
+                print(f"[host] {name}: {e}", file=sys.stderr, flush=True)
+                failed = True
+    if failed:
+        for proc in procs.values():
+            proc.terminate()
+        return 1
+    print(f"[host] {','.join(names)} ready in {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"({len(procs)} processes)", flush=True)
+    notify_ready("service_host")
+    try:
+        while all(p.poll() is None for p in procs.values()):
+            time.sleep(0.5)
+        for name, proc in procs.items():
+            if proc.returncode is not None:
+                print(f"[host] {name} exited with code {proc.returncode}", flush=True)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs.values():
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Run demo services in one process (default) or one process each.")
+    ap.add_argument("services", nargs="*", default=["sub", "alert", "summary", "rpc"],
+                    help=f"in-process: {sorted(PLUGINS)}; with --procs also broker")
+    ap.add_argument("--procs", action="store_true", help="one process per service, ready-gated")
+    args = ap.parse_args(argv)
+    if args.procs:
+        return run_processes(args.services)
+    metrics.start_exporters("service_host")
+    try:
+        asyncio.run(run_host(args.services))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
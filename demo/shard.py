@@ -0,0 +1,488 @@
+# demo/shard.py
+"""Run a telemetry consumer (alert_service or sub_telemetry) as N worker processes.
+
+Two ways to spread the load:
+
+  hash       one dispatcher thread owns the port, reads each message's source
+             from the binary header (JSON is decoded) and forwards the raw
+             bytes to worker crc32(vehicle) % N over loopback. Every message of a
+             vehicle lands on the same worker, so per-vehicle state (alert
+             debounce, rate-of-change history) stays correct. QoS is handled at
+             the dispatcher: expired messages are dropped, QoS 1 messages are
+             acked and de-duplicated there.
+  reuseport  every worker binds the port with SO_REUSEPORT and the kernel
+             balances by sender address, with no dispatcher hop. A vehicle stays
+             on one worker only while it sends from one socket, so this is for
+             stateless consumers or one-socket-per-vehicle publishers.
+
+SIGHUP restarts the workers one at a time; a worker that dies is respawned.
+In hash mode the replacement is started and takes over the route before the
+old worker drains its queue and exits; its in-memory per-vehicle state starts
+over. The supervisor merges the workers' metrics (counters and histograms are
+summed, totals survive restarts) and serves them through the usual
+DEMO_METRICS_* exporters as service "shard_<name>".
+
+    python demo/shard.py alert --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import multiprocessing as mp
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import zlib
+from typing import Optional
+
+from bulk_io import MAX_DATAGRAM, BatchSender, BulkReceiver, split_batch
+from common import ACK_MAX_IDS, ACK_TYPE, DedupWindow, broker_addr, epoch_ms, is_expired, udp_bind, udp_subscribe
+import codec
+import metrics
+import uuri
+
+WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 2)))
+MODE = os.getenv("SHARD_MODE", "hash")                      # hash | reuseport
+HOST = os.getenv("SHARD_HOST", "127.0.0.1")
+PORT = int(os.getenv("SHARD_PORT", "50052"))                # same as telemetry port
+STATS_S = float(os.getenv("SHARD_STATS_S", "1"))            # worker -> supervisor metrics period
+LOG_S = float(os.getenv("SHARD_LOG_S", "10"))               # aggregated stats line period
+DRAIN_S = float(os.getenv("SHARD_DRAIN_S", "0.2"))          # a stopping worker exits after this long idle
+STOP_TIMEOUT_S = float(os.getenv("SHARD_STOP_TIMEOUT_S", "5"))
+FORWARD_BYTES = int(os.getenv("SHARD_FORWARD_BYTES", "16384"))  # loopback batches to workers
+SOURCE_CACHE = 100_000  # routed sources remembered by the dispatcher
+
+# service name -> (module with serve(sock) and TOPIC)
+SERVICES = {"alert": "alert_service", "sub": "sub_telemetry"}
+
+log = metrics.Log("shard")
+FORWARDED = metrics.counter("shard.forwarded")
+DROPPED = metrics.counter("shard.dropped")          # no live worker for the shard
+RESTARTS = metrics.counter("shard.restarts")
+
+
+def shard_of(vehicle: str, shards: int) -> int:
+    """Stable shard for a vehicle (the same in every process and run)."""
+    return zlib.crc32(vehicle.encode("utf-8")) % shards
+
+
+def vehicle_of(source: Optional[str]) -> str:
+    """Authority of a source URI, as alert_rules.vehicle_key keys its state."""
+    source = source or ""
+    try:
+        return uuri.parse(source).authority
+    except ValueError:
+        return source
+
+
+# ---------------- dispatcher (hash mode) -----------------
+
+
+class Dispatcher:
+    """Forward datagrams from one socket to per-shard loopback ports by vehicle.
+
+    Binary messages are routed from their header and forwarded as-is; JSON
+    ones are decoded once to find source, qos and id, and also forwarded as
+    the original bytes. A shard without a route (its worker is starting)
+    drops what it would have received.
+    """
+
+    def __init__(self, sock: socket.socket, shards: int, dedup: Optional[DedupWindow] = None,
+                 forward_bytes: int = FORWARD_BYTES):
+        self.sock = sock
+        self.shards = shards
+        self.rx = BulkReceiver(sock)
+        self.dedup = dedup if dedup is not None else DedupWindow()
+        self.out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.forward_bytes = forward_bytes
+        self.senders: list[Optional[BatchSender]] = [None] * shards
+        self._shards: dict = {}  # source URI -> shard, so the URI is parsed once
+        self.stats = {"messages": 0, "expired": 0, "duplicates": 0, "acks": 0, "errors": 0, "dropped": 0}
+
+    def route(self, shard: int, port: Optional[int]) -> None:
+        """Point a shard at a worker's loopback port (None: drop until re-routed)."""
+        self.senders[shard] = None if port is None else BatchSender(
+            self.out, ("127.0.0.1", port), max_bytes=min(self.forward_bytes, MAX_DATAGRAM))
+
+    def _peek(self, part: memoryview, now_ms: int) -> Optional[tuple[int, Optional[str], Optional[str]]]:
+        head = codec.peek_delivery(part)
+        if head is not None:
+            deadline = codec.peek_deadline(part)
+            return None if deadline is not None and now_ms > deadline else head
+        msg = codec.decode(part)
+        if not isinstance(msg, dict):
+            raise ValueError("message is not an object")
+        if is_expired(msg, now_ms):
+            return None
+        qos, mid, source = msg.get("qos", 0), msg.get("id"), msg.get("source")
+        if (type(qos) is not int or not isinstance(mid, (str, type(None)))
+                or not isinstance(source, (str, type(None)))):
+            raise ValueError("malformed qos, id or source")
+        return qos, mid, source
+
+    def dispatch_once(self) -> int:
+        """Forward one wakeup's worth of datagrams; returns messages forwarded."""
+        views = self.rx.recv_views()
+        now_ms = epoch_ms()
+        acks: dict = {}
+        senders = list(self.senders)  # one consistent table for the whole wakeup
+        sent = 0
+        for view, addr in zip(views, self.rx.addrs):
+            for part in split_batch(view):
+                try:  # anything a datagram can make raise costs that datagram only
+                    head = self._peek(part, now_ms)
+                    if head is None:
+                        self.stats["expired"] += 1
+                        continue
+                    qos, mid, source = head
+                    if qos >= 1 and mid:
+                        acks.setdefault(addr, []).append(mid)
+                        if self.dedup.seen(mid):
+                            self.stats["duplicates"] += 1
+                            continue
+                    shard = self._shards.get(source)
+                    if shard is None:
+                        if len(self._shards) >= SOURCE_CACHE:
+                            self._shards.clear()
+                        shard = self._shards[source] = shard_of(vehicle_of(source), self.shards)
+                except Exception:
+                    self.stats["errors"] += 1
+                    continue
+                sender = senders[shard]
+                if sender is None:
+                    self.stats["dropped"] += 1
+                    DROPPED.inc()
+                    continue
+                sender.send(part)
+                sent += 1
+        # parts are views into the receive ring: everything goes out before the next recv
+        for sender in senders:
+            if sender is not None:
+                try:
+                    sender.flush()
+                except OSError:
+                    pass
+        for addr, ids in acks.items():
+            for i in range(0, len(ids), ACK_MAX_IDS):
+                try:
+                    self.sock.sendto(codec.JSON.encode({"type": ACK_TYPE, "ids": ids[i:i + ACK_MAX_IDS]}), addr)
+                    self.stats["acks"] += 1
+                except OSError:
+                    pass
+        self.stats["messages"] += sent
+        FORWARDED.inc(sent)
+        return sent
+
+    def run(self) -> None:
+        while self.sock.fileno() != -1:
+            try:
+                self.dispatch_once()
+            except OSError:
+                if self.sock.fileno() == -1:
+                    return
+
+    def close(self) -> None:
+        self.sock.close()
+        self.out.close()
+
+
+# ---------------- worker process -----------------
+
+
+def _report(conn, shard: int, stop: threading.Event) -> None:
+    while not stop.wait(STATS_S):
+        try:
+            conn.send(("stats", shard, os.getpid(), metrics.REGISTRY.export()))
+        except (OSError, EOFError):
+            return
+
+
+def worker_main(service: str, shard: int, mode: str, host: str, port: int, conn) -> None:
+    """Entry point of one worker: bind, report readiness, serve until SIGTERM."""
+    # Ctrl-C and hangups reach the whole process group; the supervisor decides what we do
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    mod = importlib.import_module(SERVICES[service])
+    if mode == "reuseport":
+        sock = udp_bind(host, port)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+
+    def on_term(*_):
+        if mode == "reuseport":
+            raise SystemExit(0)
+        # drain: nothing new is routed here any more; stop once the queue has been empty
+        # for DRAIN_S. The blocked recv only sees the new timeout after it returns, so wake it.
+        sock.settimeout(DRAIN_S)
+        sock.sendto(b"", sock.getsockname())
+
+    signal.signal(signal.SIGTERM, on_term)
+    stop = threading.Event()
+    conn.send(("ready", shard, os.getpid(), sock.getsockname()[1]))
+    threading.Thread(target=_report, args=(conn, shard, stop), name="shard-stats", daemon=True).start()
+    try:
+        mod.serve(sock)
+    except (socket.timeout, SystemExit):
+        pass
+    finally:
+        stop.set()
+        sock.close()
+        try:
+            conn.send(("exit", shard, os.getpid(), metrics.REGISTRY.export()))
+        except (OSError, EOFError):
+            pass
+
+
+# ---------------- supervisor -----------------
+
+
+class Worker:
+    def __init__(self, shard: int, proc, conn):
+        self.shard = shard
+        self.proc = proc
+        self.conn = conn
+        self.port: Optional[int] = None
+        self.started = time.monotonic()
+        self.stats: Optional[dict] = None  # latest REGISTRY.export() from the worker
+
+
+class ShardStats:
+    """Registry-like view merging the workers' metrics with the supervisor's own.
+
+    Counters and histograms of workers that exited are folded into `retired`,
+    so totals never go backwards across restarts.
+    """
+
+    def __init__(self, supervisor: "Supervisor"):
+        self.sup = supervisor
+        self.retired = metrics.Registry()
+        self.started = time.time()
+
+    def retire(self, export: Optional[dict]) -> None:
+        if export is not None:
+            self.retired.merge(export)
+
+    def snapshot(self) -> dict:
+        merged = metrics.Registry()
+        merged.started = self.started
+        merged.merge(self.retired.export())
+        merged.merge(metrics.REGISTRY.export())
+        shards = []
+        for w in list(self.sup.workers):
+            if w is None:
+                continue
+            if w.stats is not None:
+                merged.merge(w.stats)
+            shards.append({"shard": w.shard, "pid": w.proc.pid, "port": w.port,
+                           "uptime_s": round(time.monotonic() - w.started, 1),
+                           "counters": (w.stats or {}).get("counters", {}),
+                           "gauges": (w.stats or {}).get("gauges", {})})
+        snap = merged.snapshot()
+        snap["gauges"].update(self.sup.gauges())
+        snap["shards"] = shards
+        return snap
+
+
+class Supervisor:
+    """Start, watch, respawn and rolling-restart the workers of one service."""
+
+    def __init__(self, service: str, workers: int = WORKERS, mode: str = MODE,
+                 host: str = HOST, port: int = PORT, topic: Optional[str] = None):
+        if service not in SERVICES:
+            raise ValueError(f"unknown service {service!r}, expected one of {sorted(SERVICES)}")
+        if mode not in ("hash", "reuseport"):
+            raise ValueError(f"unknown mode {mode!r}")
+        if mode == "reuseport" and (broker_addr() is not None or not hasattr(socket, "SO_REUSEPORT")):
+            # every worker would subscribe separately and get every message
+            log.warn("reuseport mode needs SO_REUSEPORT and no DEMO_BROKER; using hash mode")
+            mode = "hash"
+        self.service = service
+        self.n = workers
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.topic = topic or importlib.import_module(SERVICES[service]).TOPIC
+        self.ctx = mp.get_context("spawn")  # the supervisor runs threads; never fork it
+        self.workers: list[Optional[Worker]] = [None] * workers
+        self.stats = ShardStats(self)
+        self.dispatcher: Optional[Dispatcher] = None
+        self.restarts = 0
+        self._stop = threading.Event()
+        self._rolling = threading.Event()
+
+    # -- lifecycle --
+
+    def start(self) -> None:
+        if self.mode == "hash":
+            sock = udp_subscribe(self.topic, self.host, self.port)
+            self.port = sock.getsockname()[1] if broker_addr() is None else self.port
+            self.dispatcher = Dispatcher(sock, self.n)
+            threading.Thread(target=self.dispatcher.run, name="shard-dispatch", daemon=True).start()
+        for i in range(self.n):
+            self._install(self._spawn(i))
+
+    def _spawn(self, shard: int, timeout_s: float = 10.0) -> Worker:
+        parent, child = self.ctx.Pipe(duplex=False)
+        proc = self.ctx.Process(target=worker_main, name=f"{self.service}-shard{shard}", daemon=True,
+                                args=(self.service, shard, self.mode, self.host, self.port, child))
+        proc.start()
+        child.close()
+        w = Worker(shard, proc, parent)
+        if parent.poll(timeout_s):
+            try:
+                kind, _, _, port = parent.recv()
+                if kind == "ready":
+                    w.port = port
+            except (EOFError, OSError):
+                pass
+        if w.port is None:
+            log.error("shard %d: worker pid %s did not come up", shard, proc.pid)
+        return w
+
+    def _install(self, w: Worker) -> None:
+        self.workers[w.shard] = w
+        if self.dispatcher is not None:
+            self.dispatcher.route(w.shard, w.port)
+
+    def _stop_worker(self, w: Worker) -> None:
+        if w.proc.is_alive():
+            w.proc.terminate()  # SIGTERM: drain and exit
+            deadline = time.monotonic() + STOP_TIMEOUT_S
+            # keep reading its pipe meanwhile: a worker blocked on a full pipe never exits
+            while w.proc.is_alive() and time.monotonic() < deadline:
+                mp.connection.wait([w.conn, w.proc.sentinel], timeout=0.1)
+                self._drain(w)
+            if w.proc.is_alive():
+                w.proc.kill()
+            w.proc.join()
+        self._collect(w)
+        w.conn.close()
+
+    def _drain(self, w: Worker) -> None:
+        try:
+            while w.conn.poll():
+                kind, _, _, data = w.conn.recv()
+                if kind in ("stats", "exit"):
+                    w.stats = data
+        except (EOFError, OSError):
+            pass
+
+    def _collect(self, w: Worker) -> None:
+        """Read whatever the worker still has in its pipe, then retire its metrics."""
+        self._drain(w)
+        self.stats.retire(w.stats)
+        w.stats = None
+
+    def restart_all(self) -> None:
+        """Ask the watch loop for a rolling restart (also what SIGHUP does)."""
+        self._rolling.set()
+
+    def _rolling_restart(self) -> None:
+        for i, old in enumerate(self.workers):
+            if self._stop.is_set():
+                return
+            new = self._spawn(i)
+            # route to the new worker first, then let the old one drain
+            self._install(new)
+            if old is not None:
+                self._stop_worker(old)
+            self.restarts += 1
+            RESTARTS.inc()
+        log.info("rolling restart of %d worker(s) done", self.n)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def watch(self) -> None:
+        """Supervise until stop(): collect stats, respawn dead workers, handle restarts."""
+        next_log = time.monotonic() + LOG_S
+        while not self._stop.is_set():
+            live = [w for w in self.workers if w is not None]
+            ready = mp.connection.wait([w.conn for w in live] + [w.proc.sentinel for w in live], timeout=0.5)
+            for w in live:
+                if w.conn in ready:
+                    self._drain(w)
+            for w in live:
+                if w.proc.sentinel in ready and not self._stop.is_set():
+                    self._respawn(w)
+            if self._rolling.is_set():
+                self._rolling.clear()
+                self._rolling_restart()
+            if time.monotonic() >= next_log:
+                next_log = time.monotonic() + LOG_S
+                snap = self.stats.snapshot()
+                log.info("%d worker(s), counters=%s", sum(1 for w in self.workers if w), snap["counters"])
+
+    def _respawn(self, w: Worker) -> None:
+        w.proc.join()
+        log.warn("shard %d: worker pid %s exited with %s, respawning", w.shard, w.proc.pid, w.proc.exitcode)
+        self._collect(w)
+        w.conn.close()
+        if self.dispatcher is not None:
+            self.dispatcher.route(w.shard, None)
+        if time.monotonic() - w.started < 1.0:
+            time.sleep(1.0)  # crash loop: don't spin
+        self._install(self._spawn(w.shard))
+        self.restarts += 1
+        RESTARTS.inc()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        for w in self.workers:
+            if w is not None:
+                w.proc.terminate()
+        for w in self.workers:
+            if w is not None:
+                self._stop_worker(w)
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+
+    def gauges(self) -> dict:
+        out = {"shard.workers": sum(1 for w in self.workers if w is not None and w.proc.is_alive()),
+               "shard.restarts": self.restarts}
+        if self.dispatcher is not None:
+            out["shard.dispatcher"] = dict(self.dispatcher.stats)
+        return out
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run a telemetry consumer as sharded worker processes.")
+    ap.add_argument("service", choices=sorted(SERVICES))
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--mode", choices=("hash", "reuseport"), default=MODE)
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    args = ap.parse_args(argv)
+
+    sup = Supervisor(args.service, args.workers, args.mode, args.host, args.port)
+    signal.signal(signal.SIGTERM, lambda *_: sup.stop())
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda *_: sup.restart_all())
+    sup.start()
+    metrics.start_exporters(f"shard_{args.service}", sup.stats)
+    print(f"[shard] {args.service} x{sup.n} ({sup.mode}) on udp://{args.host}:{sup.port}, "
+          f"pids={[w.proc.pid for w in sup.workers if w]}", flush=True)
+    try:
+        sup.watch()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sup.shutdown()
+        print("[shard] stopped, totals:", sup.stats.snapshot()["counters"], flush=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,464 @@
+from __future__ import annotations
+
+import ctypes
+import os
+import platform
+import socket
+import struct
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: no cross-process locks, one producer is on trust
+    fcntl = None
+
+
+# Same-host transport: one shared-memory ring per channel (one per UDP port it
+# replaces). The producer appends length-prefixed records and never waits; each
+# reader has its own cursor, so every reader sees every message, like
+# subscribers of the broker. A reader that falls more than a ring behind is
+# "lapped": it counts an overrun and skips ahead to the newest data.
+#
+#   DEMO_SHM_BYTES    ring size per channel (default 8 MiB)
+#   DEMO_SHM_READERS  reader slots per channel
+SHM_BYTES = int(os.getenv("DEMO_SHM_BYTES", str(8 << 20)))
+SHM_READERS = int(os.getenv("DEMO_SHM_READERS", "16"))
+
+MAGIC = 0x55505348  # "UPSH"
+VERSION = 1
+WRAP = 0xFFFFFFFF   # record length meaning "continue at the start of the ring"
+REC_LEN = struct.Struct("=I")
+
+# header layout (native byte order, 64-byte lines so the hot words don't share one)
+OFF_MAGIC, OFF_VERSION, OFF_CAPACITY, OFF_READERS, OFF_PRODUCER = 0, 4, 8, 16, 20
+OFF_WRITE_POS = 64   # u64 bytes ever written; records below it are complete
+OFF_SEQ = 128        # u32 bumped on every publish; the futex word readers sleep on
+OFF_SLEEPING = 192   # one byte per reader, set while it sleeps on the futex
+SLOT_SIZE = 64       # per-reader slots after the flags: pid u32, pos u64
+MAX_WAIT_S = 0.05    # longest single sleep, bounds the cost of a missed wakeup
+
+
+def channel_name(port: int) -> str:
+    return f"updemo-{port}"
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _slots_offset(readers: int) -> int:
+    return OFF_SLEEPING + ((readers + 63) & ~63)
+
+
+def _data_offset(readers: int) -> int:
+    return _slots_offset(readers) + readers * SLOT_SIZE
+
+
+# ---------------- futex (Linux) with a polling fallback -----------------
+
+
+_SYS_FUTEX = {"x86_64": 202, "amd64": 202, "aarch64": 98, "arm64": 98}.get(platform.machine().lower())
+FUTEX_WAIT, FUTEX_WAKE = 0, 1  # not *_PRIVATE: waiters live in other processes
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_futex():
+    if not platform.system() == "Linux" or _SYS_FUTEX is None:
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)  # CDLL calls release the GIL
+        return libc.syscall
+    except (OSError, AttributeError):
+        return None
+
+
+_syscall = _load_futex()
+HAVE_FUTEX = _syscall is not None
+
+
+def futex_wait(addr: int, expected: int, timeout_s: float) -> None:
+    """Sleep while the u32 at addr equals expected (returns early on wake, change or signal)."""
+    ts = _Timespec(int(timeout_s), int((timeout_s % 1) * 1e9))
+    _syscall(_SYS_FUTEX, ctypes.c_void_p(addr), FUTEX_WAIT, ctypes.c_uint32(expected), ctypes.byref(ts), None, 0)
+
+
+def futex_wake(addr: int, n: int = 0x7FFFFFFF) -> None:
+    _syscall(_SYS_FUTEX, ctypes.c_void_p(addr), FUTEX_WAKE, ctypes.c_int(n), None, None, 0)
+
+
+# ---------------- segment -----------------
+
+
+class _Segment(shared_memory.SharedMemory):
+    def close(self) -> None:
+        try:
+            super().close()
+        except BufferError:
+            # message or header views still point into the mapping: it is unmapped with the last of them
+            self._mmap = None
+            super().close()
+
+    def __del__(self):
+        self.close()
+
+
+def _open_segment(name: str, size: int = 0) -> _Segment:
+    """Attach to (size == 0) or create a segment that outlives this process.
+
+    The segment is left to the next producer on exit, so readers keep their
+    mapping across publisher restarts; the resource tracker must not unlink it.
+    """
+    shm = _Segment(name, create=size > 0, size=size)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _lock(name: str, suffix: str, blocking: bool):
+    """flock()ed file next to the segment; None if it is held elsewhere (non-blocking)."""
+    if fcntl is None:
+        return open(os.devnull, "w")
+    f = open(os.path.join(tempfile.gettempdir(), f"{name}.{suffix}.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+class _Ring:
+    """Typed views of one segment's header, slots and data area."""
+
+    def __init__(self, shm: _Segment):
+        self.shm = shm
+        buf = shm.buf
+        if ctypes.c_uint32.from_buffer(buf, OFF_MAGIC).value != MAGIC:
+            raise ValueError(f"shared memory {shm.name!r} is not a transport ring")
+        if ctypes.c_uint32.from_buffer(buf, OFF_VERSION).value != VERSION:
+            raise ValueError(f"shared memory {shm.name!r} has an unknown ring version")
+        self.capacity = ctypes.c_uint64.from_buffer(buf, OFF_CAPACITY).value
+        self.readers = ctypes.c_uint32.from_buffer(buf, OFF_READERS).value
+        self.producer = ctypes.c_uint32.from_buffer(buf, OFF_PRODUCER)
+        self.write_pos = ctypes.c_uint64.from_buffer(buf, OFF_WRITE_POS)
+        self.seq = ctypes.c_uint32.from_buffer(buf, OFF_SEQ)
+        self.seq_addr = ctypes.addressof(self.seq)
+        slots = _slots_offset(self.readers)
+        self.slot_pid = [ctypes.c_uint32.from_buffer(buf, slots + i * SLOT_SIZE) for i in range(self.readers)]
+        self.slot_pos = [ctypes.c_uint64.from_buffer(buf, slots + i * SLOT_SIZE + 8) for i in range(self.readers)]
+        self.sleeping = buf[OFF_SLEEPING:OFF_SLEEPING + self.readers]
+        # the producer checks all flags at once, a u64 word per 8 readers
+        self.sleeping_words = buf[OFF_SLEEPING:OFF_SLEEPING + _align8(self.readers)].cast("Q")
+        start = _data_offset(self.readers)
+        self.data = buf[start:start + self.capacity]
+
+    @staticmethod
+    def create(name: str, capacity: int, readers: int) -> "_Ring":
+        capacity = _align8(capacity)
+        shm = _open_segment(name, _data_offset(readers) + capacity)
+        buf = shm.buf
+        ctypes.c_uint64.from_buffer(buf, OFF_CAPACITY).value = capacity
+        ctypes.c_uint32.from_buffer(buf, OFF_READERS).value = readers
+        ctypes.c_uint32.from_buffer(buf, OFF_VERSION).value = VERSION
+        ctypes.c_uint32.from_buffer(buf, OFF_MAGIC).value = MAGIC  # last: the ring is valid from here
+        return _Ring(shm)
+
+    def close(self) -> None:
+        # drop our ctypes views so the mapping can go as soon as callers drop theirs
+        self.producer = self.write_pos = self.seq = None
+        self.slot_pid = self.slot_pos = []
+        for view in (self.sleeping, self.sleeping_words, self.data):
+            view.release()
+        self.shm.close()
+
+
+def unlink(name: str) -> None:
+    """Remove a channel's segment (readers attached to it keep their mapping)."""
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+# ---------------- producer -----------------
+
+
+class ShmWriter:
+    """The single producer of a channel.
+
+    Creates the ring, or continues an existing one left by a previous
+    producer. A second live producer on the same channel is refused.
+    Records never wait for readers.
+    """
+
+    def __init__(self, name: str, capacity: int = SHM_BYTES, readers: int = SHM_READERS):
+        self.name = name
+        self._owner = _lock(name, "producer", blocking=False)
+        if self._owner is None:
+            raise RuntimeError(f"shared-memory channel {name!r} already has a producer")
+        try:
+            self.ring = _Ring(_open_segment(name))
+        except FileNotFoundError:
+            self.ring = _Ring.create(name, capacity, readers)
+        self.ring.producer.value = os.getpid()
+        self.capacity = self.ring.capacity
+        self.max_message = self.capacity // 4
+        self._pos = self.ring.write_pos.value
+        self.stats = {"messages": 0, "bytes": 0, "wakeups": 0}
+
+    def send(self, data) -> None:
+        n = len(data)
+        if n > self.max_message:
+            raise ValueError(f"message of {n} bytes exceeds a quarter of the {self.capacity}-byte ring")
+        ring, cap = self.ring, self.capacity
+        need = _align8(4 + n)
+        pos = self._pos
+        off = pos % cap
+        if cap - off < need:
+            REC_LEN.pack_into(ring.data, off, WRAP)
+            pos += cap - off
+            off = 0
+        ring.data[off + 4: off + 4 + n] = data
+        REC_LEN.pack_into(ring.data, off, n)
+        self._pos = pos + need
+        ring.write_pos.value = self._pos  # publish: readers may now read the record
+        ring.seq.value = (ring.seq.value + 1) & 0xFFFFFFFF
+        self.stats["messages"] += 1
+        self.stats["bytes"] += n
+        if HAVE_FUTEX and any(ring.sleeping_words):
+            futex_wake(ring.seq_addr)
+            self.stats["wakeups"] += 1
+
+    def close(self) -> None:
+        if self.ring is not None:
+            self.ring.producer.value = 0
+            self.ring.close()
+            self.ring = None
+        self._owner.close()
+
+
+class ShmSender:
+    """Socket stand-in for publishers: sendto(data, (host, port)) writes to that port's channel."""
+
+    def __init__(self, capacity: int = SHM_BYTES, readers: int = SHM_READERS):
+        self.capacity = capacity
+        self.readers = readers
+        self.writers: dict[int, ShmWriter] = {}
+
+    def sendto(self, data, addr) -> int:
+        w = self.writers.get(addr[1])
+        if w is None:
+            w = self.writers[addr[1]] = ShmWriter(channel_name(addr[1]), self.capacity, self.readers)
+        w.send(data)
+        return len(data)
+
+    def fileno(self) -> int:
+        return -1 if self.writers is None else 0
+
+    def close(self) -> None:
+        for w in (self.writers or {}).values():
+            w.close()
+        self.writers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------- consumers -----------------
+
+
+class ShmReader:
+    """One consumer of a channel, usable where the receive helpers take a UDP socket.
+
+    recv_views() returns memoryviews straight into the ring: no copy is
+    made, and they stay valid until the producer laps this reader, which
+    intact() reports after the fact. BulkReceiver and QosReceiver use it
+    that way. A reader starts at the newest message, like a socket that
+    was just bound, and waits for the producer if the channel doesn't
+    exist yet.
+    """
+
+    def __init__(self, name: str, timeout_s: Optional[float] = None, max_batch: int = 1024):
+        self.name = name
+        self.timeout_s = timeout_s
+        self.max_batch = max_batch
+        self.ring: Optional[_Ring] = None
+        self.slot = -1
+        self.addrs: list = []
+        self._pos = 0
+        self._batch_start = 0
+        self._closed = False
+        self.stats = {"messages": 0, "overruns": 0, "lost_bytes": 0}
+        self._attach()
+
+    def _attach(self) -> bool:
+        try:
+            ring = _Ring(_open_segment(self.name))
+        except (FileNotFoundError, ValueError):
+            return False
+        lock = _lock(self.name, "readers", blocking=True)
+        try:
+            for i, pid in enumerate(ring.slot_pid):
+                if pid.value == 0 or not _alive(pid.value):
+                    pid.value = os.getpid()
+                    self.slot = i
+                    break
+            else:
+                ring.close()
+                raise RuntimeError(f"all {ring.readers} reader slots of {self.name!r} are taken")
+        finally:
+            lock.close()
+        self.ring = ring
+        self.capacity = ring.capacity
+        self._pos = self._batch_start = ring.write_pos.value
+        return True
+
+    # -- socket-like surface --
+
+    def settimeout(self, timeout_s: Optional[float]) -> None:
+        self.timeout_s = timeout_s
+
+    def gettimeout(self) -> Optional[float]:
+        return self.timeout_s
+
+    def fileno(self) -> int:
+        return -1 if self._closed else 0
+
+    def sendto(self, data, addr) -> int:
+        return len(data)  # nowhere to send replies (QoS acks): the ring itself doesn't lose messages
+
+    def recvfrom_into(self, buf, nbytes: int = 0, flags: int = 0):
+        """Copying, one-message fallback for code that wants a socket."""
+        views = self.recv_views(limit=1)
+        n = min(len(views[0]), len(buf) if not nbytes else nbytes)
+        buf[:n] = views[0][:n]
+        return n, self.addrs[0]
+
+    # -- ring access --
+
+    def _wait(self, deadline: Optional[float]) -> bool:
+        """Wait until data is available; False on timeout."""
+        ring = self.ring
+        spin = 0
+        while True:
+            if ring is not None and ring.write_pos.value != self._pos:
+                return True
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return False
+            left = MAX_WAIT_S if deadline is None else min(MAX_WAIT_S, deadline - now)
+            if ring is None:
+                time.sleep(min(left, 0.1))
+                if self._attach():
+                    ring = self.ring
+                continue
+            if HAVE_FUTEX:
+                seq = ring.seq.value
+                ring.sleeping[self.slot] = 1
+                try:
+                    if ring.write_pos.value == self._pos:
+                        futex_wait(ring.seq_addr, seq, left)
+                finally:
+                    ring.sleeping[self.slot] = 0
+            else:
+                spin += 1
+                time.sleep(min(left, 0.00005 * (1 << min(spin, 6))))  # 50 us .. 3.2 ms
+
+    def recv_views(self, limit: int = 0) -> list[memoryview]:
+        """Views of the messages published since the last call (blocks like recvfrom)."""
+        if self._closed:
+            raise OSError("reader is closed")
+        deadline = None if self.timeout_s is None else time.monotonic() + self.timeout_s
+        while True:
+            if not self._wait(deadline):
+                raise socket.timeout("timed out")
+            views = self._read(limit or self.max_batch)
+            if views:
+                return views
+
+    def _read(self, limit: int) -> list[memoryview]:
+        ring, cap = self.ring, self.capacity
+        write_pos = ring.write_pos.value
+        pos = self._pos
+        if write_pos - pos > cap:
+            self._overrun(write_pos - pos - cap)
+            pos = write_pos  # lapped: what is left unread may already be overwritten
+        self._batch_start = pos
+        data, views = ring.data, []
+        while pos < write_pos and len(views) < limit:
+            off = pos % cap
+            (n,) = REC_LEN.unpack_from(data, off)
+            end = pos + (cap - off if n == WRAP else _align8(4 + n))
+            # a length the producer overwrote while we read it must not move the cursor
+            if (n != WRAP and n > cap // 4) or end > write_pos or ring.write_pos.value - pos > cap:
+                write_pos = ring.write_pos.value
+                self._overrun(write_pos - pos)
+                pos = write_pos
+                break
+            if n != WRAP:
+                views.append(data[off + 4: off + 4 + n])
+            pos = end
+        self._pos = pos
+        ring.slot_pos[self.slot].value = pos
+        self.addrs = [("shm", 0)] * len(views)
+        self.stats["messages"] += len(views)
+        return views
+
+    def _overrun(self, lost: int) -> None:
+        self.stats["overruns"] += 1
+        self.stats["lost_bytes"] += lost
+
+    def intact(self) -> bool:
+        """True if the views of the last recv_views() were not overwritten meanwhile.
+
+        When they were, the cursor is moved to the newest data, as on a lap.
+        """
+        if self.ring is None:
+            return True
+        write_pos = self.ring.write_pos.value
+        if write_pos - self._batch_start <= self.capacity:
+            return True
+        if self._pos != write_pos:
+            self._overrun(write_pos - self._pos)
+            self._pos = write_pos
+            self.ring.slot_pos[self.slot].value = write_pos
+        return False
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self.ring is not None:
+            self.ring.sleeping[self.slot] = 0
+            self.ring.slot_pid[self.slot].value = 0
+            self.ring.close()
+            self.ring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,26 +1,28 @@
 # demo/simulate_messages.py
-import uuid
 import time
 import json
+import uuri
+from ids import new_id
 
 def uuri_str(authority, ue_id, resource, vmajor=1):
-    # Simple string format for demo purposes
-    return f"up://{authority}/{ue_id}{resource}?v={vmajor}"
+    # interned, so repeated topics cost a cache lookup rather than formatting
+    return str(uuri.uuri(authority, ue_id, resource, vmajor))
 
 def uevent(topic_uri, payload_dict):
     return {
         "type": "EVENT",
-        "id": str(uuid.uuid4()),
+        "id": new_id(),
         "source": uuri_str("car-01", "vehicle.telemetry", "/publisher"),
         "target": topic_uri,
         "content_type": "application/json",
         "payload": payload_dict,  # would be bytes in real system
         "qos": 0,
         "ttl_ms": 2000,
+        "ts_ms": int(time.time() * 1000),  # ttl_ms counts from here
     }
 
 def urequest(method_uri, payload_dict):
-    msg_id = str(uuid.uuid4())
+    msg_id = new_id()
     return {
         "type": "REQUEST",
         "id": msg_id,
@@ -30,12 +32,13 @@ def urequest(method_uri, payload_dict):
         "payload": payload_dict,
         "qos": 1,
         "ttl_ms": 3000,
+        "ts_ms": int(time.time() * 1000),
     }
 
 def uresponse(request_id, to_uri, status_dict, result_dict=None):
     return {
         "type": "RESPONSE",
-        "id": str(uuid.uuid4()),
+        "id": new_id(),
         "correlation_id": request_id,  # pairs the response to the request
         "source": uuri_str("car-01", "body.control", "/service"),
         "target": to_uri,
@@ -48,12 +51,12 @@ def main():
     # ---- Event example: speed telemetry ----
     topic = uuri_str("car-01", "vehicle.telemetry", "/speed")
     speed_evt = uevent(topic, {"kmh": 72, "timestamp_ms": int(time.time() * 1000)})
-    print("EVENT ->", json.dumps(speed_evt, indent=2))
+    print("EVENT ->", json.dumps(speed_evt, indent=2, default=str))
 
     # ---- RPC example: lock doors ----
     lock_uri = uuri_str("car-01", "body.control", "/doors/lock")
     req = urequest(lock_uri, {"lock": True})
-    print("REQUEST ->", json.dumps(req, indent=2))
+    print("REQUEST ->", json.dumps(req, indent=2, default=str))
 
     # Fake the service handling and replying OK
     resp = uresponse(
@@ -62,7 +65,7 @@ def main():
         status_dict={"code": "OK", "message": "Doors locked"},
         result_dict={"success": True}
     )
-    print("RESPONSE ->", json.dumps(resp, indent=2))
+    print("RESPONSE ->", json.dumps(resp, indent=2, default=str))
 
 if __name__ == "__main__":
     main()
@@ -1,71 +1,192 @@
 # demo/status_summary.py
 import os, time, json, socket, threading
 from pathlib import Path
-from common import udp_bind, udp_recv_json, udp_send_json, epoch_ms
+from common import QosReceiver, notify_ready, udp_subscribe, udp_send_json, epoch_ms
+from log_tail import LogTailer
+import metrics
+import uuri
 
 # inputs
 SPEED_HOST = os.getenv("SUM_SPEED_HOST", "127.0.0.1")
 SPEED_PORT = int(os.getenv("SUM_SPEED_PORT", "50052"))  # listen to telemetry
+SPEED_TOPIC = os.getenv("SUM_SPEED_TOPIC", "up://*/vehicle.telemetry/speed?v=1")  # used with DEMO_BROKER
 AUDIT_FILE = Path(os.getenv("SUM_AUDIT_PATH", "logs/audit.jsonl"))
+AUDIT_CHECKPOINT = Path(os.getenv("SUM_AUDIT_CHECKPOINT", str(AUDIT_FILE.with_name(".audit.ckpt"))))
+DEFAULT_VEHICLE = os.getenv("SUM_VEHICLE", "car-01")  # for lock commands that name no target
 
 # output
 OUT_HOST = os.getenv("SUM_OUT_HOST", "127.0.0.1")
 OUT_PORT = int(os.getenv("SUM_OUT_PORT", "50054"))
 
-INTERVAL_S = float(os.getenv("SUM_INTERVAL_S", "10"))
+INTERVAL_S = float(os.getenv("SUM_INTERVAL_S", "10"))             # full-state heartbeat
+MIN_INTERVAL_MS = float(os.getenv("SUM_MIN_INTERVAL_MS", "250"))  # deltas are coalesced to at most one per this
+SPEED_DELTA = float(os.getenv("SUM_SPEED_DELTA", "1"))            # smaller speed changes are not worth a delta
 
-state = {"speed_kmh": None, "locked": None, "last_lock_ts": None}
+FIELDS = ("speed_kmh", "locked", "last_lock_ts")
 
-def speed_listener():
-    sock = udp_bind(SPEED_HOST, SPEED_PORT, None)
+class SummaryState:
+    """Per-vehicle status shared by the listener threads and the publisher.
+
+    Every read and write goes through one Condition. Writers record only
+    meaningful changes in `dirty` and wake the publisher, which takes the
+    accumulated delta in one step.
+    """
+
+    def __init__(self, speed_delta: float = SPEED_DELTA):
+        self.speed_delta = speed_delta
+        self.cond = threading.Condition()
+        self.vehicles: dict[str, dict] = {}
+        self.dirty: dict[str, dict] = {}
+
+    def update(self, vehicle: str, **fields) -> bool:
+        with self.cond:
+            cur = self.vehicles.setdefault(vehicle, dict.fromkeys(FIELDS))
+            changed = {}
+            for k, v in fields.items():
+                old = cur.get(k)
+                if k == "speed_kmh" and old is not None and v is not None and abs(v - old) < self.speed_delta:
+                    continue
+                if v != old:
+                    changed[k] = v
+            if not changed:
+                return False
+            cur.update(changed)
+            cur["last_update"] = epoch_ms()
+            self.dirty.setdefault(vehicle, {}).update(changed)
+            self.cond.notify()
+            return True
+
+    def take_delta(self) -> dict:
+        with self.cond:
+            delta, self.dirty = self.dirty, {}
+            return delta
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            self.dirty = {}  # a full snapshot supersedes any pending delta
+            return {v: dict(s) for v, s in self.vehicles.items()}
+
+state = SummaryState()
+
+log = metrics.Log("summary")
+SPEED_EVENTS = metrics.counter("summary.speed_events")
+LOCK_EVENTS = metrics.counter("summary.lock_events")
+EMITTED = {"VEHICLE_STATUS_DELTA": metrics.counter("summary.deltas"),
+           "VEHICLE_STATUS_SUMMARY": metrics.counter("summary.heartbeats")}
+AGE_US = metrics.histogram("summary.receive_to_dispatch_us")  # speed envelope ts_ms -> state updated
+metrics.gauge("summary.vehicles", lambda: len(state.vehicles))
+
+def vehicle_of(uri, default=None):
+    try:
+        return uuri.parse(uri or "").authority
+    except ValueError:
+        return default
+
+def on_speed(evt: dict) -> None:
+    """One speed event (also called by service_host for events off its bus)."""
+    SPEED_EVENTS.inc()
+    payload = evt.get("payload")
+    kmh = payload.get("kmh") if isinstance(payload, dict) else None
+    vehicle = vehicle_of(evt.get("source")) or vehicle_of(evt.get("target"))
+    # anything but a number would break the speed delta in SummaryState.update
+    if isinstance(kmh, (int, float)) and not isinstance(kmh, bool) and vehicle:
+        state.update(vehicle, speed_kmh=kmh)
+    age = metrics.since_ms_us(evt.get("ts_ms"))
+    if age is not None:
+        AGE_US.record(age)
+
+def speed_listener(sock: socket.socket):
+    rx = QosReceiver(sock)
+    metrics.gauge("summary.receiver", lambda: dict(rx.stats))
     try:
-        while True:
-            evt = udp_recv_json(sock)
-            state["speed_kmh"] = evt.get("payload", {}).get("kmh")
+        for evt in rx:
+            on_speed(evt)
     finally:
         sock.close()
 
 def audit_watcher():
     AUDIT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    last_size = 0
-    while True:
-        try:
-            if AUDIT_FILE.exists():
-                sz = AUDIT_FILE.stat().st_size
-                if sz > last_size:
-                    with AUDIT_FILE.open("r", encoding="utf-8") as f:
-                        f.seek(last_size)
-                        for line in f:
-                            try:
-                                obj = json.loads(line)
-                                if "lock" in obj.get("request", {}):
-                                    state["locked"] = bool(obj.get("response", {}).get("success", False))
-                                    state["last_lock_ts"] = obj.get("ts_ms")
-                            except Exception:
-                                pass
-                    last_size = sz
-        except Exception:
-            pass
-        time.sleep(1)
-
-def publisher():
+    tailer = LogTailer(AUDIT_FILE, checkpoint_path=AUDIT_CHECKPOINT, poll_interval_s=1.0)
+    # resume the lock state that was current at the checkpoint
+    locks = tailer.meta.setdefault("locks", {})
+    if "locked" in tailer.meta:  # checkpoint from the single-vehicle version
+        locks.setdefault(DEFAULT_VEHICLE, {"locked": tailer.meta.pop("locked"),
+                                           "last_lock_ts": tailer.meta.pop("last_lock_ts", None)})
+    for vehicle, s in locks.items():
+        state.update(vehicle, **s)
+    try:
+        for line in tailer.follow():
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            request = obj.get("request", {})
+            if request.get("method") == "lock":
+                LOCK_EVENTS.inc()
+                vehicle = vehicle_of(request.get("target"), DEFAULT_VEHICLE)
+                s = {"locked": bool(obj.get("response", {}).get("success", False)),
+                     "last_lock_ts": obj.get("ts_ms")}
+                state.update(vehicle, **s)
+                locks[vehicle] = s
+    finally:
+        tailer.close()
+
+def summary_message(vehicles: dict, seq: int) -> dict:
+    msg = {"type": "VEHICLE_STATUS_SUMMARY", "seq": seq, "vehicles": vehicles, "last_update": epoch_ms()}
+    # single-vehicle fields kept for existing consumers
+    default = vehicles.get(DEFAULT_VEHICLE, {})
+    msg["speed_kmh"], msg["locked"] = default.get("speed_kmh"), default.get("locked")
+    return msg
+
+def run_publisher(summary: SummaryState, emit, min_interval_s: float, heartbeat_s: float, stop=None):
+    """Emit VEHICLE_STATUS_DELTA on change (at most one per min_interval_s) and a full
+    VEHICLE_STATUS_SUMMARY every heartbeat_s, whether or not anything changed."""
+    seq = 0
+    last_delta = 0.0
+    next_heartbeat = time.monotonic()
+    while stop is None or not stop.is_set():
+        with summary.cond:
+            while True:
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    break
+                if summary.dirty and now - last_delta >= min_interval_s:
+                    break
+                # changes that arrive while we wait out min_interval_s merge into one delta
+                wake = next_heartbeat if not summary.dirty else min(next_heartbeat, last_delta + min_interval_s)
+                summary.cond.wait(min(wake - now, 0.5))
+                if stop is not None and stop.is_set():
+                    return
+        seq += 1
+        if now >= next_heartbeat:
+            emit(summary_message(summary.snapshot(), seq))
+            next_heartbeat = now + heartbeat_s
+        else:
+            emit({"type": "VEHICLE_STATUS_DELTA", "seq": seq, "vehicles": summary.take_delta(),
+                  "last_update": epoch_ms()})
+        last_delta = now
+
+def publisher(stop=None):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     addr = (OUT_HOST, OUT_PORT)
+
+    def emit(msg):
+        udp_send_json(sock, addr, msg)
+        EMITTED[msg["type"]].inc()
+        if msg["type"] == "VEHICLE_STATUS_SUMMARY":
+            log.info("emitted: %s", msg)
+        else:
+            log.sampled("delta", "emitted: %s", msg)
+
     try:
-        while True:
-            msg = {
-                "type": "VEHICLE_STATUS_SUMMARY",
-                "speed_kmh": state["speed_kmh"],
-                "locked": state["locked"],
-                "last_update": epoch_ms(),
-            }
-            udp_send_json(sock, addr, msg)
-            print("[summary] emitted:", msg, flush=True)
-            time.sleep(INTERVAL_S)
+        run_publisher(state, emit, MIN_INTERVAL_MS / 1000, INTERVAL_S, stop)
     finally:
         sock.close()
 
 if __name__ == "__main__":
-    threading.Thread(target=speed_listener, daemon=True).start()
+    metrics.start_exporters("status_summary")
+    threading.Thread(target=speed_listener, args=(udp_subscribe(SPEED_TOPIC, SPEED_HOST, SPEED_PORT, None),),
+                     daemon=True).start()
     threading.Thread(target=audit_watcher, daemon=True).start()
+    notify_ready("status_summary")
     publisher()
@@ -5,24 +5,36 @@ import socket
 import sys
 import time
 
+from bulk_io import recv_one
+from common import TRANSPORT, QosReceiver, broker_addr, notify_ready, udp_subscribe
+import metrics
+
 HOST = os.getenv("DEMO_BIND_HOST", "127.0.0.1")
 PORT = int(os.getenv("DEMO_BIND_PORT", "50052"))
 # If DEMO_SUB_TIMEOUT > 0, the script will wait up to that many seconds
 # for a single message and then exit (good for CI).
 SUB_TIMEOUT = float(os.getenv("DEMO_SUB_TIMEOUT", "0"))  # 0 = run forever
+TOPIC = os.getenv("DEMO_SUB_TOPIC", "up://car-01/vehicle.telemetry/*")  # used with DEMO_BROKER
+
+log = metrics.Log("svc")
+EVENTS = metrics.counter("sub.events")
+AGE_US = metrics.histogram("sub.receive_to_dispatch_us")  # envelope ts_ms -> handled
 
 def main():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    # Make binds more reliable on CI
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind((HOST, PORT))
+    if broker_addr() is not None or TRANSPORT == "shm":
+        sock = udp_subscribe(TOPIC, HOST, PORT)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Make binds more reliable on CI
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((HOST, PORT))
+    notify_ready("sub_telemetry")
 
     if SUB_TIMEOUT > 0:
         # CI mode: receive one packet or time out, then exit
         sock.settimeout(SUB_TIMEOUT)
         try:
-            data, addr = sock.recvfrom(65535)
-            msg = json.loads(data.decode("utf-8"))
+            msg = recv_one(sock)
             # print to make debugging easier in logs
             print("[svc] got:", json.dumps(msg), file=sys.stdout, flush=True)
         except socket.timeout:
@@ -31,18 +43,33 @@ def main():
             sock.close()
         return
 
-    # Local/dev mode: print every packet forever
-    print(f"[svc] BodyControl listening on udp://{HOST}:{PORT}", flush=True)
+    # Local/dev mode: run forever; a sample of the events is printed
+    metrics.start_exporters("sub_telemetry")
+    log.info("BodyControl listening on udp://%s:%s", HOST, PORT)
     try:
-        while True:
-            data, addr = sock.recvfrom(65535)
-            try:
-                msg = json.loads(data.decode("utf-8"))
-            except Exception:
-                msg = {"raw": data.decode("utf-8", errors="replace")}
-            print("[svc] EVENT:", json.dumps(msg, indent=2), flush=True)
+        serve(sock)
     finally:
         sock.close()
 
+def serve(sock: socket.socket) -> None:
+    """Handle everything `sock` receives, forever."""
+    rx = QosReceiver(sock)
+    metrics.gauge("sub.receiver", lambda: dict(rx.stats))
+    # many datagrams (and coalesced batches) per wakeup; undecodable, expired and
+    # duplicate messages are skipped, QoS 1 ones are acked
+    for msg in rx:
+        handle(msg)
+
+def handle(msg: dict) -> None:
+    """One received event (also called by service_host for events off its bus)."""
+    EVENTS.inc()
+    age = metrics.since_ms_us(msg.get("ts_ms"))
+    if age is not None:
+        AGE_US.record(age)
+    if log.enabled("debug"):
+        log.debug("EVENT: %s", metrics.lazy(json.dumps, msg, indent=2))
+    else:
+        log.sampled("event", "EVENT: %s", metrics.lazy(json.dumps, msg))
+
 if __name__ == "__main__":
     main()
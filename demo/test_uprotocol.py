@@ -1,26 +1,21 @@
-
 import importlib
 import uuid as _stdlib_uuid
 
+import ids
+
 
 def get_uuid():
-    """Return a UUID using uProtocol if available, else stdlib uuid4()."""
-    try:
-        # Most builds: function lives in uprotocol.uuid.factory
-        uf = importlib.import_module("uprotocol.uuid.factory")
-        # common names we've seen across versions
-        for name in ("uuid", "uuid4", "random_uuid", "generate", "new"):
-            if hasattr(uf, name) and callable(getattr(uf, name)):
-                u = getattr(uf, name)()
-                print(f"[uuid] used uprotocol.uuid.factory.{name}()")
-                return u
-    except Exception as e:
-        print("[uuid] uprotocol.uuid.factory not usable:", e)
+    """Return a UUID using uProtocol if available, else a uProtocol-style UUIDv8 (demo/ids.py).
 
-    # Fallback to Python stdlib
-    u = _stdlib_uuid.uuid4()
-    print("[uuid] fell back to stdlib uuid.uuid4()")
-    return u
+    The SDK lookup happens once per process (ids.uprotocol_factory is cached).
+    """
+    fn = ids.uprotocol_factory()
+    if fn is not None:
+        try:
+            return fn()
+        except Exception as e:
+            print("[uuid] uprotocol.uuid.factory not usable:", e)
+    return _stdlib_uuid.UUID(bytes=ids.new_id())
 
 
 def build_uuri():
@@ -59,6 +54,11 @@ def build_uuri():
 
 
 def main():
+    fn = ids.uprotocol_factory()
+    if fn is not None:
+        print(f"[uuid] using uprotocol.uuid.factory.{fn.__name__}()")
+    else:
+        print("[uuid] uprotocol.uuid.factory not available; using demo UUIDv8 ids")
     u = get_uuid()
     print("Generated UUID:", u)
     uri_value = build_uuri()
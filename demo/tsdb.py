@@ -0,0 +1,446 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+import uuri
+
+
+# Each series (vehicle, topic) is a directory of fixed-size, memory-mapped
+# segment files: raw samples plus one rollup log per resolution.
+#
+#   <root>/<vehicle>/<topic>/raw-000001.seg
+#   <root>/<vehicle>/<topic>/1s-000001.seg, 1m-..., 1h-...
+#
+# A segment is a 64-byte header (int64[8]) followed by `capacity` rows.
+
+SEG_MAGIC = 0x5453_4442  # "TSDB"
+SEG_VERSION = 1
+HEADER_WORDS = 8
+HEADER_BYTES = HEADER_WORDS * 8
+H_MAGIC, H_VERSION, H_COUNT, H_CAPACITY, H_MIN, H_MAX, H_SORTED = range(7)
+
+RAW_DTYPE = np.dtype([("ts", "<i8"), ("value", "<f8")])
+ROLLUP_DTYPE = np.dtype([("ts", "<i8"), ("min", "<f8"), ("max", "<f8"), ("sum", "<f8"), ("count", "<i8")])
+
+# coarsest first; a query is served from the first level no finer than it needs
+LEVELS = (("1h", 3_600_000), ("1m", 60_000), ("1s", 1_000))
+
+DEFAULT_SEGMENT_ROWS = 1 << 18
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+# ---------------- segments -----------------
+
+
+class Segment:
+    """One memory-mapped segment file: header counters plus a row array."""
+
+    def __init__(self, path: Path, dtype: np.dtype, capacity: int = 0, readonly: bool = False):
+        self.path = path
+        if not path.exists():
+            if readonly:
+                raise FileNotFoundError(path)
+            with open(path, "wb") as f:  # sparse: untouched pages cost nothing
+                f.truncate(HEADER_BYTES + capacity * dtype.itemsize)
+            hdr = np.memmap(path, dtype="<i8", mode="r+", shape=(HEADER_WORDS,))
+            hdr[:] = (SEG_MAGIC, SEG_VERSION, 0, capacity, 0, 0, 1, 0)
+            hdr.flush()
+            del hdr
+        mode = "r" if readonly else "r+"
+        self.header = np.memmap(path, dtype="<i8", mode=mode, shape=(HEADER_WORDS,))
+        if self.header[H_MAGIC] != SEG_MAGIC:
+            raise ValueError(f"not a tsdb segment: {path}")
+        self.capacity = int(self.header[H_CAPACITY])
+        self.rows = np.memmap(path, dtype=dtype, mode=mode, offset=HEADER_BYTES, shape=(self.capacity,))
+
+    @property
+    def count(self) -> int:
+        return int(self.header[H_COUNT])
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.count
+
+    @property
+    def sorted(self) -> bool:
+        return bool(self.header[H_SORTED])
+
+    def bounds(self) -> tuple[int, int]:
+        return int(self.header[H_MIN]), int(self.header[H_MAX])
+
+    def append(self, rows: np.ndarray) -> None:
+        n, k = self.count, len(rows)
+        self.rows[n:n + k] = rows
+        ts = rows["ts"]
+        lo, hi = int(ts.min()), int(ts.max())
+        hdr = self.header
+        if n == 0:
+            hdr[H_MIN], hdr[H_MAX] = lo, hi
+        else:
+            if ts[0] < hdr[H_MAX]:
+                hdr[H_SORTED] = 0
+            hdr[H_MIN], hdr[H_MAX] = min(lo, int(hdr[H_MIN])), max(hi, int(hdr[H_MAX]))
+        hdr[H_COUNT] = n + k  # publish last, so concurrent readers never see unwritten rows
+
+    def select(self, start: int, end: int) -> np.ndarray:
+        """Rows with start <= ts < end (a view when the segment is sorted)."""
+        live = self.rows[: self.count]
+        if self.sorted:
+            ts = live["ts"]
+            return live[np.searchsorted(ts, start, "left"): np.searchsorted(ts, end, "left")]
+        ts = live["ts"]
+        return live[(ts >= start) & (ts < end)]
+
+    def flush(self) -> None:
+        if self.rows.mode != "r":
+            self.rows.flush()
+            self.header.flush()
+
+
+class SegmentLog:
+    """Append-only sequence of segments sharing one dtype and file prefix."""
+
+    def __init__(self, directory: Path, prefix: str, dtype: np.dtype, segment_rows: int, readonly: bool = False):
+        self.dir = directory
+        self.prefix = prefix
+        self.dtype = dtype
+        self.segment_rows = segment_rows
+        self.readonly = readonly
+        self.segments: list[Segment] = []
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Pick up segments created since the last call (e.g. by a writer process)."""
+        names = sorted(p.name for p in self.dir.glob(f"{self.prefix}-*.seg"))
+        for name in names[len(self.segments):]:
+            try:
+                self.segments.append(Segment(self.dir / name, self.dtype, readonly=self.readonly))
+            except ValueError:  # a writer is still initialising it; pick it up next time
+                break
+
+    def _tail(self) -> Segment:
+        if not self.segments or self.segments[-1].free == 0:
+            path = self.dir / f"{self.prefix}-{len(self.segments) + 1:06d}.seg"
+            self.segments.append(Segment(path, self.dtype, self.segment_rows))
+        return self.segments[-1]
+
+    def append(self, rows: np.ndarray) -> None:
+        while len(rows):
+            seg = self._tail()
+            take = min(seg.free, len(rows))
+            seg.append(rows[:take])
+            rows = rows[take:]
+
+    def newest(self) -> Optional[int]:
+        """Largest ts stored (rows appended out of order are never the newest)."""
+        for seg in reversed(self.segments):
+            if seg.count:
+                return seg.bounds()[1]
+        return None
+
+    def select(self, start: int, end: int) -> np.ndarray:
+        parts = []
+        for seg in self.segments:
+            if not seg.count:
+                continue
+            lo, hi = seg.bounds()
+            if hi < start or lo >= end:
+                continue
+            parts.append(seg.select(start, end))
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        out = np.concatenate(parts)
+        if not all(s.sorted for s in self.segments):
+            out = out[np.argsort(out["ts"], kind="stable")]
+        return out
+
+    def find(self, ts: int) -> Optional[tuple[Segment, int]]:
+        """Segment and row holding exactly `ts`."""
+        for seg in self.segments:
+            lo, hi = seg.bounds()
+            if not seg.count or not lo <= ts <= hi:
+                continue
+            col = seg.rows[: seg.count]["ts"]
+            if seg.sorted:
+                i = int(np.searchsorted(col, ts))
+                if i < seg.count and col[i] == ts:
+                    return seg, i
+            else:
+                hits = np.flatnonzero(col == ts)
+                if len(hits):
+                    return seg, int(hits[0])
+        return None
+
+    def flush(self) -> None:
+        for seg in self.segments:
+            seg.flush()
+
+
+# ---------------- series -----------------
+
+
+def _merge_into(row, mn: float, mx: float, sm: float, cnt: int) -> None:
+    row["min"] = min(row["min"], mn)
+    row["max"] = max(row["max"], mx)
+    row["sum"] += sm
+    row["count"] += cnt
+
+
+class Series:
+    """Raw samples of one (vehicle, topic) plus incrementally maintained rollups."""
+
+    def __init__(self, directory: Path, segment_rows: int = DEFAULT_SEGMENT_ROWS, readonly: bool = False):
+        self.dir = directory
+        if not readonly:
+            directory.mkdir(parents=True, exist_ok=True)
+        self.raw = SegmentLog(directory, "raw", RAW_DTYPE, segment_rows, readonly)
+        # rollups hold far fewer rows; size their segments accordingly
+        self.rollups = {
+            name: SegmentLog(directory, name, ROLLUP_DTYPE, max(1024, segment_rows * 1000 // width), readonly)
+            for name, width in LEVELS
+        }
+        self.late = 0  # samples older than their rollup's newest bucket
+
+    def refresh(self) -> None:
+        self.raw.refresh()
+        for log in self.rollups.values():
+            log.refresh()
+
+    def append(self, ts: np.ndarray, values: np.ndarray) -> None:
+        ts = np.asarray(ts, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if not len(ts):
+            return
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[order]
+        rows = np.empty(len(ts), dtype=RAW_DTYPE)
+        rows["ts"], rows["value"] = ts, values
+        self.raw.append(rows)
+        for name, width in LEVELS:
+            self._roll(self.rollups[name], width, ts, values)
+
+    def _roll(self, log: SegmentLog, width: int, ts: np.ndarray, values: np.ndarray) -> None:
+        buckets = ts - ts % width
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        groups = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+        groups["ts"] = buckets[starts]
+        groups["min"] = np.minimum.reduceat(values, starts)
+        groups["max"] = np.maximum.reduceat(values, starts)
+        groups["sum"] = np.add.reduceat(values, starts)
+        groups["count"] = np.diff(np.r_[starts, len(values)])
+
+        newest = log.newest()
+        if newest is not None:
+            old = groups["ts"] <= newest
+            self.late += int(groups["count"][groups["ts"] < newest].sum())
+            missing = []
+            for g in groups[old]:  # the open bucket, and late data: merge into the stored bucket
+                hit = log.find(int(g["ts"]))
+                if hit is None:
+                    missing.append(g)
+                else:
+                    seg, i = hit
+                    _merge_into(seg.rows[i], g["min"], g["max"], g["sum"], g["count"])
+            # a late bucket that was never stored is added out of order; readers re-sort
+            groups = np.concatenate([np.array(missing, dtype=ROLLUP_DTYPE), groups[~old]])
+        if len(groups):
+            log.append(groups)
+
+    def query(self, start_ms: int, end_ms: int, resolution_ms: int) -> dict:
+        """Buckets of `resolution_ms` over [start_ms, end_ms), from the coarsest level that fits."""
+        level, width = "raw", 1
+        for name, w in LEVELS:
+            if w <= resolution_ms:
+                level, width = name, w
+                break
+        if level == "raw":
+            rows = self.raw.select(start_ms, end_ms)
+            ts, mn, mx, sm, cnt = rows["ts"], rows["value"], rows["value"], rows["value"], np.ones(len(rows), np.int64)
+        else:
+            # whole buckets: the first one may start before start_ms
+            rows = self.rollups[level].select(start_ms - start_ms % width, end_ms)
+            ts, mn, mx, sm, cnt = rows["ts"], rows["min"], rows["max"], rows["sum"], rows["count"]
+        return {"level": level, **rebucket(ts, mn, mx, sm, cnt, max(resolution_ms, width))}
+
+    def flush(self) -> None:
+        self.raw.flush()
+        for log in self.rollups.values():
+            log.flush()
+
+
+def rebucket(ts, mn, mx, sm, cnt, width: int) -> dict:
+    """Merge sorted (min, max, sum, count) rows into `width`-ms buckets."""
+    if not len(ts):
+        empty = np.empty(0)
+        return {"ts": np.empty(0, np.int64), "min": empty, "max": empty, "mean": empty,
+                "count": np.empty(0, np.int64)}
+    buckets = ts - ts % width
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    total = np.add.reduceat(np.asarray(sm, np.float64), starts)
+    count = np.add.reduceat(np.asarray(cnt, np.int64), starts)
+    return {
+        "ts": buckets[starts],
+        "min": np.minimum.reduceat(mn, starts),
+        "max": np.maximum.reduceat(mx, starts),
+        "mean": total / count,
+        "count": count,
+    }
+
+
+# ---------------- store -----------------
+
+
+def _key(part: str) -> str:
+    return quote(part, safe="") or "_"
+
+
+def value_field(payload: dict) -> Optional[str]:
+    """The numeric payload field to record: kmh for speed, else the first number that isn't a timestamp."""
+    if "kmh" in payload:
+        return "kmh"
+    for k, v in payload.items():
+        if k != "timestamp_ms" and isinstance(v, (int, float)) and not isinstance(v, bool):
+            return k
+    return None
+
+
+class TelemetryStore:
+    """Embedded append-only telemetry store, keyed by (vehicle, topic).
+
+    Writers call ``append`` or ``ingest``; any number of readers (in the same
+    or other processes, ``readonly=True``) call ``query``. Rollups at 1s, 1m
+    and 1h are updated on every append, so long ranges never touch raw data.
+    """
+
+    def __init__(self, root: str | os.PathLike, segment_rows: int = DEFAULT_SEGMENT_ROWS, readonly: bool = False):
+        self.root = Path(root)
+        self.segment_rows = segment_rows
+        self.readonly = readonly
+        if not readonly:
+            self.root.mkdir(parents=True, exist_ok=True)
+        self._series: dict[tuple[str, str], Series] = {}
+        self.skipped = 0  # ingested events without a usable timestamp or value
+
+    def series(self, vehicle: str, topic: str) -> Series:
+        key = (vehicle, topic)
+        s = self._series.get(key)
+        if s is None:
+            path = self.root / _key(vehicle) / _key(topic)
+            if self.readonly and not path.is_dir():
+                raise KeyError(key)
+            s = self._series[key] = Series(path, self.segment_rows, self.readonly)
+        return s
+
+    def keys(self) -> list[tuple[str, str]]:
+        if not self.root.is_dir():
+            return []
+        return sorted((unquote(v.name), unquote(t.name))
+                      for v in self.root.iterdir() if v.is_dir()
+                      for t in v.iterdir() if t.is_dir())
+
+    def append(self, vehicle: str, topic: str, ts_ms, values) -> None:
+        self.series(vehicle, topic).append(np.atleast_1d(ts_ms), np.atleast_1d(values))
+
+    def ingest(self, events: Iterable[dict], now_ms: Optional[int] = None) -> int:
+        """Append telemetry events (topic = last segment of the target's resource); returns rows stored."""
+        grouped: dict[tuple[str, str], tuple[list, list]] = {}
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        for evt in events:
+            payload = evt.get("payload") or {}
+            if not isinstance(payload, dict):
+                self.skipped += 1
+                continue
+            field = value_field(payload)
+            try:
+                target = uuri.parse(evt.get("target") or "")
+            except (ValueError, TypeError):
+                continue
+            if field is None:
+                continue
+            try:
+                t, v = int(payload.get("timestamp_ms", now_ms)), float(payload[field])
+                if not INT64_MIN <= t <= INT64_MAX:
+                    raise OverflowError(t)
+            except (TypeError, ValueError, OverflowError):  # garbage payload: skip, don't stop ingest
+                self.skipped += 1
+                continue
+            topic = target.resource.rsplit("/", 1)[-1] or target.ue_id
+            ts, vals = grouped.setdefault((target.authority, topic), ([], []))
+            ts.append(t)
+            vals.append(v)
+        for (vehicle, topic), (ts, vals) in grouped.items():
+            self.series(vehicle, topic).append(np.asarray(ts), np.asarray(vals))
+        return sum(len(t) for t, _ in grouped.values())
+
+    def query(self, vehicle: str, topic: str, start_ms: int, end_ms: int,
+              max_points: int = 1000, resolution_ms: Optional[int] = None) -> dict:
+        """Range query; the resolution defaults to whatever yields about ``max_points`` buckets."""
+        s = self.series(vehicle, topic)
+        if self.readonly:
+            s.refresh()
+        if resolution_ms is None:
+            resolution_ms = max(1, (end_ms - start_ms) // max(1, max_points))
+        return s.query(start_ms, end_ms, resolution_ms)
+
+    def flush(self) -> None:
+        for s in self._series.values():
+            s.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._series.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def to_rows(result: dict) -> list[dict]:
+    """Column arrays -> plain row dicts (for JSON or a dataframe without pandas on the read path)."""
+    cols = ("ts", "min", "max", "mean", "count")
+    return [dict(zip(cols, (int(t), float(a), float(b), float(m), int(c))))
+            for t, a, b, m, c in zip(*(result[c] for c in cols))]
+
+
+# ---------------- ingest service -----------------
+
+
+def main():
+    from common import QosReceiver, udp_subscribe
+
+    root = os.getenv("TSDB_DIR", "logs/tsdb")
+    host = os.getenv("TSDB_IN_HOST", "127.0.0.1")
+    port = int(os.getenv("TSDB_IN_PORT", "50052"))
+    topic = os.getenv("TSDB_TOPIC", "up://*/vehicle.telemetry/*")  # used with DEMO_BROKER
+    flush_s = float(os.getenv("TSDB_FLUSH_S", "5"))
+
+    sock = udp_subscribe(topic, host, port, 1.0)
+    rx = QosReceiver(sock)
+    stored, last_flush = 0, time.monotonic()
+    print(f"[tsdb] storing udp://{host}:{port} telemetry under {root}", flush=True)
+    with TelemetryStore(root) as store:
+        try:
+            while True:
+                try:
+                    stored += store.ingest(rx.recv_batch())
+                except OSError:  # socket.timeout
+                    pass
+                if time.monotonic() - last_flush >= flush_s:
+                    store.flush()
+                    last_flush = time.monotonic()
+                    print(f"[tsdb] {stored} samples stored, {store.skipped} skipped, "
+                          f"{len(store.keys())} series", flush=True)
+        finally:
+            sock.close()
+
+
+if __name__ == "__main__":
+    main()
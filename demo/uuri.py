@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+
+# up://<authority>/<ue_id>[/<resource path>][?v=<major>]
+_URI_RE = re.compile(r"^up://([^/?#]*)/([^/?#]+)(/[^?#]*)?(?:\?v=(\d+))?$")
+
+WILDCARD = "*"
+
+
+# ---------------- value type -----------------
+
+
+class UUri:
+    """Parsed uProtocol URI. Instances come from an InternTable, so equal URIs
+    are usually the same object; hash and string form are computed once."""
+
+    __slots__ = ("authority", "ue_id", "resource", "version", "id", "segments", "_str", "_hash")
+
+    def __init__(self, authority: str, ue_id: str, resource: str = "", version: Optional[int] = None,
+                 uid: int = 0):
+        self.authority = authority
+        self.ue_id = ue_id
+        self.resource = resource
+        self.version = version
+        self.id = uid  # small integer, unique among the URIs currently in the table that created it
+        self._str = format_uuri(authority, ue_id, resource, version)
+        self._hash = hash(self._str)
+        # trie path: authority, ue_id, resource path parts, then the version
+        parts = [authority, ue_id, *(p for p in resource.split("/") if p)]
+        if version is not None:
+            parts.append(f"v{version}")
+        self.segments = tuple(parts)
+
+    def __str__(self) -> str:
+        return self._str
+
+    def __repr__(self) -> str:
+        return f"UUri({self._str!r})"
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if isinstance(other, UUri):
+            return self._hash == other._hash and self._str == other._str
+        if isinstance(other, str):
+            return self._str == other
+        return NotImplemented
+
+    @property
+    def is_pattern(self) -> bool:
+        return WILDCARD in self.segments
+
+
+def format_uuri(authority: str, ue_id: str, resource: str = "", version: Optional[int] = None) -> str:
+    tail = "" if version is None else f"?v={version}"
+    return f"up://{authority}/{ue_id}{resource}{tail}"
+
+
+# ---------------- interning -----------------
+
+
+class InternTable:
+    """Bounded LRU of parsed URIs: one shared UUri per distinct string.
+
+    Thread-safe. Ids of evicted URIs are handed out again, so they stay below
+    maxsize + 1.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._by_str: OrderedDict[str, UUri] = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._free_ids: list[int] = []
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, text: str) -> UUri:
+        with self._lock:
+            u = self._by_str.get(text)
+            if u is not None:
+                self.hits += 1
+                self._by_str.move_to_end(text)
+                return u
+            self.misses += 1
+        m = _URI_RE.match(text) if isinstance(text, str) else None
+        if m is None:
+            raise ValueError(f"not a uProtocol URI: {text!r}")
+        authority, ue_id, resource, version = m.groups()
+        with self._lock:
+            u = self._by_str.get(text)
+            if u is not None:  # another thread interned it meanwhile
+                return u
+            if self._free_ids:
+                uid = self._free_ids.pop()
+            else:
+                uid, self._next_id = self._next_id, self._next_id + 1
+            u = UUri(authority, ue_id, resource or "", int(version) if version else None, uid)
+            self._by_str[text] = u
+            if len(self._by_str) > self.maxsize:
+                self._free_ids.append(self._by_str.popitem(last=False)[1].id)
+        return u
+
+    def __len__(self) -> int:
+        return len(self._by_str)
+
+
+TABLE = InternTable()
+
+
+def parse(text: str) -> UUri:
+    """Parse through the shared intern table."""
+    return TABLE.parse(text)
+
+
+def uuri(authority: str, ue_id: str, resource: str = "", v: Optional[int] = 1) -> UUri:
+    """Build (and intern) a URI from its parts; the table is the cache."""
+    return TABLE.parse(format_uuri(authority, ue_id, resource, v))
+
+
+# ---------------- wildcard matching -----------------
+
+
+class TopicTrie:
+    """Subscriptions keyed by URI segments.
+
+    A "*" segment matches exactly one segment, except as the last segment of
+    a pattern, where it matches everything below that point. So
+    ``up://car-01/vehicle.telemetry/*`` covers every telemetry topic of
+    car-01 and ``up://*/vehicle.telemetry/speed?v=1`` every car's speed.
+    Match results are cached per topic until the trie changes.
+    """
+
+    _VALUES = "\0values"
+    _REST = "\0rest"
+
+    def __init__(self, cache_size: int = 4096):
+        self._root: dict = {}
+        self._cache: dict[str, frozenset] = {}
+        self._cache_size = cache_size
+
+    @staticmethod
+    def _segments(topic) -> tuple:
+        return (topic if isinstance(topic, UUri) else parse(topic)).segments
+
+    def add(self, pattern, value) -> None:
+        node = self._root
+        segs = self._segments(pattern)
+        for i, seg in enumerate(segs):
+            if seg == WILDCARD and i == len(segs) - 1:
+                node.setdefault(self._REST, set()).add(value)
+                break
+            node = node.setdefault(seg, {})
+        else:
+            node.setdefault(self._VALUES, set()).add(value)
+        self._cache.clear()
+
+    def remove(self, pattern, value) -> None:
+        segs = self._segments(pattern)
+        path = [self._root]
+        for i, seg in enumerate(segs):
+            if seg == WILDCARD and i == len(segs) - 1:
+                key = self._REST
+                break
+            nxt = path[-1].get(seg)
+            if nxt is None:
+                return
+            path.append(nxt)
+        else:
+            key = self._VALUES
+        values = path[-1].get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del path[-1][key]
+        # prune empty branches
+        for depth in range(len(path) - 1, 0, -1):
+            if path[depth]:
+                break
+            parent, seg = path[depth - 1], segs[depth - 1]
+            del parent[seg]
+        self._cache.clear()
+
+    def match(self, topic) -> frozenset:
+        key = str(topic)
+        hit = self._cache.get(key)
+        if hit is not None:
+            return hit
+        segs = self._segments(topic)
+        out: set = set()
+        self._walk(self._root, segs, 0, out)
+        result = frozenset(out)
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[key] = result
+        return result
+
+    def _walk(self, node: dict, segs: tuple, i: int, out: set) -> None:
+        rest = node.get(self._REST)
+        if rest and i < len(segs):
+            out |= rest
+        if i == len(segs):
+            out |= node.get(self._VALUES, ())
+            return
+        for key in (segs[i], WILDCARD):
+            child = node.get(key)
+            if child is not None:
+                self._walk(child, segs, i + 1, out)
+
+    def values(self) -> Iterable:
+        """Every stored value (for debugging/stats)."""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for k, v in node.items():
+                if k in (self._VALUES, self._REST):
+                    yield from v
+                else:
+                    stack.append(v)
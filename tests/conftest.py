@@ -0,0 +1,29 @@
+"""
+Shared fixtures for the unit tests.
+"""
+
+import threading
+
+import pytest
+
+import rpc_server
+from audit import AuditWriter
+
+
+@pytest.fixture
+def rpc_audit(monkeypatch, tmp_path):
+    """Route rpc_server's audit log to tmp_path for the duration of a test.
+
+    Serve threads write their audit entry after replying, so they can outlive the
+    test body; teardown joins every "rpc-conn" thread and closes the writer before
+    monkeypatch restores the real path, which keeps logs/ untouched.
+    """
+    path = tmp_path / "audit.jsonl"
+    writer = AuditWriter(path, flush_interval_s=0.01)
+    monkeypatch.setattr(rpc_server, "AUDIT", path)
+    monkeypatch.setattr(rpc_server, "_audit", writer)
+    yield path
+    for t in threading.enumerate():
+        if t.name == "rpc-conn":
+            t.join(5)
+    writer.close()
@@ -0,0 +1,51 @@
+"""
+Unit tests for the vectorized alert engine.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from alert_rules import AlertEngine, RateOfChangeRule, SustainedRule, ThresholdRule
+
+
+def _evt(car, kmh, ts):
+    return {"source": f"up://{car}/vehicle.telemetry/publisher?v=1",
+            "target": f"up://{car}/vehicle.telemetry/speed?v=1",
+            "payload": {"kmh": kmh, "timestamp_ms": ts}}
+
+
+def test_debounce_is_per_vehicle():
+    engine = AlertEngine([ThresholdRule("SPEED_ALERT", 80, debounce_ms=2000)])
+    alerts = engine.evaluate([_evt("car-01", 90, 1000), _evt("car-02", 95, 1100), _evt("car-01", 99, 1200)])
+    assert [(a["vehicle"], a["kmh"]) for a in alerts] == [("car-01", 90.0), ("car-02", 95.0)]
+    assert engine.evaluate([_evt("car-01", 91, 2500)]) == []  # still debounced
+    assert [a["vehicle"] for a in engine.evaluate([_evt("car-01", 91, 3000)])] == ["car-01"]
+
+
+def test_sustained_window_spans_batches_and_resets():
+    engine = AlertEngine([SustainedRule("SUSTAINED", 100, window_ms=3000, debounce_ms=0)])
+    assert engine.evaluate([_evt("car-01", 110, 0), _evt("car-01", 120, 1000)]) == []
+    assert engine.evaluate([_evt("car-01", 90, 2000), _evt("car-01", 110, 2500)]) == []  # run broken
+    assert engine.evaluate([_evt("car-01", 110, 5000)]) == []
+    alerts = engine.evaluate([_evt("car-01", 115, 5500)])
+    assert [a["event_ts_ms"] for a in alerts] == [5500]
+
+
+def test_rate_of_change_uses_previous_sample_of_same_vehicle():
+    engine = AlertEngine([RateOfChangeRule("HARSH", max_per_s=20, debounce_ms=0)])
+    batch = [_evt("car-01", 50, 0), _evt("car-02", 100, 500), _evt("car-01", 60, 1000)]
+    assert engine.evaluate(batch) == []
+    alerts = engine.evaluate([_evt("car-02", 60, 1000)])  # -40 km/h in 0.5 s
+    assert [a["vehicle"] for a in alerts] == ["car-02"]
+
+
+def test_out_of_order_and_garbage_samples_do_not_fire_or_break_the_batch():
+    engine = AlertEngine([RateOfChangeRule("HARSH", max_per_s=20, debounce_ms=0),
+                          ThresholdRule("SPEED_ALERT", 80, debounce_ms=0)])
+    assert engine.evaluate([_evt("car-01", 50, 1000)]) == []
+    # older than the stored sample, and a repeated timestamp: no rate to speak of
+    assert engine.evaluate([_evt("car-01", 70, 900), _evt("car-01", 20, 1000)]) == []
+    batch = [_evt("car-01", "fast", 2000), dict(_evt("car-02", 90, 2000), source=["x"]),
+             _evt("car-03", 95, "late"), _evt("car-04", 99, 2000)]
+    assert [a["vehicle"] for a in engine.evaluate(batch)] == ["car-04"]
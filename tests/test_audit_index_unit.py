@@ -0,0 +1,69 @@
+"""
+Unit tests for the audit log index.
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from audit_index import AuditIndex  # noqa: E402
+
+T0 = 1_700_000_000_000
+
+
+def _append(path, start, n):
+    with open(path, "a") as f:
+        for i in range(start, start + n):
+            method = "lock" if i % 2 else "unlock"
+            f.write(json.dumps({"correlation_id": f"c-{i}", "request": {"method": method},
+                                "response": {"correlation_id": f"c-{i}", "success": True},
+                                "ts_ms": T0 + i}) + "\n")
+
+
+def test_lookup_and_range_across_rotation_and_appends(tmp_path):
+    log = tmp_path / "audit.jsonl"
+    _append(log, 0, 1000)
+    index = AuditIndex(log, block_lines=64)
+    assert index.update() == 1000
+
+    os.replace(log, tmp_path / "audit.jsonl.1700000000999")  # rotation keeps the inode
+    _append(log, 1000, 500)
+    with open(log, "a") as f:
+        f.write('{"correlation_id": "partial"')  # writer mid-line: not indexed yet
+
+    assert [r["ts_ms"] for r in index.lookup("c-10")] == [T0 + 10]
+    assert [r["correlation_id"] for r in index.lookup("c-1200")] == ["c-1200"]
+    assert list(index.lookup("partial")) == []
+    assert index.stats()["records"] == 1500
+    assert not list(tmp_path.glob("audit.jsonl.*idx*"))  # sidecars stay out of the rotation glob
+
+    got = [r["ts_ms"] - T0 for r in index.range(T0 + 990, T0 + 1010, method="lock")]
+    assert got == [i for i in range(990, 1010) if i % 2]
+
+
+def test_index_persists_and_only_reads_new_bytes(tmp_path):
+    log = tmp_path / "audit.jsonl"
+    _append(log, 0, 100)
+    assert AuditIndex(log).update() == 100
+    _append(log, 100, 10)
+    reopened = AuditIndex(log)
+    assert reopened.update() == 10
+    assert [r["correlation_id"] for r in reopened.lookup("c-105", refresh=False)] == ["c-105"]
+
+
+def test_long_lines_and_non_object_lines_do_not_stop_indexing(tmp_path, monkeypatch):
+    import audit_index
+    monkeypatch.setattr(audit_index, "READ_CHUNK", 64)
+    log = tmp_path / "audit.jsonl"
+    _append(log, 0, 2)
+    with open(log, "a") as f:
+        f.write(json.dumps({"correlation_id": "big", "blob": "x" * 500, "ts_ms": T0}) + "\n")
+        f.write("[1, 2]\n")
+    _append(log, 2, 2)
+    index = AuditIndex(log)
+    assert index.update() == 5
+    assert [r["correlation_id"] for r in index.lookup("c-3")] == ["c-3"]
+    assert len(next(index.lookup("big"))["blob"]) == 500
@@ -0,0 +1,53 @@
+"""
+Unit tests for the batched audit writer.
+"""
+
+import json
+
+import pytest
+
+from audit import AuditWriter
+
+
+def test_group_commit_writes_every_entry_in_order(tmp_path):
+    path = tmp_path / "logs" / "audit.jsonl"
+    w = AuditWriter(path, batch_size=16, flush_interval_s=0.01)
+    for i in range(100):
+        assert w.write({"correlation_id": f"c-{i}"})
+    assert w.flush(timeout=5)
+    lines = [json.loads(l) for l in path.read_text().splitlines()]
+    assert [e["correlation_id"] for e in lines] == [f"c-{i}" for i in range(100)]
+    assert all("ts_ms" in e for e in lines)
+    assert w.stats["batches"] < 100
+    w.close()
+
+
+def test_rotates_by_size(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    w = AuditWriter(path, batch_size=1, rotate_bytes=200)
+    for i in range(20):
+        w.write({"correlation_id": f"c-{i}"})
+    w.close()
+    segments = sorted(tmp_path.glob("audit.jsonl*"))
+    assert len(segments) > 1
+    assert w.stats["rotations"] == len(segments) - 1
+    total = sum(len(p.read_text().splitlines()) for p in segments)
+    assert total == 20
+
+
+def test_bad_batches_are_counted_and_a_dead_writer_fails_fast(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    w = AuditWriter(path, batch_size=1, queue_size=1)
+    w.write({"correlation_id": "c-0", "payload": object()})  # not JSON-serializable
+    w.write({"correlation_id": "c-1"})
+    assert w.flush(timeout=5)
+    assert w.stats["failed"] == 1 and w.stats["written"] == 1
+    assert [json.loads(l)["correlation_id"] for l in path.read_text().splitlines()] == ["c-1"]
+
+    w._q.put(None)  # the thread exits as if it had died
+    w._thread.join(5)
+    with pytest.raises(RuntimeError):
+        w.flush()
+    w._q.put({"correlation_id": "fills the queue"})
+    with pytest.raises(RuntimeError):
+        w.write({"correlation_id": "c-2"})
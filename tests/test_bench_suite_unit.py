@@ -0,0 +1,19 @@
+"""
+Unit tests for the benchmark harness' reporting helpers.
+"""
+
+from bench_suite import compare, percentiles
+
+
+def test_percentiles():
+    p = percentiles([float(i) for i in range(1, 1001)])
+    assert (p["p50"], p["p99"], p["p99_9"], p["max"]) == (501.0, 991.0, 1000.0, 1000.0)
+    assert percentiles([])["p50"] is None
+
+
+def test_compare_flags_regressions_in_the_right_direction():
+    old = {"pubsub": {"throughput_msgs_s": 1000, "latency_ms": {"p99": 10.0}}}
+    better = {"pubsub": {"throughput_msgs_s": 1200, "latency_ms": {"p99": 8.0}}}
+    worse = {"pubsub": {"throughput_msgs_s": 800, "latency_ms": {"p99": 10.5}}}
+    assert compare(old, better, 0.1) == []
+    assert compare(old, worse, 0.1) == ["pubsub.throughput_msgs_s"]
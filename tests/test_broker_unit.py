@@ -0,0 +1,125 @@
+"""
+Unit tests for the pub/sub fan-out broker.
+"""
+
+import json
+import socket
+import threading
+
+import broker
+import codec
+from common import QosReceiver, ReliableSender
+
+
+def _sock():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    s.settimeout(2)
+    return s
+
+
+def test_every_matching_subscriber_gets_every_message():
+    bsock = _sock()
+    b = broker.Broker(bsock, queue_max=100)
+    threading.Thread(target=b.receive_loop, daemon=True).start()
+    threading.Thread(target=b.send_loop, daemon=True).start()
+    baddr = bsock.getsockname()
+
+    speed = "up://car-01/vehicle.telemetry/speed?v=1"
+    exact, wildcard, other, pub = _sock(), _sock(), _sock(), _sock()
+    try:
+        for s, topic in ((exact, speed), (wildcard, "up://car-01/vehicle.telemetry/*"),
+                         (other, "up://car-01/body.control/*")):
+            s.sendto(json.dumps({"type": "SUBSCRIBE", "topic": topic}).encode(), baddr)
+        for s in (exact, wildcard, other):
+            s.sendto(b'{"type": "BROKER_STATS"}', baddr)
+            s.recvfrom(65535)  # stats reply => our SUBSCRIBE was processed first
+
+        for i in range(3):
+            msg = {"type": "EVENT", "target": speed, "payload": {"kmh": i}}
+            c = codec.BINARY if i % 2 else codec.JSON
+            pub.sendto(c.encode(msg), baddr)
+
+        for s in (exact, wildcard):
+            got = []
+            while len(got) < 3:
+                got.extend(codec.decode(p) for p in broker.split_batch(memoryview(s.recvfrom(65535)[0])))
+            assert [m["payload"]["kmh"] for m in got] == [0, 1, 2]
+        other.settimeout(0.2)
+        try:
+            other.recvfrom(65535)
+            assert False, "non-matching subscriber received a message"
+        except socket.timeout:
+            pass
+    finally:
+        for s in (exact, wildcard, other, pub, bsock):
+            s.close()
+
+
+def test_full_queue_drops_and_counts():
+    sub = broker.Subscriber(("127.0.0.1", 9), None, queue_max=2)
+    assert sub.offer(b"a") and sub.offer(b"b")
+    assert not sub.offer(b"c")
+    assert sub.dropped == 1
+
+
+def test_malformed_datagrams_are_counted_and_do_not_stop_routing():
+    bsock = _sock()
+    b = broker.Broker(bsock, queue_max=100)
+    threading.Thread(target=b.receive_loop, daemon=True).start()
+    baddr = bsock.getsockname()
+    s = _sock()
+    try:
+        bad = [b"[1,2]", b'"s"', b"\xb1\x01\x09",
+               b'{"type":"SUBSCRIBE","topic":"up://car-01/a/b?v=1","lease_s":"abc"}',
+               b'{"type":"SUBSCRIBE","topic":["a"]}']
+        for raw in bad:
+            s.sendto(raw, baddr)
+        s.sendto(b'{"type": "BROKER_STATS"}', baddr)
+        stats = json.loads(s.recvfrom(65535)[0])
+        assert stats["bad"] == len(bad) and stats["subscribers"] == []
+    finally:
+        s.close()
+        bsock.close()
+
+
+def test_qos1_acks_are_relayed_back_to_the_publisher():
+    bsock = _sock()
+    b = broker.Broker(bsock, queue_max=100)
+    threading.Thread(target=b.receive_loop, daemon=True).start()
+    threading.Thread(target=b.send_loop, daemon=True).start()
+    baddr = bsock.getsockname()
+    speed = "up://car-01/vehicle.telemetry/speed?v=1"
+    subs, pub = [_sock(), _sock()], socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for s in subs:
+        s.sendto(json.dumps({"type": "SUBSCRIBE", "topic": speed}).encode(), baddr)
+        s.sendto(b'{"type": "BROKER_STATS"}', baddr)
+        s.recvfrom(65535)
+    receivers = [QosReceiver(s) for s in subs]
+    got = [[], []]
+
+    def drain(i):
+        while len(got[i]) < 10:
+            try:
+                got[i].extend(receivers[i].recv_batch())
+            except (socket.timeout, OSError):
+                return
+
+    threads = [threading.Thread(target=drain, args=(i,), daemon=True) for i in range(2)]
+    for t in threads:
+        t.start()
+    sender = ReliableSender(pub, baddr, rto_s=0.5, max_retries=2)
+    try:
+        for i in range(10):
+            c = codec.CT_BINARY if i % 2 else codec.CT_JSON
+            assert sender.send({"type": "EVENT", "qos": 1, "target": speed, "content_type": c, "payload": {"i": i}})
+        assert sender.flush(timeout=3)
+        for t in threads:
+            t.join(3)
+    finally:
+        sender.close()
+        for s in subs + [pub, bsock]:
+            s.close()
+    assert sender.stats["acked"] == 10 and sender.stats["failed"] == 0
+    assert [sorted(m["payload"]["i"] for m in g) for g in got] == [list(range(10))] * 2
+    assert b.stats["acks"] == 10 and not b.ack_routes  # the second subscriber's ACKs are absorbed
@@ -0,0 +1,54 @@
+"""
+Unit tests for batched UDP send/receive.
+"""
+
+import socket
+
+import codec
+from bulk_io import BatchSender, BulkReceiver
+
+
+def _pair():
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(("127.0.0.1", 0))
+    rx.settimeout(2)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return rx, tx
+
+
+def test_coalesced_batches_are_split_back_into_messages():
+    rx, tx = _pair()
+    try:
+        with BatchSender(tx, rx.getsockname(), max_bytes=512, linger_ms=1000) as sender:
+            for i in range(50):
+                sender.send({"type": "EVENT", "payload": {"kmh": i}})
+        assert sender.stats["datagrams"] < 50
+
+        receiver = BulkReceiver(rx, slots=8)
+        got = []
+        while len(got) < 50:
+            got.extend(receiver.recv_batch())
+        assert [m["payload"]["kmh"] for m in got] == list(range(50))
+        assert receiver.stats["wakeups"] < sender.stats["datagrams"] + 1
+    finally:
+        rx.close()
+        tx.close()
+
+
+def test_bare_datagrams_of_either_codec_are_accepted():
+    rx, tx = _pair()
+    try:
+        tx.sendto(b'{"n": 1}', rx.getsockname())
+        tx.sendto(codec.BINARY.encode({"type": "EVENT", "payload": {"n": 2}}), rx.getsockname())
+        tx.sendto(b"garbage", rx.getsockname())
+        tx.sendto(bytes([0xBA, 0, 3, 0, 40]) + b"cut short", rx.getsockname())  # truncated batch
+        receiver = BulkReceiver(rx, slots=4)
+        got = []
+        while len(got) < 2:
+            got.extend(receiver.recv_batch())
+        assert got[0] == {"n": 1} and got[1]["payload"] == {"n": 2}
+        while receiver.stats["errors"] < 2:
+            assert receiver.recv_batch() == []
+    finally:
+        rx.close()
+        tx.close()
@@ -0,0 +1,142 @@
+"""
+Unit tests for the traffic capture recorder and replayer.
+"""
+
+import socket
+import threading
+import time
+
+import capture
+import codec
+import rpc_client
+import rpc_server
+from capture import KIND_RPC_REQUEST, KIND_RPC_RESPONSE, KIND_UDP, Capture, Recorder, RpcTap
+
+
+def _event(i):
+    return {"type": "EVENT", "id": f"id-{i}", "source": "up://car-01/vehicle.telemetry/publisher?v=1",
+            "content_type": codec.CT_BINARY, "payload": {"kmh": i}}
+
+
+def test_records_round_trip_seek_by_time_and_survive_a_torn_tail(tmp_path):
+    path = tmp_path / "run.cap"
+    with Recorder(path, index_every=10) as rec:
+        for i in range(100):
+            rec.write(KIND_UDP, 50052, codec.encode(_event(i)), ts_us=1_000_000 + i * 1000)
+    with Capture(path) as cap:
+        got = [(r.ts_us, codec.decode(r.data)["payload"]["kmh"]) for r in cap]
+        assert got == [(1_000_000 + i * 1000, i) for i in range(100)]
+        assert len(cap.index) == 10
+        window = [r.ts_us for r in cap.records(since_us=1_042_000, until_us=1_045_000)]
+        assert window == [1_042_000, 1_043_000, 1_044_000]
+        assert cap.info()["records"] == 100 and cap.info()["duration_s"] == 0.099
+
+    with open(path, "ab") as f:  # a record cut short by a crash
+        f.write(capture.REC_HDR.pack(2_000_000, 50, KIND_UDP, 0, 50052) + b"partial")
+    with Capture(path) as cap:
+        assert sum(1 for _ in cap) == 100
+    with Recorder(path, index_every=10) as rec:  # appending cuts the torn record off first
+        rec.write(KIND_UDP, 50052, b"after", ts_us=3_000_000)
+    with Capture(path) as cap:
+        records = list(cap)
+        assert len(records) == 101 and bytes(records[-1].data) == b"after"
+        del records
+
+
+def test_replay_keeps_recorded_spacing_scaled_by_speed(tmp_path):
+    path = tmp_path / "run.cap"
+    with Recorder(path) as rec:
+        for i in range(5):
+            rec.write(KIND_UDP, 1, b"tick-%d" % i, ts_us=i * 100_000)  # 0.4 s of traffic
+        rec.write(KIND_RPC_RESPONSE, 6000, b"{}", ts_us=400_000)
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sink.settimeout(2)
+    port = sink.getsockname()[1]
+    try:
+        with Capture(path) as cap:
+            fast = capture.replay(cap, speed=0, udp_port=port)
+            paced = capture.replay(cap, speed=4, udp_port=port)  # 0.1 s
+        got = [sink.recv(100) for _ in range(10)]
+    finally:
+        sink.close()
+    assert got == [b"tick-%d" % i for i in range(5)] * 2
+    assert fast["udp"] == 5 and fast["skipped"] == 1 and fast["elapsed_s"] < 0.05
+    assert 0.09 <= paced["elapsed_s"] < 0.3
+
+
+def test_rpc_tap_records_both_directions_and_replay_reissues_requests(rpc_audit, tmp_path):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, addr = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=rpc_server.serve_conn, args=(conn, addr), name="rpc-conn",
+                             daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    upstream = srv.getsockname()
+    path = tmp_path / "rpc.cap"
+    recorder = Recorder(path)
+    listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen.bind(("127.0.0.1", 0))
+    listen.listen(8)
+    tap = RpcTap(recorder, listen, upstream)
+    threading.Thread(target=tap.serve, daemon=True).start()
+    try:
+        with rpc_client.RpcClient(*listen.getsockname()) as client:
+            assert client.call("lock", target="up://car-01/body.access/door")["success"]
+            assert client.call("nope")["status"]["code"] == "ERR"
+        deadline = time.monotonic() + 2
+        while recorder.records < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        recorder.close()
+        with Capture(path) as cap:
+            kinds = [r.kind for r in cap]
+            assert sorted(kinds) == [KIND_RPC_REQUEST] * 2 + [KIND_RPC_RESPONSE] * 2
+            stats = capture.replay(cap, speed=0, rpc_addr=upstream)
+        assert stats["rpc"] == 2 and stats["rpc_responses"] == {"OK": 1, "ERR": 1}
+    finally:
+        tap.close()
+        srv.close()
+
+
+def test_replay_survives_corrupt_responses_and_tap_close_stops_pumps(tmp_path):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+
+    def corrupt_then_ok():
+        conn, _ = srv.accept()
+        with conn:
+            for i, _frame in enumerate(capture.FrameReader(conn)):
+                capture.send_frame(conn, b"\xb1\x01\x09" + bytes(40) if i == 0 else b'{"status":{"code":"OK"}}')
+
+    threading.Thread(target=corrupt_then_ok, daemon=True).start()
+    rpc = capture._RpcReplay(srv.getsockname())
+    rpc.send(b'{"method":"lock"}')
+    rpc.send(b'{"method":"lock"}')
+    started = time.monotonic()
+    rpc.close(5)
+    assert rpc.codes == {"undecodable": 1, "OK": 1} and time.monotonic() - started < 2
+
+    recorder = Recorder(tmp_path / "tap.cap")
+    listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen.bind(("127.0.0.1", 0))
+    listen.listen(8)
+    tap = RpcTap(recorder, listen, srv.getsockname())
+    threading.Thread(target=tap.serve, daemon=True).start()
+    client = socket.create_connection(listen.getsockname())
+    deadline = time.monotonic() + 2
+    while not tap._pumps and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tap.close()
+    assert not any(t.is_alive() for t in tap._pumps)
+    recorder.close()
+    client.close()
+    srv.close()
@@ -0,0 +1,64 @@
+"""
+Unit tests for the JSON / compact binary envelope codecs.
+"""
+
+import pytest
+
+import codec
+from simulate_messages import uevent, urequest, uresponse, uuri_str
+
+
+def _roundtrip(msg):
+    wire = codec.BINARY.encode(msg)
+    out = codec.decode(wire)
+    assert out.pop("content_type") == codec.CT_BINARY
+    expected = dict(msg)
+    expected.pop("content_type", None)
+    expected.setdefault("qos", 0)
+    assert out == expected
+    return wire
+
+
+def test_binary_roundtrips_demo_envelopes():
+    evt = uevent(uuri_str("car-01", "vehicle.telemetry", "/speed"), {"kmh": 72, "timestamp_ms": 1})
+    req = urequest(uuri_str("car-01", "body.control", "/doors/lock"), {"lock": True})
+    resp = uresponse(req["id"], req["source"], {"code": "OK", "message": "Doors locked"}, {"success": True})
+    for msg in (evt, req, resp):
+        wire = _roundtrip(msg)
+        assert len(wire) < len(codec.JSON.encode(msg)) / 2
+
+
+def test_binary_handles_unknown_topics_and_loose_fields():
+    msg = {"method": "lock", "correlation_id": "not-a-uuid", "target": "up://car-99/x/y?v=2"}
+    _roundtrip(msg)
+
+
+def test_non_canonical_uuid_strings_come_back_unchanged():
+    upper = "AAAAAAAA-2222-4333-8444-555555555555"
+    _roundtrip({"type": "RESPONSE", "correlation_id": upper, "id": upper.lower()})
+    _roundtrip({"correlation_id": "aaaaaaaa-2222-4333-8444-55555555555 "})
+
+
+def test_decode_raises_value_error_for_malformed_input():
+    wire = codec.BINARY.encode(uevent("up://car-01/vehicle.telemetry/speed?v=1", {"kmh": 1}))
+    corrupt = [wire[:10], wire[:2] + b"\x09" + wire[3:], b"[1,2]", b'"s"',
+               wire[:-1] + b"\xff", codec.HEADER.pack(codec.MAGIC, codec.VERSION, 1, 0, 0, 0,
+                                                       bytes(16), 0, 999)]
+    for data in corrupt:
+        with pytest.raises(ValueError):
+            codec.decode(data)
+
+
+def test_decode_sniffs_json():
+    assert codec.decode(b'{"type":"EVENT"}') == {"type": "EVENT"}
+    assert codec.encode({"content_type": "text/plain", "a": 1}).startswith(b"{")
+
+
+def test_deadline_is_read_from_the_binary_header():
+    evt = uevent("up://car-77/vehicle.telemetry/speed?v=1", {"kmh": 1})
+    evt["ts_ms"] = 1_700_000_000_000
+    wire = _roundtrip(evt)
+    assert codec.peek_deadline(wire) == 1_700_000_000_000 + evt["ttl_ms"]
+    assert codec.peek_deadline(codec.JSON.encode(evt)) is None
+    del evt["ts_ms"]
+    assert codec.peek_deadline(codec.BINARY.encode(evt)) is None
@@ -0,0 +1,53 @@
+"""
+Unit tests for the shared length-prefixed framing.
+"""
+
+import socket
+import struct
+
+import pytest
+
+from common import FrameDecoder, FrameReader, FrameTooLarge, recv_msg, send_frame, send_msg
+
+
+def _frame(body: bytes) -> bytes:
+    return struct.pack("!I", len(body)) + body
+
+
+def test_decoder_handles_split_and_coalesced_frames():
+    bodies = [b"a" * 10, b"", b"b" * 100_000, b"c"]  # the big one forces the buffer to grow
+    stream = b"".join(_frame(b) for b in bodies)
+    dec = FrameDecoder(initial_size=16)
+    got = []
+    for i in range(0, len(stream), 7777):  # arbitrary fragment boundaries
+        chunk = stream[i:i + 7777]
+        dec.feed(chunk)
+        got.extend(bytes(v) for v in dec.frames())
+    assert got == bodies
+    assert dec.buffered == 0
+
+
+def test_oversized_frame_is_rejected():
+    dec = FrameDecoder(max_frame=1024)
+    dec.feed(struct.pack("!I", 4096))
+    with pytest.raises(FrameTooLarge):
+        dec.frames()
+
+
+def test_reader_and_vectored_writer_over_a_socket():
+    a, b = socket.socketpair()
+    try:
+        big = b"x" * (1 << 20)  # larger than the socket buffer: exercises the short-write path
+        import threading
+        t = threading.Thread(target=lambda: [send_frame(a, big), send_msg(a, {"k": 1}), send_frame(a, b"tail")])
+        t.start()
+        reader = FrameReader(b)
+        assert bytes(reader.read()) == big
+        assert bytes(reader.read()) == b'{"k":1}'
+        assert bytes(reader.read()) == b"tail"
+        t.join()
+        send_msg(a, {"one": "frame"})
+        assert recv_msg(b) == {"one": "frame"}
+    finally:
+        a.close()
+        b.close()
@@ -0,0 +1,130 @@
+"""
+Unit tests for the RPC response cache and single-flight coalescing.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import rpc_server
+from idempotency import Idempotency, ResponseCache, SingleFlight, flight_key
+
+
+def test_response_cache_expires_and_evicts_lru(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ResponseCache(ttl_s=10, max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}  # a is now most recent
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None and cache.get("a") == {"v": 1}
+    now[0] += 10
+    assert cache.get("a") is None and len(cache) == 1
+
+
+def test_single_flight_shares_one_call_and_its_error():
+    sf, calls, gate = SingleFlight(), [], threading.Event()
+
+    def slow():
+        calls.append(1)
+        gate.wait(2)
+        return {"ok": True}
+
+    with ThreadPoolExecutor(8) as pool:
+        futs = [pool.submit(sf.do, "k", slow) for _ in range(8)]
+        time.sleep(0.1)
+        gate.set()
+        results = [f.result(2) for f in futs]
+    assert len(calls) == 1
+    assert sum(1 for _, shared in results if not shared) == 1
+
+    def boom():
+        raise RuntimeError("actuator jammed")
+    with pytest.raises(RuntimeError):
+        sf.do("k", boom)
+
+
+def test_flight_key_ignores_retry_bookkeeping():
+    a = {"method": "lock", "target": "up://car-01/body.access/door", "correlation_id": "1", "ts_ms": 1}
+    b = dict(a, correlation_id="2", ts_ms=2)
+    assert flight_key(a) == flight_key(b)
+    assert flight_key(a) != flight_key(dict(a, target="up://car-02/body.access/door"))
+
+
+def _counting_lock(monkeypatch, blocking=True):
+    calls = []
+
+    def handler(req):
+        calls.append(req.get("correlation_id"))
+        time.sleep(0.05)
+        return {"status": {"code": "OK"}, "success": True}
+
+    async def ahandler(req):
+        calls.append(req.get("correlation_id"))
+        await asyncio.sleep(0.05)
+        return {"status": {"code": "OK"}, "success": True}
+
+    reg = rpc_server.MethodRegistry()
+    reg.register("lock", handler if blocking else ahandler, blocking=blocking, idempotent=True)
+    monkeypatch.setattr(rpc_server, "registry", reg)
+    monkeypatch.setattr(rpc_server, "idempotency", Idempotency(ttl_s=30))
+    return calls
+
+
+def test_threaded_retries_hit_cache_and_concurrent_duplicates_coalesce(monkeypatch):
+    calls = _counting_lock(monkeypatch)
+    reqs = [{"method": "lock", "target": "up://car-01/body.access/door", "correlation_id": f"c-{i}"}
+            for i in range(6)]
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(rpc_server.handle_request, reqs))
+    assert len(calls) == 1
+    assert [r["correlation_id"] for r in results] == [f"c-{i}" for i in range(6)]
+
+    retry = rpc_server.handle_request(dict(reqs[3]))
+    assert retry["success"] and retry["correlation_id"] == "c-3" and len(calls) == 1
+    assert rpc_server.idempotency.stats == {"executed": 1, "cache_hits": 1, "coalesced": 5}
+
+
+def test_async_duplicates_coalesce(monkeypatch):
+    calls = _counting_lock(monkeypatch, blocking=False)
+
+    async def run():
+        with ThreadPoolExecutor(4) as executor:
+            reqs = [{"method": "lock", "target": "up://car-01/body.access/door", "correlation_id": f"c-{i}"}
+                    for i in range(5)]
+            other = {"method": "lock", "target": "up://car-02/body.access/door", "correlation_id": "x"}
+            results = await asyncio.gather(*(rpc_server.handle_request_async(r, executor)
+                                             for r in reqs + [other]))
+            retry = await rpc_server.handle_request_async(dict(reqs[0]), executor)
+            return results, retry
+
+    results, retry = asyncio.run(run())
+    assert sorted(calls) == ["c-0", "x"]
+    assert all(r["success"] for r in results) and retry["correlation_id"] == "c-0"
+    assert [r["correlation_id"] for r in results] == ["c-0", "c-1", "c-2", "c-3", "c-4", "x"]
+
+
+def test_async_waiters_get_an_error_when_the_leader_is_cancelled():
+    from idempotency import AsyncSingleFlight
+
+    async def main():
+        flights, started = AsyncSingleFlight(), asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        leader = asyncio.create_task(flights.do("k", slow))
+        await started.wait()
+        follower = asyncio.create_task(flights.do("k", slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(RuntimeError):
+            await follower  # an Exception, so the RPC layer answers handler_failed
+        assert leader.cancelled()
+
+    asyncio.run(main())
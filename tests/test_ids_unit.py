@@ -0,0 +1,45 @@
+"""
+Unit tests for the time-ordered UUIDv8 message ids.
+"""
+
+import time
+import uuid
+
+import codec
+import ids
+from ids import IdFactory
+
+
+def test_ids_are_uuidv8_and_strictly_increasing_past_the_counter(monkeypatch):
+    frozen = 1_700_000_000_000 * 1_000_000
+    monkeypatch.setattr(time, "time_ns", lambda: frozen)
+    factory = IdFactory(node=0x1234)
+    block = factory.block(5000)  # more than the 4096 a millisecond holds
+    block.append(factory.next())
+    assert block == sorted(block) and len(set(block)) == len(block)
+    first = uuid.UUID(bytes=block[0])
+    assert first.version == 8 and first.variant == uuid.RFC_4122
+    assert block[0].time_ms == 1_700_000_000_000
+    assert block[-1].time_ms == 1_700_000_000_001  # ran ahead of the frozen clock instead of repeating
+    assert block[0][8:] == block[-1][8:] and int.from_bytes(block[0][8:], "big") & ids.NODE_MASK == 0x1234
+
+    monkeypatch.setattr(time, "time_ns", lambda: frozen - 10_000_000)  # clock steps back 10 ms
+    assert factory.next() > block[-1]
+
+
+def test_binary_ids_stand_in_for_their_string_form():
+    mid = ids.new_id()
+    text = str(mid)
+    assert mid == text and text == mid and {mid: 1}[text] == 1
+    assert mid != bytes(mid) and mid != ids.new_id()
+    assert codec.decode(codec.JSON.encode({"id": mid}))["id"] == text
+    wire = codec.BINARY.encode({"type": "EVENT", "id": mid})
+    assert bytes(mid) in wire and codec.decode(wire)["id"] == text
+
+
+def test_uprotocol_lookup_happens_once():
+    ids.uprotocol_factory.cache_clear()
+    import test_uprotocol
+    a, b = test_uprotocol.get_uuid(), test_uprotocol.get_uuid()
+    assert a != b
+    assert ids.uprotocol_factory.cache_info().misses == 1
@@ -0,0 +1,64 @@
+"""
+Unit tests for the metrics registry, histogram and sampled logging.
+"""
+
+import json
+import urllib.request
+
+import metrics
+
+
+def test_histogram_percentiles_are_within_bucket_precision():
+    h = metrics.Histogram(bits=5)
+    for v in range(1, 100_001):
+        h.record(v)
+    s = h.summary()
+    assert s["count"] == 100_000 and s["min"] == 1 and s["max"] == 100_000
+    for q, exact in ((50, 50_000), (99, 99_000), (99.9, 99_900)):
+        assert abs(h.percentile(q) - exact) / exact < 1 / 32
+    assert h.percentile(0.0001) == 1
+
+
+def test_snapshot_file_and_http_endpoint(tmp_path):
+    reg = metrics.Registry()
+    reg.counter("x.events").inc(3)
+    reg.histogram("x.lat_us").record(250)
+    reg.gauge("x.depth", lambda: 7)
+    path = tmp_path / "m.json"
+    metrics.write_snapshot(path, reg, service="x")
+    snap = json.loads(path.read_text())
+    assert snap["counters"] == {"x.events": 3} and snap["gauges"] == {"x.depth": 7}
+    assert snap["histograms_us"]["x.lat_us"]["p50"] == 250
+
+    srv = metrics.serve_stats(0, reg, service="x")
+    try:
+        port = srv.server_address[1]
+        body = json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2).read())
+        assert body["service"] == "x" and body["counters"]["x.events"] == 3
+    finally:
+        srv.shutdown()
+
+
+def test_sampled_log_suppresses_and_reports(capsys):
+    log = metrics.Log("t", level="info", sample_s=60)
+    for i in range(5):
+        log.sampled("k", "msg %s", metrics.lazy(str, i))
+    log.debug("hidden")
+    log.sample_s = 0
+    log.sampled("k", "again")
+    assert capsys.readouterr().out.splitlines() == ["[t] msg 0", "[t] again (+4 more)"]
+
+
+def test_registry_export_merges_across_processes():
+    a, b, total = metrics.Registry(), metrics.Registry(), metrics.Registry()
+    for reg, values in ((a, range(1, 501)), (b, range(501, 1001))):
+        reg.counter("x.events").inc(len(values))
+        for v in values:
+            reg.histogram("x.lat_us").record(v)
+    for reg in (a, b):
+        total.merge(reg.export())
+    s = total.snapshot()
+    assert s["counters"] == {"x.events": 1000}
+    h = s["histograms_us"]["x.lat_us"]
+    assert h["count"] == 1000 and h["min"] == 1 and h["max"] == 1000
+    assert abs(h["p50"] - 500) / 500 < 1 / 32
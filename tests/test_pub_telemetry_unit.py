@@ -0,0 +1,46 @@
+"""
+Unit tests for the publisher's load-generator mode.
+"""
+
+import socket
+
+import codec
+import pub_telemetry as pub
+from bulk_io import BulkReceiver
+
+
+def test_templates_patch_id_value_and_timestamp():
+    for ct in (codec.CT_JSON, codec.CT_BINARY):
+        tpl = pub.EnvelopeTemplate("car-0042", "rpm", ct)
+        ids = pub.IdSequence(ct == codec.CT_BINARY)
+        a = codec.decode(tpl.render(ids.next(), 3100, b"1700000000123"))
+        b = codec.decode(tpl.render(ids.next(), 7, b"1700000000456"))
+        assert a["target"] == "up://car-0042/vehicle.telemetry/rpm?v=1"
+        assert a["payload"] == {"value": 3100, "timestamp_ms": 1700000000123}
+        assert b["payload"]["value"] == 7
+        assert a["id"] != b["id"]
+
+
+def test_loadgen_worker_sends_exact_count_across_vehicles():
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(("127.0.0.1", 0))
+    rx.settimeout(2)
+    try:
+        sent = pub.loadgen_worker(rx.getsockname(), 50000, ["car-a", "car-b"], 2,
+                                  codec.CT_JSON, duration_s=5, count=200, burst="")
+        assert sent == 200
+        receiver = BulkReceiver(rx, slots=16)
+        got = []
+        while len(got) < 200:
+            got.extend(receiver.recv_batch())
+        targets = {m["target"] for m in got}
+        assert len(targets) == 4
+    finally:
+        rx.close()
+
+
+def test_burst_profile_square_wave():
+    p = pub.BurstProfile("4:1:5")
+    assert p.factor(0.5) == 1.0
+    assert p.factor(4.5) == 5.0
+    assert p.factor(5.5) == 1.0
@@ -9,13 +9,15 @@ import os
 import signal
 import subprocess
 import sys
-import time
+
+from service_host import start_service
 
 
 def _start_subscriber():
     # Start demo/sub_telemetry.py in its own process group so we can cleanly kill it.
-    # stdout/stderr to DEVNULL to avoid pipe blocking.
-    return subprocess.Popen(
+    # stdout/stderr to DEVNULL to avoid pipe blocking. Returns once its UDP socket
+    # is bound (the subscriber reports ready), so no sleep is needed.
+    return start_service(
         [sys.executable, "demo/sub_telemetry.py"],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
@@ -38,15 +40,13 @@ def _kill_process_group(proc: subprocess.Popen):
 def test_pubsub_runs():
     sub = _start_subscriber()
     try:
-        # Give the subscriber time to bind its UDP socket.
-        time.sleep(1.0)
-
         # Run publisher with a strict timeout so CI can’t hang.
         pub = subprocess.run(
             [sys.executable, "demo/pub_telemetry.py"],
             capture_output=True,
             text=True,
             timeout=10,
+            env={**os.environ, "PUB_COUNT": "1"},  # one event, then exit
         )
 
         # Publisher should exit cleanly.
@@ -0,0 +1,138 @@
+"""
+Unit tests for QoS 1 delivery, dedup and TTL shedding.
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+import codec
+import metrics
+from common import DedupWindow, QosReceiver, ReliableSender, epoch_ms, is_expired
+
+
+def _udp(timeout=2.0):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    s.settimeout(timeout)
+    return s
+
+
+def _lossy_proxy(front, back_addr, drop_every):
+    """Forward datagrams front -> back_addr, dropping every Nth; relay replies to the last client."""
+    back = _udp(0.05)
+    stop = threading.Event()
+    client = [None]
+
+    def run():
+        n = 0
+        front.settimeout(0.05)
+        while not stop.is_set():
+            try:
+                data, addr = front.recvfrom(65535)
+                client[0] = addr
+                n += 1
+                if n % drop_every:
+                    back.sendto(data, back_addr)
+            except socket.timeout:
+                pass
+            try:
+                data, _ = back.recvfrom(65535)
+                front.sendto(data, client[0])
+            except socket.timeout:
+                pass
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return stop
+
+
+def test_qos1_survives_loss_and_is_delivered_once():
+    rx_sock, front = _udp(0.2), _udp()
+    stop = _lossy_proxy(front, rx_sock.getsockname(), drop_every=3)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = ReliableSender(tx, front.getsockname(), window=8, rto_s=0.05)
+    receiver = QosReceiver(rx_sock)
+    got = []
+
+    def drain():
+        deadline = time.monotonic() + 5
+        while len(got) < 30 and time.monotonic() < deadline:
+            try:
+                got.extend(receiver.recv_batch())
+            except socket.timeout:
+                pass
+
+    t = threading.Thread(target=drain, daemon=True)
+    t.start()
+    try:
+        for i in range(30):
+            assert sender.send({"type": "EVENT", "qos": 1, "ttl_ms": 10_000, "payload": {"i": i}}, timeout=5)
+        assert sender.flush(timeout=5)
+        t.join(5)
+    finally:
+        stop.set()
+        sender.close()
+    assert sorted(m["payload"]["i"] for m in got) == list(range(30))
+    assert sender.stats["acked"] == 30 and sender.stats["retransmits"] > 0
+
+
+def test_expired_messages_are_shed_and_duplicates_dropped():
+    rx_sock, tx = _udp(), socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = rx_sock.getsockname()
+    old = {"type": "EVENT", "id": "11111111-2222-4333-8444-555555555555", "qos": 0,
+           "ttl_ms": 100, "ts_ms": epoch_ms() - 1000, "content_type": codec.CT_BINARY}
+    fresh = dict(old, id="aaaaaaaa-2222-4333-8444-555555555555", qos=1, ts_ms=epoch_ms())
+    for msg in (old, dict(old, content_type=codec.CT_JSON), fresh, fresh):
+        tx.sendto(codec.encode(msg), addr)
+    time.sleep(0.05)
+    receiver = QosReceiver(rx_sock)
+    out = receiver.recv_batch()
+    assert [m["id"] for m in out] == [fresh["id"]]
+    assert receiver.stats["expired"] == 2 and receiver.stats["duplicates"] == 1
+    ack = codec.decode(tx.recv(65535))  # both copies acked, in one datagram
+    assert ack == {"type": "ACK", "ids": [fresh["id"], fresh["id"]]}
+
+
+def test_dedup_window_and_expiry_helpers():
+    d = DedupWindow(window_s=60, max_ids=2)
+    assert not d.seen("a") and d.seen("a")
+    d.seen("b"), d.seen("c")
+    assert len(d) == 2 and not d.seen("a")  # evicted by the size cap
+    assert is_expired({"ttl_ms": 10, "ts_ms": 0}, now_ms=11)
+    assert not is_expired({"ttl_ms": 0, "ts_ms": 0}, now_ms=11)
+    assert not is_expired({"ttl_ms": 10}, now_ms=11)
+
+
+def test_malformed_envelopes_are_counted_not_raised():
+    rx_sock, tx = _udp(), socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = rx_sock.getsockname()
+    for raw in (b"[1]", b'{"qos":"1","id":"a"}', b'{"ts_ms":"x","ttl_ms":5}', b'{"qos":1,"id":["x"]}'):
+        tx.sendto(raw, addr)
+    tx.sendto(codec.encode({"type": "EVENT", "payload": {"kmh": 1}}), addr)
+    time.sleep(0.05)
+    receiver = QosReceiver(rx_sock)
+    out = receiver.recv_batch()
+    assert [m["payload"] for m in out] == [{"kmh": 1}] and receiver.stats["errors"] == 4
+    assert metrics.since_ms_us("x") is None
+    rx_sock.close(); tx.close()
+
+
+def test_bad_ttl_is_rejected_by_send_and_cannot_stall_the_window():
+    sink, tx = _udp(), socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = ReliableSender(tx, sink.getsockname(), window=1, rto_s=0.02, max_retries=1)
+    try:
+        with pytest.raises(ValueError):
+            sender.send({"type": "EVENT", "qos": 1, "ttl_ms": 2000.0})
+        assert sender.in_flight() == 0
+        msg = {"type": "EVENT", "qos": 1, "ttl_ms": 2000}
+        assert sender.send(msg)
+        msg["ttl_ms"] = 2000.0  # mutated after send: the retransmit thread must give it up, not die
+        assert sender.flush(timeout=2) and sender.stats["failed"] == 1
+        assert sender.send({"type": "EVENT", "qos": 1}, timeout=1)
+        assert sender._thread.is_alive()
+    finally:
+        sender.close()
+        sink.close(); tx.close()
@@ -0,0 +1,171 @@
+"""
+Unit tests for the persistent, pipelined RPC client/server.
+"""
+
+import socket
+import threading
+
+import pytest
+
+import rpc_client
+import rpc_server
+
+
+def _start_server():
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, addr = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=rpc_server.serve_conn, args=(conn, addr), name="rpc-conn",
+                             daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return srv
+
+
+def test_pipelined_calls_share_one_connection(rpc_audit):
+    srv = _start_server()
+    port = srv.getsockname()[1]
+    try:
+        with rpc_client.RpcClient("127.0.0.1", port) as client:
+            futures = [client.submit("lock", correlation_id=f"c-{i}") for i in range(10)]
+            results = [f.result(timeout=5) for f in futures]
+        assert [r["correlation_id"] for r in results] == [f"c-{i}" for i in range(10)]
+        assert all(r["success"] for r in results)
+    finally:
+        srv.close()
+
+
+def test_pool_reports_unknown_method(rpc_audit):
+    srv = _start_server()
+    port = srv.getsockname()[1]
+    try:
+        with rpc_client.RpcPool("127.0.0.1", port, size=2) as pool:
+            res = pool.call("unlock_trunk", timeout_s=5)
+        assert res["status"]["code"] == "ERR"
+    finally:
+        srv.close()
+
+
+def test_async_server_runs_requests_concurrently(rpc_audit):
+    import asyncio
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.new_event_loop()
+    runner = threading.Thread(target=loop.run_forever, daemon=True)
+    runner.start()
+    executor = ThreadPoolExecutor(max_workers=8)
+    srv = asyncio.run_coroutine_threadsafe(
+        rpc_server.start_async_server("127.0.0.1", 0, executor), loop).result(5)
+    port = srv.sockets[0].getsockname()[1]
+    try:
+        with rpc_client.RpcClient("127.0.0.1", port) as client:
+            started = time.monotonic()
+            futures = [client.submit("lock") for _ in range(8)]
+            results = [f.result(timeout=5) for f in futures]
+            elapsed = time.monotonic() - started
+        assert all(r["success"] for r in results)
+        # lock allows 4 at a time: two 50 ms waves, not eight serial sleeps
+        assert elapsed < 8 * 0.05
+    finally:
+        loop.call_soon_threadsafe(srv.close)
+        loop.call_soon_threadsafe(loop.stop)
+        runner.join(5)  # nothing may touch the audit writer once the fixture closes it
+        executor.shutdown(wait=False)
+
+
+def test_expired_and_hopeless_requests_are_rejected_without_running(monkeypatch):
+    import time
+
+    calls = []
+    reg = rpc_server.MethodRegistry()
+    reg.register("lights", lambda req: calls.append(req) or {"status": {"code": "OK"}})
+    monkeypatch.setattr(rpc_server, "registry", reg)
+    now = rpc_server.epoch_ms()
+
+    res = rpc_server.handle_request({"method": "lights", "ts_ms": now - 5000, "ttl_ms": 3000})
+    assert res["status"]["code"] == "DEADLINE_EXCEEDED" and not calls
+
+    assert rpc_server.handle_request({"method": "lights", "ts_ms": now, "ttl_ms": 3000})["status"]["code"] == "OK"
+    assert rpc_server.handle_request({"method": "lights", "ts_ms": "x", "ttl_ms": 3000})["status"]["code"] == "OK"
+    m = reg.get("lights")
+    m.latency_s = 0.5  # measured: 500 ms per call, 4 at a time
+    ahead = 8          # three waves -> 1.5 s, past a 1 s budget
+    assert rpc_server.admission(m, now + 1000, now, ahead, 0)["status"]["code"] == "RESOURCE_EXHAUSTED"
+    assert rpc_server.admission(m, now + 2000, now, ahead, 0) is None
+    assert rpc_server.admission(m, None, now, ahead, 0) is None  # no deadline: nothing to miss
+    assert len(calls) == 2
+
+
+def test_async_scheduler_runs_by_priority_then_deadline(monkeypatch):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    order = []
+
+    def handler(name):
+        async def run(req):
+            order.append(req["tag"])
+            await asyncio.sleep(0.05)
+            return {"status": {"code": "OK"}}
+        return run
+
+    reg = rpc_server.MethodRegistry()
+    reg.register("lock", handler("lock"), blocking=False, priority=rpc_server.PRIORITY_SAFETY)
+    reg.register("lights", handler("lights"), blocking=False, priority=rpc_server.PRIORITY_COSMETIC)
+    monkeypatch.setattr(rpc_server, "registry", reg)
+    monkeypatch.setattr(rpc_server, "scheduler", rpc_server.Scheduler(capacity=1))
+
+    async def main():
+        now = rpc_server.epoch_ms()
+        reqs = [
+            {"method": "lights", "tag": "first"},                                   # runs at once
+            {"method": "lights", "tag": "late", "ts_ms": now, "ttl_ms": 3000},
+            {"method": "lights", "tag": "soon", "ts_ms": now, "ttl_ms": 2000},
+            {"method": "lock", "tag": "lock", "ts_ms": now, "ttl_ms": 3000},        # safety jumps the queue
+            {"method": "lights", "tag": "dropped", "ts_ms": now, "ttl_ms": 20},     # expires while queued
+        ]
+        with ThreadPoolExecutor(1) as executor:
+            tasks = []
+            for r in reqs:
+                tasks.append(asyncio.ensure_future(rpc_server.handle_request_async(r, executor)))
+                await asyncio.sleep(0)
+            return await asyncio.gather(*tasks)
+
+    results = asyncio.run(main())
+    assert order == ["first", "lock", "soon", "late"]
+    assert [r["status"]["code"] for r in results] == ["OK"] * 4 + ["DEADLINE_EXCEEDED"]
+    assert rpc_server.scheduler.running == 0 and len(rpc_server.scheduler) == 0
+
+
+def test_timed_out_call_does_not_stay_in_flight():
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+    conns = []
+
+    def accept_silently():
+        while True:
+            try:
+                conns.append(srv.accept()[0])  # read nothing, answer nothing
+            except OSError:
+                return
+
+    threading.Thread(target=accept_silently, daemon=True).start()
+    try:
+        with rpc_client.RpcPool("127.0.0.1", srv.getsockname()[1], size=2) as pool:
+            for _ in range(3):
+                with pytest.raises(TimeoutError):
+                    pool.call("lock", timeout_s=0.05)
+            assert len(pool._clients) == 1 and pool._clients[0].in_flight == 0
+    finally:
+        srv.close()
+        for c in conns:
+            c.close()
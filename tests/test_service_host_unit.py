@@ -0,0 +1,89 @@
+"""
+Unit tests for the single-process service host and ready-gated process launch.
+"""
+
+import asyncio
+import json
+import socket
+import sys
+import time
+
+import pytest
+
+import alert_service
+import codec
+import rpc_client
+import rpc_server
+import sub_telemetry
+from service_host import ServiceHost, TopicBus, start_service
+
+
+def test_bus_delivers_each_handler_its_matching_messages_as_one_batch():
+    bus, speed, everything = TopicBus(), [], []
+    bus.subscribe("up://*/vehicle.telemetry/speed?v=1", speed.append)
+    bus.subscribe("up://car-01/vehicle.telemetry/*", everything.append)
+    msgs = [{"target": "up://car-01/vehicle.telemetry/speed?v=1", "n": 1},
+            {"target": "up://car-02/vehicle.telemetry/speed?v=1", "n": 2},
+            {"target": "up://car-01/vehicle.telemetry/rpm?v=1", "n": 3},
+            {"target": "not a uri", "n": 4}]
+    bus.publish(msgs)
+    assert [[m["n"] for m in b] for b in speed] == [[1, 2]]
+    assert [[m["n"] for m in b] for b in everything] == [[1, 3]]
+    assert bus.stats == {"published": 4, "delivered": 4, "unrouted": 1, "errors": 0}
+
+
+def test_host_feeds_plugins_from_one_ingress_and_serves_rpc(monkeypatch, rpc_audit):
+    alerts = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    alerts.bind(("127.0.0.1", 0))
+    alerts.settimeout(2)
+    monkeypatch.setattr(alert_service, "OUT_PORT", alerts.getsockname()[1])
+    monkeypatch.setattr(rpc_server, "PORT", 0)
+    monkeypatch.setattr(sub_telemetry.EVENTS, "value", 0)  # restored: other tests read this registry
+
+    async def main():
+        host = ServiceHost(["sub", "alert", "rpc"], port=0)
+        await host.start()
+        try:
+            loop = asyncio.get_running_loop()
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as pub:
+                pub.settimeout(2)
+                evt = {"type": "EVENT", "id": "0190a1b2-c3d4-8e5f-a6b7-c8d9e0f1a2b3", "qos": 1,
+                       "source": "up://car-01/vehicle.telemetry/publisher?v=1",
+                       "target": "up://car-01/vehicle.telemetry/speed?v=1",
+                       "content_type": codec.CT_BINARY, "payload": {"kmh": 150}}
+                pub.sendto(codec.encode(evt), ("127.0.0.1", host.port))
+                ack = await loop.run_in_executor(None, pub.recv, 2048)
+                alert = await loop.run_in_executor(None, alerts.recv, 65535)
+            rpc_port = host.plugins[2].port
+
+            def call():
+                with rpc_client.RpcClient("127.0.0.1", rpc_port) as client:
+                    return client.call("lock")
+            res = await loop.run_in_executor(None, call)
+            return json.loads(ack), json.loads(alert), res, dict(host.bus.stats)
+        finally:
+            await host.stop()
+
+    try:
+        ack, alert, res, stats = asyncio.run(main())
+    finally:
+        alerts.close()
+    assert ack["ids"] == ["0190a1b2-c3d4-8e5f-a6b7-c8d9e0f1a2b3"]
+    assert alert["type"] == "SPEED_ALERT" and res["success"]
+    assert sub_telemetry.EVENTS.value == 1  # decoded once, seen by both plugins
+    assert stats["published"] == 1 and stats["delivered"] == 2
+
+
+def test_start_service_returns_on_readiness_and_reports_early_exit():
+    ready = "import common, time; common.notify_ready('t'); time.sleep(30)"
+    started = time.monotonic()
+    proc = start_service([sys.executable, "-c", ready], cwd="demo")
+    try:
+        assert proc.poll() is None and time.monotonic() - started < 5
+    finally:
+        proc.kill()
+        proc.wait()
+    with pytest.raises(RuntimeError):
+        start_service([sys.executable, "-c", "raise SystemExit(3)"])
+    with pytest.raises(TimeoutError):
+        start_service([sys.executable, "-c", "import time; time.sleep(30)"], timeout_s=0.3)
@@ -0,0 +1,133 @@
+"""
+Unit tests for the sharded consumer: vehicle routing, QoS at the dispatcher,
+and stats that survive a rolling restart.
+"""
+
+import socket
+import threading
+import time
+import uuid
+
+import codec
+from bulk_io import BulkReceiver
+from shard import Dispatcher, Supervisor, shard_of
+
+
+def _udp(timeout=2.0):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    s.settimeout(timeout)
+    return s
+
+
+def _event(vehicle, kmh, content_type=codec.CT_JSON, qos=0):
+    return {"type": "EVENT", "id": str(uuid.uuid4()), "content_type": content_type, "qos": qos,
+            "source": f"up://{vehicle}/vehicle.telemetry/publisher?v=1",
+            "target": f"up://{vehicle}/vehicle.telemetry/speed?v=1",
+            "payload": {"kmh": kmh}, "ts_ms": int(time.time() * 1000), "ttl_ms": 5000}
+
+
+def _drain(sock):
+    rx, out = BulkReceiver(sock), []
+    sock.settimeout(0.2)
+    try:
+        while True:
+            out.extend(rx.recv_batch())
+    except socket.timeout:
+        return out
+
+
+def test_dispatcher_keeps_each_vehicle_on_one_shard_and_acks_qos1():
+    front, client = _udp(), _udp()
+    shards = [_udp(), _udp(), _udp()]
+    d = Dispatcher(front, len(shards))
+    for i, s in enumerate(shards):
+        d.route(i, s.getsockname()[1])
+    vehicles = [f"car-{i:02d}" for i in range(12)]
+    dup = _event("car-00", 1, codec.CT_BINARY, qos=1)
+    try:
+        for n in range(4):
+            for v in vehicles:
+                ct = codec.CT_BINARY if n % 2 else codec.CT_JSON
+                client.sendto(codec.encode(_event(v, n, ct)), front.getsockname())
+        client.sendto(codec.encode(dup), front.getsockname())
+        client.sendto(codec.encode(dup), front.getsockname())  # a retransmit
+        sent = 0
+        while sent < 4 * len(vehicles) + 1:
+            sent += d.dispatch_once()
+
+        seen = {}
+        for i, s in enumerate(shards):
+            for msg in _drain(s):
+                seen.setdefault(msg["source"].split("/")[2], set()).add(i)
+        assert sorted(seen) == vehicles
+        assert all(where == {shard_of(v, 3)} for v, where in seen.items())
+        assert len({shard_of(v, 3) for v in vehicles}) > 1
+        assert d.stats["duplicates"] == 1 and d.stats["acks"] >= 1
+        ack = codec.decode(client.recv(65535))
+        assert ack["type"] == "ACK" and dup["id"] in ack["ids"]
+    finally:
+        d.close(); client.close()
+        for s in shards:
+            s.close()
+
+
+def test_dispatcher_counts_malformed_messages_and_keeps_forwarding():
+    front, client, shard = _udp(), _udp(), _udp()
+    d = Dispatcher(front, 1)
+    d.route(0, shard.getsockname()[1])
+    try:
+        for raw in (b"[1,2]", b'{"source":["a"]}', b'{"qos":1,"id":["x"]}',
+                    b'{"qos":"1","id":"x"}', b'{"source":5}', b'{"ts_ms":"x","ttl_ms":5}'):
+            client.sendto(raw, front.getsockname())
+        client.sendto(codec.encode(_event("car-01", 7)), front.getsockname())
+        sent = 0
+        while sent < 1:
+            sent += d.dispatch_once()
+        assert d.stats["errors"] == 6
+        assert [m["payload"]["kmh"] for m in _drain(shard)] == [7]
+    finally:
+        d.close(); client.close(); shard.close()
+
+
+def _wait_for(fn, timeout_s=10.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if fn():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_supervisor_aggregates_stats_across_a_rolling_restart(monkeypatch):
+    import shard
+    monkeypatch.setattr(shard, "STATS_S", 0.1)
+    sup = Supervisor("sub", workers=2, mode="hash", host="127.0.0.1", port=0)
+    client = _udp()
+    events = lambda: sup.stats.snapshot()["counters"].get("sub.events", 0)
+
+    def send(n):
+        for i in range(n):
+            client.sendto(codec.encode(_event(f"car-{i % 8:02d}", i)), ("127.0.0.1", sup.port))
+            if i % 50 == 49:
+                time.sleep(0.01)  # stay well inside the loopback socket buffers
+
+    with sup:
+        watcher = threading.Thread(target=sup.watch, daemon=True)
+        watcher.start()
+        try:
+            old_pids = {w.proc.pid for w in sup.workers}
+            send(200)
+            assert _wait_for(lambda: events() == 200)
+            assert sum(1 for s in sup.stats.snapshot()["shards"] if s["counters"].get("sub.events")) == 2
+
+            sup.restart_all()
+            assert _wait_for(lambda: sup.restarts == 2)
+            assert not old_pids & {w.proc.pid for w in sup.workers}
+            assert events() == 200  # the retired workers' totals are kept
+            send(100)
+            assert _wait_for(lambda: events() == 300)
+        finally:
+            sup.stop()
+            watcher.join(5)
+            client.close()
@@ -0,0 +1,113 @@
+"""
+Unit tests for the shared-memory ring transport.
+"""
+
+import itertools
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import codec
+import shm_transport
+from bulk_io import BatchSender, BulkReceiver
+from shm_transport import ShmReader, ShmWriter
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def channel():
+    name = f"updemo-test-{os.getpid()}-{next(_names)}"
+    yield name
+    shm_transport.unlink(name)
+
+
+def _event(i):
+    return {"type": "EVENT", "id": f"id-{i}", "source": "up://car-01/vehicle.telemetry/publisher?v=1",
+            "content_type": codec.CT_BINARY, "payload": {"kmh": i}}
+
+
+def test_every_reader_gets_every_message_without_copies(channel):
+    writer = ShmWriter(channel, capacity=1 << 16)
+    readers = [ShmReader(channel, timeout_s=1), ShmReader(channel, timeout_s=1)]
+    try:
+        for i in range(100):
+            writer.send(b"msg-%d" % i)
+        for r in readers:
+            views = r.recv_views()
+            assert [bytes(v) for v in views] == [b"msg-%d" % i for i in range(100)]
+            assert views[0].obj is not None and r.intact()  # a view into the segment itself
+        # batched envelopes through the usual receive helpers
+        sender = shm_transport.ShmSender.__new__(shm_transport.ShmSender)
+        sender.writers = {0: writer}
+        out = BatchSender(sender, ("127.0.0.1", 0), max_bytes=4096)
+        for i in range(50):
+            out.send(_event(i))
+        out.flush()
+        got = []
+        rx = BulkReceiver(readers[0])
+        while len(got) < 50:
+            got += rx.recv_batch()
+        assert [m["payload"]["kmh"] for m in got] == list(range(50))
+    finally:
+        for r in readers:
+            r.close()
+        writer.close()
+
+
+def test_lapped_reader_counts_an_overrun_and_skips_ahead(channel):
+    writer = ShmWriter(channel, capacity=4096)
+    reader = ShmReader(channel, timeout_s=0.2)
+    try:
+        for i in range(1000):  # ~16 KB through a 4 KB ring
+            writer.send(b"x" * 8)
+        with pytest.raises(socket.timeout):
+            reader.recv_views()  # skipped to the newest position: nothing left to read
+        assert reader.stats["overruns"] == 1 and reader.stats["lost_bytes"] > 0
+
+        writer.send(b"kept")
+        views = reader.recv_views()
+        assert [bytes(v) for v in views] == [b"kept"] and reader.intact()
+        for i in range(600):
+            writer.send(b"y" * 8)
+        assert not reader.intact()  # the view above may have been overwritten
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_torn_record_length_resyncs_instead_of_running_past_the_producer(channel):
+    writer = ShmWriter(channel, capacity=4096)
+    reader = ShmReader(channel, timeout_s=0.2)
+    try:
+        start = reader._pos
+        writer.send(b"first")
+        # what a reader sees when the producer rewrites the length under it
+        shm_transport.REC_LEN.pack_into(writer.ring.data, start % writer.capacity, 3_000_000_000)
+        with pytest.raises(socket.timeout):
+            reader.recv_views()
+        assert reader._pos == writer.ring.write_pos.value and reader.stats["overruns"] == 1
+        writer.send(b"next")
+        assert [bytes(v) for v in reader.recv_views()] == [b"next"]
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_blocked_reader_wakes_on_publish_and_producer_is_exclusive(channel):
+    writer = ShmWriter(channel, capacity=1 << 16)
+    reader = ShmReader(channel, timeout_s=2)
+    try:
+        with pytest.raises(RuntimeError):
+            ShmWriter(channel)
+        threading.Timer(0.2, writer.send, args=(b"wake",)).start()
+        started = time.monotonic()
+        views = reader.recv_views()
+        assert bytes(views[0]) == b"wake"
+        assert time.monotonic() - started < 0.2 + shm_transport.MAX_WAIT_S
+    finally:
+        reader.close()
+        writer.close()
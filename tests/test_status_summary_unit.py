@@ -0,0 +1,58 @@
+"""
+Unit tests for the event-driven status summary.
+"""
+
+import threading
+import time
+
+from status_summary import SummaryState, run_publisher
+
+
+def _run(summary, min_interval_s, heartbeat_s):
+    out, stop = [], threading.Event()
+    t = threading.Thread(target=run_publisher, args=(summary, out.append, min_interval_s, heartbeat_s, stop),
+                         daemon=True)
+    t.start()
+    return out, stop, t
+
+
+def test_small_speed_changes_are_not_deltas():
+    s = SummaryState(speed_delta=2)
+    assert s.update("car-01", speed_kmh=50)
+    assert not s.update("car-01", speed_kmh=51)
+    assert s.update("car-01", speed_kmh=53)
+    assert not s.update("car-01", locked=None)
+    assert s.take_delta() == {"car-01": {"speed_kmh": 53}}
+
+
+def test_deltas_are_coalesced_and_heartbeat_carries_full_state():
+    s = SummaryState(speed_delta=1)
+    out, stop, t = _run(s, min_interval_s=0.2, heartbeat_s=0.6)
+    try:
+        time.sleep(0.05)  # first heartbeat goes out immediately
+        for kmh in range(60, 70):
+            s.update("car-01", speed_kmh=kmh)
+        s.update("car-02", locked=True, last_lock_ts=1)
+        time.sleep(0.8)
+    finally:
+        stop.set()
+        t.join(2)
+    kinds = [m["type"] for m in out]
+    assert kinds[0] == "VEHICLE_STATUS_SUMMARY"
+    deltas = [m for m in out if m["type"] == "VEHICLE_STATUS_DELTA"]
+    assert len(deltas) == 1  # ten speed changes and a lock, one message
+    assert deltas[0]["vehicles"] == {"car-01": {"speed_kmh": 69}, "car-02": {"locked": True, "last_lock_ts": 1}}
+    beat = [m for m in out if m["type"] == "VEHICLE_STATUS_SUMMARY"][-1]
+    assert beat["vehicles"]["car-01"]["speed_kmh"] == 69
+    assert beat["speed_kmh"] == 69  # single-vehicle fields for existing consumers
+
+
+def test_non_numeric_speed_is_ignored(monkeypatch):
+    import status_summary
+
+    s = SummaryState(speed_delta=2)
+    monkeypatch.setattr(status_summary, "state", s)
+    src = "up://car-01/vehicle.telemetry/publisher?v=1"
+    for payload in ({"kmh": 50}, {"kmh": "fast"}, {"kmh": True}, [1], {"kmh": 60}):
+        status_summary.on_speed({"source": src, "payload": payload})
+    assert s.vehicles["car-01"]["speed_kmh"] == 60
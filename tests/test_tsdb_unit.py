@@ -0,0 +1,87 @@
+"""
+Unit tests for the telemetry time-series store.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from tsdb import TelemetryStore, to_rows  # noqa: E402
+
+T0 = 1_700_002_800_000  # on an hour boundary
+
+
+def _fill(root, n=7200, step_ms=500, segment_rows=1024):
+    store = TelemetryStore(root, segment_rows=segment_rows)
+    ts = T0 + np.arange(n) * step_ms
+    values = (np.arange(n) % 100).astype(float)
+    for i in range(0, n, 333):  # several appends, several segments
+        store.append("car-01", "speed", ts[i:i + 333], values[i:i + 333])
+    store.flush()
+    return store, ts, values
+
+
+def test_rollups_match_raw_aggregates(tmp_path):
+    store, ts, values = _fill(tmp_path)
+    one_hour = store.query("car-01", "speed", T0, T0 + 3_600_000, resolution_ms=3_600_000)
+    assert one_hour["level"] == "1h"
+    assert one_hour["count"].tolist() == [7200]
+    assert one_hour["mean"][0] == pytest.approx(values.mean())
+    assert (one_hour["min"][0], one_hour["max"][0]) == (0.0, 99.0)
+
+    minutes = store.query("car-01", "speed", T0, T0 + 600_000, max_points=10)
+    assert minutes["level"] == "1m" and len(minutes["ts"]) == 10
+    assert minutes["mean"][0] == pytest.approx(values[:120].mean())
+
+    raw = store.query("car-01", "speed", T0, T0 + 5_000, max_points=1000)
+    assert raw["level"] == "raw" and raw["count"].sum() == 10
+
+
+def test_reader_sees_writer_data_and_late_samples_merge(tmp_path):
+    store, _, _ = _fill(tmp_path, n=100)
+    reader = TelemetryStore(tmp_path, readonly=True)
+    assert reader.keys() == [("car-01", "speed")]
+    before = reader.query("car-01", "speed", T0, T0 + 1000, resolution_ms=1000)["count"][0]
+
+    store.append("car-01", "speed", [T0 + 1], [500.0])  # late, into an existing 1s bucket
+    after = reader.query("car-01", "speed", T0, T0 + 1000, resolution_ms=1000)
+    assert after["count"][0] == before + 1 and after["max"][0] == 500.0
+
+
+def test_late_sample_without_a_bucket_still_reaches_the_rollups(tmp_path):
+    store = TelemetryStore(tmp_path, segment_rows=1024)
+    store.append("car-01", "speed", [T0 + 10_000, T0 + 120_000], [1.0, 2.0])
+    store.append("car-01", "speed", [T0 + 60_500, T0 + 60_700], [7.0, 9.0])  # late, in empty 1s/1m buckets
+    store.append("car-01", "speed", [T0 + 120_500, T0 + 60_900], [3.0, 5.0])  # open bucket, and late again
+    for resolution in (1, 1_000, 60_000, 3_600_000):  # raw and every rollup agree
+        rows = to_rows(store.query("car-01", "speed", T0, T0 + 3_600_000, resolution_ms=resolution))
+        assert sum(r["count"] for r in rows) == 6
+        assert sum(r["mean"] * r["count"] for r in rows) == pytest.approx(27.0)
+    minutes = to_rows(store.query("car-01", "speed", T0, T0 + 180_000, resolution_ms=60_000))
+    assert [(r["ts"] - T0, r["count"], r["max"]) for r in minutes] == [(0, 1, 1.0), (60_000, 3, 9.0), (120_000, 2, 3.0)]
+    seconds = to_rows(store.query("car-01", "speed", T0 + 60_000, T0 + 61_000, resolution_ms=1_000))
+    assert seconds == [{"ts": T0 + 60_000, "min": 5.0, "max": 9.0, "mean": 7.0, "count": 3}]
+    assert store.series("car-01", "speed").late > 0
+
+
+def test_ingest_skips_garbage_payloads(tmp_path):
+    store = TelemetryStore(tmp_path)
+    target = "up://car-01/vehicle.telemetry/speed?v=1"
+    n = store.ingest([{"target": target, "payload": {"kmh": "fast"}},
+                      {"target": target, "payload": {"kmh": 1, "timestamp_ms": "x"}},
+                      {"target": target, "payload": [1]},
+                      {"target": target, "payload": {"kmh": 2, "timestamp_ms": T0}}])
+    assert n == 1 and store.skipped == 3
+
+
+def test_ingest_events_by_vehicle_and_topic(tmp_path):
+    store = TelemetryStore(tmp_path)
+    n = store.ingest([
+        {"target": "up://car-01/vehicle.telemetry/speed?v=1", "payload": {"kmh": 90, "timestamp_ms": T0}},
+        {"target": "up://car-02/vehicle.telemetry/rpm?v=1", "payload": {"value": 3000, "timestamp_ms": T0}},
+        {"target": "not a uri", "payload": {"kmh": 1}},
+    ])
+    assert n == 2
+    assert store.keys() == [("car-01", "speed"), ("car-02", "rpm")]
+    rows = to_rows(store.query("car-02", "rpm", T0, T0 + 1000))
+    assert rows == [{"ts": T0, "min": 3000.0, "max": 3000.0, "mean": 3000.0, "count": 1}]
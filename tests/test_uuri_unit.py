@@ -0,0 +1,64 @@
+"""
+Unit tests for UUri parsing/interning and wildcard topic matching.
+"""
+
+import pytest
+
+import uuri
+from uuri import InternTable, TopicTrie
+
+
+def test_parse_interns_and_formats():
+    table = InternTable(maxsize=2)
+    a = table.parse("up://car-01/vehicle.telemetry/speed?v=1")
+    assert a is table.parse("up://car-01/vehicle.telemetry/speed?v=1")
+    assert (a.authority, a.ue_id, a.resource, a.version) == ("car-01", "vehicle.telemetry", "/speed", 1)
+    assert str(a) == "up://car-01/vehicle.telemetry/speed?v=1"
+    assert a == "up://car-01/vehicle.telemetry/speed?v=1"
+    assert {str(a): 1}[a] == 1
+    table.parse("up://car-02/x/y?v=1")
+    table.parse("up://car-03/x/y?v=1")
+    assert len(table) == 2  # bounded LRU
+    with pytest.raises(ValueError):
+        table.parse("http://car-01/x")
+
+
+def test_table_is_thread_safe_and_reuses_evicted_ids():
+    import threading
+
+    table = InternTable(maxsize=8)
+    errors = []
+
+    def churn(k):
+        try:
+            for i in range(3000):
+                table.parse(f"up://car-{(i * 7 + k) % 20}/x/y?v=1")
+        except Exception as e:  # noqa: BLE001 - surfaced below
+            errors.append(e)
+
+    threads = [threading.Thread(target=churn, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and len(table) == 8
+    assert max(u.id for u in table._by_str.values()) <= 9
+    assert len({u.id for u in table._by_str.values()}) == 8
+
+
+def test_builder_matches_the_old_fstring_format():
+    assert str(uuri.uuri("car-01", "body.control", "/doors/lock")) == "up://car-01/body.control/doors/lock?v=1"
+
+
+def test_trie_wildcards():
+    trie = TopicTrie()
+    trie.add("up://car-01/vehicle.telemetry/*", "car1-telemetry")
+    trie.add("up://*/vehicle.telemetry/speed?v=1", "all-speed")
+    trie.add("up://car-01/vehicle.telemetry/speed?v=1", "exact")
+    assert trie.match("up://car-01/vehicle.telemetry/speed?v=1") == {"car1-telemetry", "all-speed", "exact"}
+    assert trie.match("up://car-02/vehicle.telemetry/speed?v=1") == {"all-speed"}
+    assert trie.match("up://car-01/vehicle.telemetry/rpm?v=1") == {"car1-telemetry"}
+    assert trie.match("up://car-01/body.control/doors/lock?v=1") == set()
+    trie.remove("up://*/vehicle.telemetry/speed?v=1", "all-speed")
+    assert trie.match("up://car-02/vehicle.telemetry/speed?v=1") == set()
+    assert set(trie.values()) == {"car1-telemetry", "exact"}